@@ -1,19 +1,98 @@
+import mmap
+import multiprocessing
 import os
+import shutil
+import struct
 import subprocess
 import sys
-from tempfile import NamedTemporaryFile
+import tempfile
+import threading
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
+from enum import Enum
 
 from werkzeug.utils import safe_join
 
 from adfotg import storage
+from adfotg.amitools.fs import DosType
+from adfotg.amitools.fs.ADFSVolume import ADFSVolume
+from adfotg.amitools.fs.FSError import FSError
+from adfotg.amitools.fs.FSString import FSString
+from adfotg.amitools.fs.blkdev.ADFBlockDevice import ADFBlockDevice
 from adfotg.config import config
 from adfotg.error import ActionError, AdfotgError
+from adfotg.jobs import JobCancelled
+from adfotg.util import Interpretable
 
 
 ADF_SIZE = 901120
+ADF_HD_SIZE = 2 * ADF_SIZE
+# "DOS" and the file-system type byte.
+DOS_MAGIC_SIZE = 4
 
 MAX_FFS_FILENAME = 30
 
+BLOCK_SIZE = 512
+_T_HEADER = 2
+_ST_ROOT = 1
+_ROOT_NAME_OFFSET = 432
+
+
+class AdfBuilder(Interpretable, Enum):
+    '''How the ADF images are built.
+
+    NATIVE builds the image in-process with amitools, XDFTOOL runs
+    the adfotg-xdftool program in a subprocess.
+    '''
+    NATIVE = "native"
+    XDFTOOL = "xdftool"
+
+
+class MappedSource:
+    '''Read-only memory map of a file from which the ADF contents
+    are sliced without copying them.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._mmap = None
+        self._view = None
+        self._file = open(path, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size > 0:
+                self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+            else:
+                # Empty files cannot be mmapped.
+                self._view = memoryview(b'')
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self._view)
+
+    def slice(self, start=None, length=None):
+        start = start or 0
+        if length is None:
+            return self._view[start:]
+        return self._view[start:start + length]
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Some slice is still referenced; the map will be
+                # released together with it.
+                pass
+            self._mmap = None
+        self._file.close()
+
 
 class FileUploadOp:
     def __init__(self, source, pos=None, rename=None):
@@ -21,6 +100,9 @@ class FileUploadOp:
         self._pos = pos
         self._rename = rename
 
+        self._mapped = None
+        self._owns_mapped = False
+        self._data = None
         self._tempfile = None
 
     @classmethod
@@ -47,29 +129,49 @@ class FileUploadOp:
         else:
             return start, length
 
-    def open(self):
+    def open(self, sources=None):
+        '''Map the source file for reading.
+
+        sources -- optional dict of MappedSource objects keyed by path,
+          shared between several ops. The source is looked up in it
+          and added to it if not found. The caller is then responsible
+          for closing the MappedSources.
+        '''
+        if sources is None:
+            self._mapped = MappedSource(self._source)
+            self._owns_mapped = True
+        else:
+            if self._source not in sources:
+                sources[self._source] = MappedSource(self._source)
+            self._mapped = sources[self._source]
         if self._pos is not None:
-            self._tempfile = NamedTemporaryFile()
-            start, length = self._pos
-            with open(self._source, 'rb') as fsrc:
-                if start is not None:
-                    fsrc.seek(start)
-                if length is not None:
-                    data = fsrc.read(length)
-                else:
-                    data = fsrc.read()
-                if not data:
-                    raise AdfotgError("read less data than requested "
-                                      "from '{}'".format(self._source))
-                self._tempfile.write(data)
-                self._tempfile.flush()
+            self._data = self._mapped.slice(*self._pos)
+            if not self._data:
+                raise AdfotgError("read less data than requested "
+                                  "from '{}'".format(self._source))
+        else:
+            self._data = self._mapped.slice()
 
     def close(self):
+        if self._data is not None:
+            self._data.release()
+            self._data = None
+        if self._mapped is not None:
+            if self._owns_mapped:
+                self._mapped.close()
+            self._mapped = None
+            self._owns_mapped = False
         if self._tempfile is not None:
             self._tempfile.close()
             self._tempfile = None
 
     def command(self):
+        if self._pos is not None and self._tempfile is None:
+            # xdftool can only read whole files, so the slice
+            # must be spilled to disk.
+            self._tempfile = tempfile.NamedTemporaryFile()
+            self._tempfile.write(self._data)
+            self._tempfile.flush()
         cmd = [
             'write',
             self._sys_name,
@@ -77,6 +179,19 @@ class FileUploadOp:
         ]
         return cmd
 
+    def spec(self):
+        '''Returns: the arguments that make the same op again.'''
+        return self._source, self._pos, self._rename
+
+    @property
+    def size(self):
+        '''Number of bytes to write; known only when opened.'''
+        return len(self._data) if self._data is not None else 0
+
+    def write(self, volume):
+        '''Write the file to an opened ADFSVolume.'''
+        volume.write_file(self._data, FSString(self._adf_name))
+
     def validate(self):
         if len(self._adf_name) > MAX_FFS_FILENAME:
             raise ActionError(
@@ -104,42 +219,288 @@ def is_adf_path(filepath):
     # Is there a better way to do this?
     return (os.path.isfile(filepath) and
             os.path.getsize(filepath) and
-            filepath.lower().endswith(".adf"))
+            is_adf_name(filepath))
+
+
+def is_adf_name(filename):
+    return filename.lower().endswith(".adf")
+
+
+def is_dos_boot_block(head):
+    '''Does the data start with the boot block of an AmigaDOS disk?
+    The first DOS_MAGIC_SIZE bytes are enough to tell.
+    '''
+    return (len(head) >= DOS_MAGIC_SIZE and head[:3] == b"DOS"
+            and head[3] <= 7)
+
+
+def root_block_offset(size):
+    '''Returns: the offset of the root block in an ADF of this size,
+    or None if it's not a standard ADF size.
+    '''
+    if size == ADF_SIZE:
+        return 880 * BLOCK_SIZE
+    elif size == ADF_HD_SIZE:
+        return 1760 * BLOCK_SIZE
+    return None
+
+
+def read_label(root_block):
+    '''Read the disk label from the root block of an AmigaDOS disk.
+
+    Returns: the label or None if this is not a valid root block.
+    '''
+    if len(root_block) != BLOCK_SIZE:
+        return None
+    longs = struct.unpack(">128I", root_block)
+    if (longs[0] != _T_HEADER or longs[127] != _ST_ROOT
+            or sum(longs) & 0xFFFFFFFF != 0):
+        return None
+    length = min(root_block[_ROOT_NAME_OFFSET], MAX_FFS_FILENAME)
+    start = _ROOT_NAME_OFFSET + 1
+    return root_block[start:start + length].decode("latin-1")
+
+
+def create_adf(adf_path, label, file_ops, builder=None, progress=None):
+    '''Create a new FFS-formatted ADF with the label and the files
+    written by the file_ops.
+
+    builder -- an AdfBuilder; defaults to the configured 'adf_builder'
+    progress -- optional progress(done, total) callback, called with
+      the number of bytes of the files written so far
+    '''
+    builder = AdfBuilder.interpret(builder or config.adf_builder)
+    try:
+        for file_op in file_ops:
+            # TODO Creating this in the caller but opening it here
+            # breaks the RAII rule.
+            file_op.open()
+        _build_adf(builder, adf_path, label, file_ops,
+                   _Progress(progress, file_ops))
+    finally:
+        for file_op in file_ops:
+            file_op.close()
+
 
+def create_adfs(disks, builder=None, progress=None):
+    '''Create a set of ADFs at once; either all of them or none.
 
-def create_adf(adf_path, label, file_ops):
+    disks -- list of (adf_path, label, file_ops) tuples; all ADFs
+      must be created in the same directory
+    builder -- an AdfBuilder; defaults to the configured 'adf_builder'
+    progress -- optional progress(done, total) callback, called with
+      the number of bytes of the files written to all ADFs so far
+
+    The ADFs are built by a pool of workers, one per CPU. The native
+    builder is pure Python, so with more than one CPU its workers are
+    processes, each of which maps the source files again; the progress
+    is then reported as each ADF is finished. Otherwise the workers
+    are threads, which for the xdftool builder wait for its processes,
+    and each source file is opened only once for the whole set, even
+    if it's split over several ADFs. The ADFs are built in a temporary
+    directory and are moved into their target directory only if all
+    of them were built successfully.
+
+    Returns: a list of (code, adf_name, error) tuples, one for each
+    disk and in the same order. Code is 200 and error is empty for
+    a created ADF. If any ADF has failed, all ADFs are discarded and
+    the ADFs that were built successfully are reported with code 424.
+    '''
+    builder = AdfBuilder.interpret(builder or config.adf_builder)
+    if not disks:
+        return []
+    adf_dir = os.path.dirname(disks[0][0])
+    if any(os.path.dirname(adf_path) != adf_dir for adf_path, _, _ in disks):
+        raise ValueError("all ADFs must be created in the same directory")
+    started = time.monotonic()
+    sources = {}
+    build_dir = tempfile.mkdtemp(prefix=".batch-", dir=adf_dir)
+    try:
+        for _, _, file_ops in disks:
+            for file_op in file_ops:
+                file_op.open(sources)
+        advance = _Progress(progress, [file_op for _, _, file_ops in disks
+                                       for file_op in file_ops])
+        builds = [(os.path.join(build_dir, os.path.basename(adf_path)),
+                   label, file_ops)
+                  for adf_path, label, file_ops in disks]
+        workers = min(len(disks), os.cpu_count() or 1)
+        if builder == AdfBuilder.NATIVE and workers > 1:
+            errors = _build_in_processes(builds, workers, advance)
+        else:
+            errors = _build_in_threads(builder, builds, workers, advance)
+        for error in errors:
+            # Cancel the job instead of reporting the disks as failed.
+            if isinstance(error, JobCancelled):
+                raise error
+        if not any(errors):
+            _move_all([os.path.basename(adf_path) for adf_path, _, _ in disks],
+                      build_dir, adf_dir)
+    finally:
+        for _, _, file_ops in disks:
+            for file_op in file_ops:
+                file_op.close()
+        for source in sources.values():
+            source.close()
+        shutil.rmtree(build_dir, ignore_errors=True)
+    print("batch of {} ADFs {} in {:.3f}s".format(
+        len(disks), "failed" if any(errors) else "created",
+        time.monotonic() - started), file=sys.stderr)
+    results = []
+    for (adf_path, _, _), error in zip(disks, errors):
+        adf_name = os.path.basename(adf_path)
+        if error is None and not any(errors):
+            results.append((200, adf_name, ''))
+        elif error is None:
+            results.append((424, adf_name,
+                            "discarded because other ADFs have failed"))
+        else:
+            code = 400 if isinstance(error, ActionError) else 500
+            results.append((code, adf_name, str(error)))
+    return results
+
+
+def _build_in_threads(builder, builds, workers, advance):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_build_adf, builder, adf_path, label, file_ops,
+                        advance)
+            for adf_path, label, file_ops in builds
+        ]
+    return [future.exception() for future in futures]
+
+
+def _build_in_processes(builds, workers, advance):
+    # Forked from a clean process, not from this multithreaded one.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context) as pool:
+        futures = {
+            pool.submit(_build_native_adf, adf_path, label,
+                        [file_op.spec() for file_op in file_ops],
+                        config.adf_alloc_policy): file_ops
+            for adf_path, label, file_ops in builds
+        }
+        try:
+            for future in as_completed(futures):
+                advance(sum(file_op.size for file_op in futures[future]))
+        except JobCancelled:
+            pool.shutdown(cancel_futures=True)
+            raise
+    return [future.exception() for future in futures]
+
+
+def _build_native_adf(adf_path, label, file_specs, alloc_policy):
+    '''Build the ADF in a worker process.'''
+    file_ops = [FileUploadOp(*spec) for spec in file_specs]
+    try:
+        for file_op in file_ops:
+            file_op.open()
+        _build_adf(AdfBuilder.NATIVE, adf_path, label, file_ops,
+                   lambda nbytes: None, alloc_policy)
+    finally:
+        for file_op in file_ops:
+            file_op.close()
+
+
+def _move_all(names, src_dir, dst_dir):
+    moved = []
+    try:
+        for name in names:
+            dst_path = os.path.join(dst_dir, name)
+            if os.path.exists(dst_path):
+                raise ActionError("ADF '{}' already exists".format(name))
+            os.replace(os.path.join(src_dir, name), dst_path)
+            moved.append(dst_path)
+    except Exception:
+        for path in moved:
+            storage.unlink(path, optional=True)
+        raise
+
+
+class _Progress:
+    '''Sums up the bytes written by the file ops, possibly from
+    several threads, for a progress(done, total) callback.
+    '''
+    def __init__(self, progress, file_ops):
+        self._progress = progress
+        self._total = sum(file_op.size for file_op in file_ops)
+        self._done = 0
+        self._lock = threading.Lock()
+        if progress:
+            progress(0, self._total)
+
+    def __call__(self, nbytes):
+        if self._progress:
+            with self._lock:
+                self._done += nbytes
+                done = self._done
+            self._progress(done, self._total)
+
+
+def _build_adf(builder, adf_path, label, file_ops, advance,
+               alloc_policy=None):
     if not adf_path.lower().endswith(".adf"):
         raise ValueError("ADF filename must have .adf extension")
+    started = time.monotonic()
+    if builder == AdfBuilder.NATIVE:
+        _create_adf_native(adf_path, label, file_ops, advance,
+                           alloc_policy or config.adf_alloc_policy)
+    else:
+        _create_adf_xdftool(adf_path, label, file_ops)
+        advance(sum(file_op.size for file_op in file_ops))
+    print("created '{}' with {} builder in {:.3f}s".format(
+        adf_path, builder.value, time.monotonic() - started),
+        file=sys.stderr)
+
+
+def _create_adf_native(adf_path, label, file_ops, advance, alloc_policy):
+    # The whole image is built in memory and written only once
+    # when the block device is closed.
+    blkdev = ADFBlockDevice(adf_path)
+    blkdev.create()
+    volume = ADFSVolume(blkdev, alloc_policy)
+    try:
+        volume.create(FSString(label), dos_type=DosType.DOS_FFS)
+        for file_op in file_ops:
+            file_op.write(volume)
+            advance(file_op.size)
+        volume.close()
+    except (FSError, IOError) as e:
+        raise AdfotgError(str(e)) from e
+    try:
+        blkdev.close()
+    except Exception:
+        storage.unlink(adf_path, optional=True)
+        raise
+
+
+def _create_adf_xdftool(adf_path, label, file_ops):
     workdir = os.path.dirname(adf_path)
     adf_name = os.path.basename(adf_path)
     cmd_base = [
         'adfotg-xdftool', adf_name,
+        '--alloc-policy', config.adf_alloc_policy,
         'create', '+',
         'format', label, 'ffs',
     ]
     file_commands = []
-    try:
-        for file_op in file_ops:
-            # TODO Creating this in the caller but opening it here
-            # breaks the RAII rule.
-            file_op.open()
-            file_commands.append('+')
-            file_commands += file_op.command()
-        print("calling command", cmd_base + file_commands, file=sys.stderr)
-        env = dict(os.environ)
-        env['PYTHONIOENCODING'] = 'utf-8'
-        p = subprocess.Popen(
-            cmd_base + file_commands,
-            cwd=workdir, stdin=subprocess.DEVNULL, env=env,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, _ = p.communicate()
-        exitcode = p.wait()
-        if exitcode != 0:
-            storage.unlink(adf_path, optional=True)
-            raise AdfotgError(stdout)
-    finally:
-        for file_op in file_ops:
-            file_op.close()
+    for file_op in file_ops:
+        file_commands.append('+')
+        file_commands += file_op.command()
+    print("calling command", cmd_base + file_commands, file=sys.stderr)
+    env = dict(os.environ)
+    env['PYTHONIOENCODING'] = 'utf-8'
+    p = subprocess.Popen(
+        cmd_base + file_commands,
+        cwd=workdir, stdin=subprocess.DEVNULL, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = p.communicate()
+    exitcode = p.wait()
+    if exitcode != 0:
+        storage.unlink(adf_path, optional=True)
+        raise AdfotgError(stdout)
 
 
 def list_standard_adfs():
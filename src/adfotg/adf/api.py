@@ -3,8 +3,8 @@ import os
 from flask import jsonify, request, send_from_directory, Blueprint
 from werkzeug.utils import safe_join
 
-from adfotg import adf, storage
-from adfotg.apiutil import Listing, del_files
+from adfotg import adf
+from adfotg.apiutil import Listing, del_files, run_job
 from adfotg.config import config
 from adfotg.error import ActionError
 
@@ -38,11 +38,7 @@ def list_adfs():
     # TODO - recurse into subdirectories or support more ADF dirs than one.
     # Users could potentially store hundreds of those and pagination is required.
     listing = Listing(request)
-    full_list = storage.listdir(config.adf_dir, name_filter=listing.filter_name,
-                                sort=listing.sorting)
-    return jsonify(
-        listing=listing.limit(full_list),
-        total=len(full_list))
+    return listing.response(config.adf_dir)
 
 
 @api.route("/std", methods=["GET"])
@@ -94,7 +90,8 @@ def del_adf(name):
 def create_adf(name):
     '''Create ADF with contents from the upload zone.
 
-    This API requires xdftool.
+    The ADF is built in-process by default. The external xdftool
+    is required only if the 'xdftool' ADF builder is configured.
 
     There's a limitation of max. 30 characters on a filename
     and label length. If a source file exceeds this limitation,
@@ -124,6 +121,10 @@ def create_adf(name):
 
     - An empty list will result in empty but formatted ADF.
 
+    Query args:
+    - async -- optional; if 1, the ADF runs as a background job
+      and the response is 202 with the Job object, see GET /jobs/<id>
+
     Returns: nothing if successful
 
     Errors:
@@ -135,7 +136,7 @@ def create_adf(name):
       - if a filename exceeds the limit of 30 characters
       - if an invalid argument is specified for a file operation
 
-    - 500 can be returned if xdftool fails, even if that
+    - 500 can be returned if building the ADF fails, even if that
       failure was caused by the client preparing the operations
       incorrectly.
 
@@ -143,14 +144,76 @@ def create_adf(name):
     target_path = safe_join(config.adf_dir, name)
     if os.path.exists(target_path):
         raise ActionError("ADF '{}' already exists".format(name))
-    label = request.get_json().get("label")
+    args = request.get_json()
+    label = _validate_label(args.get("label"))
+    contents = args.get("contents", [])
+    file_ops = [adf.FileUploadOp.interpret_api(config.upload_dir, piece)
+                for piece in contents]
+    return run_job("create_adf", lambda progress: adf.create_adf(
+        target_path, label, file_ops, progress=progress))
+
+
+@api.route("/batch", methods=["POST"])
+def create_adfs():
+    '''Create a set of ADFs with contents from the upload zone.
+
+    This is the same as calling `POST /adf/image/<name>` once for each
+    disk, but all ADFs are built in one go and the source files are
+    read only once. This is the preferred way to create ADFs from
+    a file that is split over several disks.
+
+    The operation is atomic: either all ADFs are created, or none.
+
+    Body args:
+    - disks -- list of {name: string, label: string, contents: list}
+      objects. The fields have the same meaning as the URL and body
+      args of `POST /adf/image/<name>`.
+
+    Query args:
+    - async -- optional; if 1, the batch runs as a background job
+      and the response is 202 with the Job object, see GET /jobs/<id>
+
+    Returns: list of tuples which can be either: (200, name, '')
+    or (error_code, name, error). There are as many elements
+    in the returned list as there are disks in the request. If any
+    disk fails, the disks that would have been created successfully
+    are reported with the 424 error code.
+
+    Errors:
+
+    - 400
+      - if no disks are specified
+      - if any ADF already exists or the same name is used twice
+      - if any disk label or filename is invalid, as in
+        `POST /adf/image/<name>`
+    '''
+    disks_args = request.get_json().get("disks")
+    if not disks_args:
+        raise ActionError("no disks specified")
+    disks = []
+    names = set()
+    for disk_args in disks_args:
+        name = disk_args.get("name")
+        if not name:
+            raise ActionError("must specify ADF name")
+        if name.lower() in names:
+            raise ActionError("ADF '{}' is specified twice".format(name))
+        names.add(name.lower())
+        target_path = safe_join(config.adf_dir, name)
+        if os.path.exists(target_path):
+            raise ActionError("ADF '{}' already exists".format(name))
+        label = _validate_label(disk_args.get("label"))
+        file_ops = [adf.FileUploadOp.interpret_api(config.upload_dir, piece)
+                    for piece in disk_args.get("contents", [])]
+        disks.append((target_path, label, file_ops))
+    return run_job("create_adfs", lambda progress: adf.create_adfs(
+        disks, progress=progress), jsonify)
+
+
+def _validate_label(label):
     if not label:
         raise ActionError("must specify label")
     if len(label) > adf.MAX_FFS_FILENAME:
         raise ActionError("label length exceeds limit; max '{}', is '{}'".format(
             adf.MAX_FFS_FILENAME, len(label)))
-    contents = request.get_json().get("contents", [])
-    file_ops = [adf.FileUploadOp.interpret_api(config.upload_dir, piece)
-                for piece in contents]
-    adf.create_adf(target_path, label, file_ops)
-    return ''
+    return label
@@ -1,4 +1,5 @@
-import struct
+import array
+import sys
 
 from .block.BitmapBlock import BitmapBlock
 from .block.BitmapExtBlock import BitmapExtBlock
@@ -6,14 +7,32 @@ from .DosType import *
 from .FSError import *
 
 
+# block allocation policies
+# legacy: the first free blocks from the last allocation on, scattered or not
+ALLOC_LEGACY = "legacy"
+# first-fit: the first run of free blocks that is long enough
+ALLOC_FIRST_FIT = "first-fit"
+# best-fit: the shortest run of free blocks that is long enough
+ALLOC_BEST_FIT = "best-fit"
+ALLOC_POLICIES = (ALLOC_FIRST_FIT, ALLOC_BEST_FIT, ALLOC_LEGACY)
+
+
+def _popcount(val):
+    return bin(val).count("1")
+
+
 class ADFSBitmap:
-    def __init__(self, root_blk):
+    def __init__(self, root_blk, alloc_policy=ALLOC_FIRST_FIT):
+        if alloc_policy not in ALLOC_POLICIES:
+            raise ValueError("invalid allocation policy: %s" % alloc_policy)
         self.root_blk = root_blk
+        self.alloc_policy = alloc_policy
         self.blkdev = self.root_blk.blkdev
         # state
         self.ext_blks = []
         self.bitmap_blks = []
-        self.bitmap_data = None
+        # bitmap longs as ints, bit set = block is free
+        self.bitmap_words = None
         self.valid = False
         # bitmap block entries
         self.bitmap_blk_bytes = root_blk.blkdev.block_bytes - 4
@@ -27,6 +46,7 @@ class ADFSBitmap:
         if last_long_bits == 0:
             last_long_bits = 32
         self.bitmap_last_long_bits = last_long_bits
+        self.bitmap_last_long_mask = (1 << last_long_bits) - 1
         # number of blocks required for bitmap (and bytes consumed there)
         self.bitmap_num_blks = (
             self.bitmap_longs + self.bitmap_blk_longs - 1
@@ -51,7 +71,7 @@ class ADFSBitmap:
         self.num_used = 0
 
         # create data and preset with 0xff
-        self.bitmap_data = bytearray([0xFF] * self.bitmap_all_blk_bytes)
+        self._set_bitmap_data(bytearray([0xFF] * self.bitmap_all_blk_bytes))
 
         # clear bit for root block
         blk_pos = self.root_blk.blk_num
@@ -119,9 +139,10 @@ class ADFSBitmap:
 
     def _write_bitmap_blks(self):
         # write bitmap blocks
+        bitmap_data = self._get_bitmap_data()
         off = 0
         for blk in self.bitmap_blks:
-            blk.set_bitmap_data(self.bitmap_data[off : off + self.bitmap_blk_bytes])
+            blk.set_bitmap_data(bitmap_data[off : off + self.bitmap_blk_bytes])
             blk.write()
             off += self.bitmap_blk_bytes
 
@@ -179,64 +200,183 @@ class ADFSBitmap:
                 extra="got=%d want=%d" % (self.bitmap_num_blks, num_bm_blks),
             )
 
-        self.bitmap_data = bitmap_data
+        self._set_bitmap_data(bitmap_data)
         self.valid = True
 
+    def _set_bitmap_data(self, data):
+        words = array.array("I")
+        words.frombytes(bytes(data))
+        if sys.byteorder == "little":
+            words.byteswap()
+        self.bitmap_words = words
+
+    def _get_bitmap_data(self):
+        words = array.array("I", self.bitmap_words)
+        if sys.byteorder == "little":
+            words.byteswap()
+        return bytearray(words.tobytes())
+
+    def _get_free_int(self):
+        """Returns the whole bitmap as one int: bit n is set if the
+        block at reserved + n is free"""
+        words = self.bitmap_words[: self.bitmap_longs]
+        if sys.byteorder == "big":
+            words.byteswap()
+        free = int.from_bytes(words.tobytes(), "little")
+        return free & ((1 << self.bitmap_bits) - 1)
+
     def find_free(self):
         result = self.find_n_free(1)
         if result:
             return result[0]
 
     def find_n_free(self, num):
+        """Returns num free blocks, or None if there aren't that many.
+        Unless the allocation policy is legacy, a contiguous run of free
+        blocks is preferred; if there is none the first free blocks are
+        taken as they come."""
+        if num <= 0:
+            return []
+        result = None
+        if self.alloc_policy == ALLOC_FIRST_FIT:
+            result = self._find_run(num)
+        elif self.alloc_policy == ALLOC_BEST_FIT:
+            result = self._find_best_run(num)
+        if result is None:
+            result = self._find_scattered(num)
+        if result is not None:
+            # keep as start offset for the next time
+            self.find_start_off = (result[-1] - self.blkdev.reserved) // 32
+        return result
+
+    def _find_run(self, num):
+        # first fit from the start offset on, then from the beginning
+        first = self._find_run_from(num, self.find_start_off)
+        if first is None and self.find_start_off > 0:
+            first = self._find_run_from(num, 0)
+        if first is None:
+            return None
+        first += self.blkdev.reserved
+        return list(range(first, first + num))
+
+    def _find_best_run(self, num):
+        # the shortest run that fits, the first one of them on a tie
+        best_first = None
+        best_len = None
+        for first, length in self.get_free_runs():
+            if length >= num and (best_len is None or length < best_len):
+                best_first = first
+                best_len = length
+                if length == num:
+                    break
+        if best_first is None:
+            return None
+        return list(range(best_first, best_first + num))
+
+    def get_free_runs(self):
+        """Yields (first block, number of blocks) of each run of free
+        blocks, in block order"""
+        words = self.bitmap_words
+        last_long = self.bitmap_longs - 1
+        reserved = self.blkdev.reserved
+        run_start = 0
+        run_len = 0
+        for long_off in range(self.bitmap_longs):
+            val = words[long_off]
+            if val == 0xFFFFFFFF and long_off != last_long:
+                if run_len == 0:
+                    run_start = long_off * 32
+                run_len += 32
+                continue
+            if long_off == last_long:
+                val &= self.bitmap_last_long_mask
+            bit = 0
+            while val:
+                if val & 1:
+                    width = (~val & (val + 1)).bit_length() - 1
+                    if run_len == 0:
+                        run_start = long_off * 32 + bit
+                    run_len += width
+                else:
+                    width = (val & -val).bit_length() - 1
+                    if run_len:
+                        yield reserved + run_start, run_len
+                    run_len = 0
+                val >>= width
+                bit += width
+            if bit < 32 and run_len:
+                yield reserved + run_start, run_len
+                run_len = 0
+        if run_len:
+            yield reserved + run_start, run_len
+
+    def _find_run_from(self, num, start_long):
+        words = self.bitmap_words
+        last_long = self.bitmap_longs - 1
+        run_start = 0
+        run_len = 0
+        for long_off in range(start_long, self.bitmap_longs):
+            val = words[long_off]
+            if val == 0xFFFFFFFF and long_off != last_long:
+                if run_len == 0:
+                    run_start = long_off * 32
+                run_len += 32
+                if run_len >= num:
+                    return run_start
+                continue
+            if long_off == last_long:
+                val &= self.bitmap_last_long_mask
+            # walk the runs of set and clear bits in the long
+            bit = 0
+            while val:
+                if val & 1:
+                    # number of trailing set bits
+                    width = (~val & (val + 1)).bit_length() - 1
+                    if run_len == 0:
+                        run_start = long_off * 32 + bit
+                    run_len += width
+                    if run_len >= num:
+                        return run_start
+                else:
+                    # number of trailing clear bits
+                    width = (val & -val).bit_length() - 1
+                    run_len = 0
+                val >>= width
+                bit += width
+            if bit < 32:
+                run_len = 0
+        return None
+
+    def _find_scattered(self, num):
         result = []
+        words = self.bitmap_words
         long_off = self.find_start_off
         last_long = self.bitmap_longs - 1
         # run through all longs of bitmap if needed
         for n in range(self.bitmap_longs):
-            # read bitmap long
-            val = struct.unpack_from(">I", self.bitmap_data, long_off * 4)[0]
-            # some bits are free in here.. find em
-            if val != 0:
-                # last long has less bits
-                if long_off == last_long:
-                    max_bits = self.bitmap_last_long_bits
-                else:
-                    max_bits = 32
-
-                base_blk_num = self.blkdev.reserved + long_off * 32
-
-                # walk through bits and collect free ones
-                for bit in range(max_bits):
-                    mask = 1 << bit
-                    if (val & mask) == mask:
-                        blk_num = base_blk_num + bit
-                        result.append(blk_num)
-                        # got all free blocks?
-                        if len(result) == num:
-                            # keep as start offset for the next time
-                            self.find_start_off = long_off
-                            return result
-
+            val = words[long_off]
+            # last long has less bits
+            if long_off == last_long:
+                val &= self.bitmap_last_long_mask
+            base_blk_num = self.blkdev.reserved + long_off * 32
+            # collect free bits, lowest first
+            while val:
+                low = val & -val
+                result.append(base_blk_num + low.bit_length() - 1)
+                if len(result) == num:
+                    return result
+                val ^= low
             # next long
             long_off += 1
             if long_off == self.bitmap_longs:
                 long_off = 0
+        return None
 
     def get_num_free(self):
-        num = 0
-        res = self.blkdev.reserved
-        for i in range(self.bitmap_bits):
-            if self.get_bit(i + res):
-                num += 1
-        return num
+        return _popcount(self._get_free_int())
 
     def get_num_used(self):
-        num = 0
-        res = self.blkdev.reserved
-        for i in range(self.bitmap_bits):
-            if not self.get_bit(i + res):
-                num += 1
-        return num
+        return self.bitmap_bits - self.get_num_free()
 
     def alloc_n(self, num):
         free_blks = self.find_n_free(num)
@@ -254,24 +394,18 @@ class ADFSBitmap:
         if off < self.blkdev.reserved or off >= self.blkdev.num_blocks:
             return None
         off = off - self.blkdev.reserved
-        long_off = off // 32
-        bit_off = off % 32
-        val = struct.unpack_from(">I", self.bitmap_data, long_off * 4)[0]
-        mask = 1 << bit_off
-        return (val & mask) == mask
+        return (self.bitmap_words[off >> 5] >> (off & 31)) & 1 == 1
 
     # mark as free
     def set_bit(self, off):
         if off < self.blkdev.reserved or off >= self.blkdev.num_blocks:
             return False
         off = off - self.blkdev.reserved
-        long_off = off // 32
-        bit_off = off % 32
-        val = struct.unpack_from(">I", self.bitmap_data, long_off * 4)[0]
-        mask = 1 << bit_off
+        long_off = off >> 5
+        mask = 1 << (off & 31)
+        val = self.bitmap_words[long_off]
         if val & mask == 0:
-            val = val | mask
-            struct.pack_into(">I", self.bitmap_data, long_off * 4, val)
+            self.bitmap_words[long_off] = val | mask
             self.dirty = True
             self.num_used -= 1
 
@@ -280,13 +414,11 @@ class ADFSBitmap:
         if off < self.blkdev.reserved or off >= self.blkdev.num_blocks:
             return False
         off = off - self.blkdev.reserved
-        long_off = off // 32
-        bit_off = off % 32
-        val = struct.unpack_from(">I", self.bitmap_data, long_off * 4)[0]
-        mask = 1 << bit_off
+        long_off = off >> 5
+        mask = 1 << (off & 31)
+        val = self.bitmap_words[long_off]
         if val & mask == mask:
-            val = val & ~mask
-            struct.pack_into(">I", self.bitmap_data, long_off * 4, val)
+            self.bitmap_words[long_off] = val & ~mask
             self.dirty = True
             self.num_used += 1
 
@@ -294,7 +426,7 @@ class ADFSBitmap:
         print("Bitmap:")
         print("  ext: ", self.ext_blks)
         print("  blks:", len(self.bitmap_blks))
-        print("  bits:", len(self.bitmap_data) * 8, self.blkdev.num_blocks)
+        print("  bits:", len(self.bitmap_words) * 32, self.blkdev.num_blocks)
 
     def print_info(self):
         num_free = self.get_num_free()
@@ -257,7 +257,7 @@ class ADFSFile(ADFSNode):
             if is_ffs:
                 # pad block
                 if size < bs:
-                    d += b"\0" * (bs - size)
+                    d = bytes(d) + b"\0" * (bs - size)
                 # write raw block data in FFS
                 self.blkdev.write_block(blk_num, d)
             else:
@@ -287,6 +287,17 @@ class ADFSFile(ADFSNode):
         result += self.data_blk_nums
         return result
 
+    def get_block_extents(self):
+        """return the runs of ascending blocks of the header, list and data
+        blocks, in this order, as (first block, number of blocks) tuples"""
+        result = []
+        for blk_num in self.get_block_nums():
+            if result and result[-1][0] + result[-1][1] == blk_num:
+                result[-1][1] += 1
+            else:
+                result.append([blk_num, 1])
+        return [tuple(extent) for extent in result]
+
     def get_blocks(self, with_data=True):
         result = [self.block]
         result += self.ext_blks
@@ -1,7 +1,7 @@
 from .block.BootBlock import BootBlock
 from .block.RootBlock import RootBlock
 from .ADFSVolDir import ADFSVolDir
-from .ADFSBitmap import ADFSBitmap
+from .ADFSBitmap import ADFSBitmap, ALLOC_FIRST_FIT
 from .FileName import FileName
 from .RootMetaInfo import RootMetaInfo
 from .FSError import *
@@ -12,8 +12,9 @@ import adfotg.amitools.util.ByteSize as ByteSize
 
 
 class ADFSVolume:
-    def __init__(self, blkdev):
+    def __init__(self, blkdev, alloc_policy=ALLOC_FIRST_FIT):
         self.blkdev = blkdev
+        self.alloc_policy = alloc_policy
 
         self.boot = None
         self.root = None
@@ -53,7 +54,7 @@ class ADFSVolume:
                 self.root_dir = ADFSVolDir(self, self.root)
                 self.root_dir.read()
                 # create bitmap
-                self.bitmap = ADFSBitmap(self.root)
+                self.bitmap = ADFSBitmap(self.root, self.alloc_policy)
                 self.bitmap.read()
                 self.valid = True
             else:
@@ -114,7 +115,7 @@ class ADFSVolume:
         self.root.create(fn.get_name(), create_ts, disk_ts, mod_ts, fstype=dos_type)
         self.name = name
         # create bitmap
-        self.bitmap = ADFSBitmap(self.root)
+        self.bitmap = ADFSBitmap(self.root, self.alloc_policy)
         self.bitmap.create()
         self.bitmap.write()  # writes root block, too
         # create empty root dir
@@ -157,6 +158,40 @@ class ADFSVolume:
 
     # ----- Path Queries -----
 
+    def get_files(self, node=None):
+        """yield all files of the volume, or of the given dir"""
+        if node == None:
+            node = self.root_dir
+        for entry in node.get_entries():
+            if entry.is_dir():
+                yield from self.get_files(entry)
+            else:
+                yield entry
+
+    def get_frag_info(self):
+        """return an array of strings with the fragmentation of the files
+        and of the free space"""
+        res = []
+        num_files = 0
+        num_frag = 0
+        num_extents = 0
+        for node in self.get_files():
+            extents = len(node.get_block_extents())
+            num_files += 1
+            num_extents += extents
+            if extents > 1:
+                num_frag += 1
+        free_runs = [length for _, length in self.bitmap.get_free_runs()]
+        res.append(
+            "files:  %10d  fragmented %d  extents %d"
+            % (num_files, num_frag, num_extents)
+        )
+        res.append(
+            "free:   %10d  runs %d  largest %d"
+            % (sum(free_runs), len(free_runs), max(free_runs, default=0))
+        )
+        return res
+
     def get_path_name(self, path_name, allow_file=True, allow_dir=True):
         """get node for given path"""
         # make sure path name is a FSString
@@ -5,6 +5,7 @@ import unicodedata
 
 from .ADFSDir import ADFSDir
 from .ADFSFile import ADFSFile
+from .ADFSBitmap import ALLOC_FIRST_FIT
 from .ADFSVolume import ADFSVolume
 from .MetaDB import MetaDB
 from . import DosType
@@ -22,11 +23,14 @@ class Imager:
     META_MODE_DB = 1
     META_MODE_FSUAE = 2
 
-    def __init__(self, path_encoding=None, meta_mode=META_MODE_DB):
+    def __init__(self, path_encoding=None, meta_mode=META_MODE_DB, progress=None):
         self.meta_mode = meta_mode
         self.meta_db = None
         self.meta_fsuae = MetaInfoFSUAE()
         self.total_bytes = 0
+        # progress(done, total) is called with the bytes packed so far
+        self.progress = progress
+        self.pack_total_bytes = None
         self.path_encoding = path_encoding
         # get path name encoding for host file system
         if self.path_encoding == None:
@@ -134,6 +138,9 @@ class Imager:
         # remove trailing slash
         if in_path[-1] == "/":
             in_path = in_path[:-1]
+        if self.progress != None:
+            self.pack_total_bytes = self._sum_file_sizes(in_path)
+            self.progress(self.total_bytes, self.pack_total_bytes)
         meta_path = in_path + ".xdfmeta"
         if os.path.exists(meta_path):
             self.meta_db = MetaDB()
@@ -175,7 +182,9 @@ class Imager:
             blkdev = factory.create(image_file, force=force, options=options)
         return blkdev
 
-    def pack_create_volume(self, in_path, blkdev, dos_type=None):
+    def pack_create_volume(
+        self, in_path, blkdev, dos_type=None, alloc_policy=ALLOC_FIRST_FIT
+    ):
         if self.meta_db != None:
             name = self.meta_db.get_volume_name()
             meta_info = self.meta_db.get_root_meta_info()
@@ -192,7 +201,7 @@ class Imager:
             meta_info = None
             if dos_type is None:
                 dos_type = DosType.DOS0
-        volume = ADFSVolume(blkdev)
+        volume = ADFSVolume(blkdev, alloc_policy)
         volume.create(FSString(name), meta_info, dos_type=dos_type)
         return volume
 
@@ -244,3 +253,14 @@ class Imager:
             node = parent_node.create_file(FSString(ami_name), data, meta_info, False)
             node.flush()
             self.total_bytes += len(data)
+            if self.progress != None:
+                self.progress(self.total_bytes, self.pack_total_bytes)
+
+    def _sum_file_sizes(self, in_path):
+        total = 0
+        for dir_path, _, names in os.walk(in_path):
+            for name in names:
+                path = os.path.join(dir_path, name)
+                if not self.meta_fsuae.is_meta_file(path):
+                    total += os.path.getsize(path)
+        return total
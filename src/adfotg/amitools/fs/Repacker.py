@@ -1,3 +1,4 @@
+from .ADFSBitmap import ALLOC_FIRST_FIT
 from .ADFSVolume import ADFSVolume
 from adfotg.amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
 
@@ -42,7 +43,7 @@ class Repacker:
         self.out_blkdev = f.create(image_file, force=force, options=options)
         return self.out_blkdev
 
-    def create_out_volume(self, blkdev=None):
+    def create_out_volume(self, blkdev=None, alloc_policy=ALLOC_FIRST_FIT):
         if blkdev != None:
             self.out_blkdev = blkdev
         if self.out_blkdev == None:
@@ -55,7 +56,7 @@ class Repacker:
         dos_type = iv.get_dos_type()
         meta_info = iv.get_meta_info()
         boot_code = iv.get_boot_code()
-        self.out_volume = ADFSVolume(self.out_blkdev)
+        self.out_volume = ADFSVolume(self.out_blkdev, alloc_policy)
         self.out_volume.create(
             name, meta_info=meta_info, dos_type=dos_type, boot_code=boot_code
         )
@@ -6,6 +6,7 @@ from .ADFBlockDevice import ADFBlockDevice
 from .HDFBlockDevice import HDFBlockDevice
 from .RawBlockDevice import RawBlockDevice
 from .DiskGeometry import DiskGeometry
+from .BlockCache import DEFAULT_CACHE_BLOCKS
 from adfotg.amitools.fs.rdb.RDisk import RDisk
 import adfotg.amitools.util.BlkDevTools as BlkDevTools
 
@@ -107,6 +108,15 @@ class BlkDevFactory:
         else:
             return 512
 
+    def _get_cache_blocks(self, options):
+        if options and "cache" in options:
+            cache = int(options["cache"])
+            if cache < 0:
+                raise ValueError("invalid cache size given: %d" % cache)
+            return cache
+        else:
+            return DEFAULT_CACHE_BLOCKS
+
     def open(
         self, img_file, read_only=False, options=None, fobj=None, none_if_missing=False
     ):
@@ -159,6 +169,7 @@ class BlkDevFactory:
 
         # get block size
         bs = self._get_block_size(options)
+        cache = self._get_cache_blocks(options)
 
         # now create blkdev
         if t in (self.TYPE_ADF, self.TYPE_ADF_HD):
@@ -176,10 +187,14 @@ class BlkDevFactory:
             geo = DiskGeometry(block_bytes=bs)
             if not geo.detect(size, options):
                 raise IOError("can't detect geometry of HDF image file")
-            blkdev = HDFBlockDevice(img_file, read_only, fobj=fobj, block_size=bs)
+            blkdev = HDFBlockDevice(
+                img_file, read_only, fobj=fobj, block_size=bs, cache_blocks=cache
+            )
             blkdev.open(geo)
         else:
-            rawdev = RawBlockDevice(img_file, read_only, fobj=fobj, block_bytes=bs)
+            rawdev = RawBlockDevice(
+                img_file, read_only, fobj=fobj, block_bytes=bs, cache_blocks=cache
+            )
             rawdev.open()
             # check block size stored in rdb
             rdisk = RDisk(rawdev)
@@ -188,7 +203,9 @@ class BlkDevFactory:
                 # adjust block size and re-open
                 rawdev.close()
                 bs = rdb_bs
-                rawdev = RawBlockDevice(img_file, read_only, fobj=fobj, block_bytes=bs)
+                rawdev = RawBlockDevice(
+                    img_file, read_only, fobj=fobj, block_bytes=bs, cache_blocks=cache
+                )
                 rawdev.open()
                 rdisk = RDisk(rawdev)
             if not rdisk.open():
@@ -225,6 +242,7 @@ class BlkDevFactory:
 
         # get block size
         bs = self._get_block_size(options)
+        cache = self._get_cache_blocks(options)
 
         # create blkdev
         if t == self.TYPE_ADF:
@@ -238,7 +256,9 @@ class BlkDevFactory:
             geo = DiskGeometry()
             if not geo.setup(options):
                 raise IOError("can't determine geometry of HDF image file")
-            blkdev = HDFBlockDevice(img_file, fobj=fobj, block_size=bs)
+            blkdev = HDFBlockDevice(
+                img_file, fobj=fobj, block_size=bs, cache_blocks=cache
+            )
             blkdev.create(geo)
         return blkdev
 
@@ -0,0 +1,128 @@
+# a size-bounded LRU cache of the blocks of an image file
+#
+# Written blocks are kept dirty in the cache and are written back to
+# the image file on write_back(), sorted and joined to runs of
+# consecutive blocks, so that each run is written with a single call.
+
+from collections import OrderedDict
+
+DEFAULT_CACHE_BLOCKS = 1024
+
+
+class BlockCache:
+    def __init__(self, img_file, max_blocks=DEFAULT_CACHE_BLOCKS):
+        self.img_file = img_file
+        # 0 disables the cache: reads and writes go to the image file
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.dirty = set()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_runs = 0
+        self.write_blks = 0
+
+    def read_blk(self, blk_num, num_blks=1):
+        if self.max_blocks == 0:
+            return self.img_file.read_blk(blk_num, num_blks)
+        blocks = self.blocks
+        if num_blks == 1:
+            data = blocks.get(blk_num)
+            if data is None:
+                self.misses += 1
+                return self._load(blk_num, 1)
+            self.hits += 1
+            blocks.move_to_end(blk_num)
+            return data
+        result = []
+        # misses are read from the image file in runs
+        miss_start = None
+        for n in range(blk_num, blk_num + num_blks):
+            data = blocks.get(n)
+            if data is None:
+                self.misses += 1
+                if miss_start is None:
+                    miss_start = n
+                continue
+            self.hits += 1
+            blocks.move_to_end(n)
+            if miss_start is not None:
+                result.append(self._load(miss_start, n - miss_start))
+                miss_start = None
+            result.append(data)
+        if miss_start is not None:
+            result.append(self._load(miss_start, blk_num + num_blks - miss_start))
+        return b"".join(result)
+
+    def write_blk(self, blk_num, data, num_blks=1):
+        if self.max_blocks == 0:
+            self.img_file.write_blk(blk_num, data, num_blks)
+            return
+        self.img_file.check_write_blk(blk_num, data, num_blks)
+        if num_blks == 1:
+            # copy: the caller may still modify its data
+            self._put(blk_num, bytes(data))
+            self.dirty.add(blk_num)
+            return
+        bb = self.img_file.block_bytes
+        for i in range(num_blks):
+            self._put(blk_num + i, bytes(data[i * bb : (i + 1) * bb]))
+            self.dirty.add(blk_num + i)
+
+    def write_back(self):
+        """write all dirty blocks to the image file"""
+        if not self.dirty:
+            return
+        blk_nums = sorted(self.dirty)
+        blocks = self.blocks
+        start = 0
+        for i in range(1, len(blk_nums) + 1):
+            if i == len(blk_nums) or blk_nums[i] != blk_nums[i - 1] + 1:
+                run = blk_nums[start:i]
+                data = b"".join(blocks[n] for n in run)
+                self.img_file.write_blk(run[0], data, len(run))
+                self.write_runs += 1
+                self.write_blks += len(run)
+                start = i
+        self.dirty.clear()
+
+    def invalidate(self):
+        """drop all cached blocks, without writing back the dirty ones"""
+        self.blocks.clear()
+        self.dirty.clear()
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "cached": len(self.blocks),
+            "dirty": len(self.dirty),
+            "write_runs": self.write_runs,
+            "write_blks": self.write_blks,
+        }
+
+    def _load(self, blk_num, num_blks):
+        data = self.img_file.read_blk(blk_num, num_blks)
+        bb = self.img_file.block_bytes
+        if num_blks == 1 and len(data) == bb:
+            self._put(blk_num, data)
+        else:
+            # a short read at the end of the image is not cached
+            for i in range(len(data) // bb):
+                self._put(blk_num + i, data[i * bb : (i + 1) * bb])
+        return data
+
+    def _put(self, blk_num, data):
+        blocks = self.blocks
+        if blk_num in blocks:
+            blocks.move_to_end(blk_num)
+        blocks[blk_num] = data
+        if len(blocks) > self.max_blocks:
+            old_blk_num = next(iter(blocks))
+            if old_blk_num in self.dirty:
+                # write back all of them, while they can be joined to runs
+                self.write_back()
+            del blocks[old_blk_num]
+            self.evictions += 1
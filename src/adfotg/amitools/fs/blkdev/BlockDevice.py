@@ -26,6 +26,15 @@ class BlockDevice:
         print("block_bytes:", self.block_bytes)
         print("reserved:   ", self.reserved)
         print("bootblocks: ", self.bootblocks)
+        stats = self.get_cache_stats()
+        if stats is not None:
+            print(
+                "cache:       hits=%(hits)d misses=%(misses)d "
+                "evictions=%(evictions)d cached=%(cached)d dirty=%(dirty)d" % stats
+            )
+            print(
+                "write-back:  %(write_blks)d blocks in %(write_runs)d runs" % stats
+            )
 
     def _blk_to_offset(self, blk_num):
         return self.block_bytes * blk_num
@@ -49,6 +58,11 @@ class BlockDevice:
     def write_block(self, blk_num, data):
         pass
 
+    def get_cache_stats(self):
+        """return a dict with the statistics of the block cache,
+        or None if the device has none"""
+        return None
+
     def get_geometry(self):
         return DiskGeometry(self.cyls, self.heads, self.sectors)
 
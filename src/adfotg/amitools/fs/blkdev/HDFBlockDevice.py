@@ -1,10 +1,19 @@
+from .BlockCache import BlockCache, DEFAULT_CACHE_BLOCKS
 from .BlockDevice import BlockDevice
 from .ImageFile import ImageFile
 
 
 class HDFBlockDevice(BlockDevice):
-    def __init__(self, hdf_file, read_only=False, block_size=512, fobj=None):
+    def __init__(
+        self,
+        hdf_file,
+        read_only=False,
+        block_size=512,
+        fobj=None,
+        cache_blocks=DEFAULT_CACHE_BLOCKS,
+    ):
         self.img_file = ImageFile(hdf_file, read_only, block_size, fobj)
+        self.cache = BlockCache(self.img_file, cache_blocks)
 
     def create(self, geo, reserved=2):
         self._set_geometry(
@@ -14,6 +23,7 @@ class HDFBlockDevice(BlockDevice):
             reserved=reserved,
             block_bytes=self.img_file.block_bytes,
         )
+        self.cache.invalidate()
         self.img_file.create(geo.get_num_blocks())
         self.img_file.open()
 
@@ -25,16 +35,22 @@ class HDFBlockDevice(BlockDevice):
             reserved=reserved,
             block_bytes=self.img_file.block_bytes,
         )
+        self.cache.invalidate()
         self.img_file.open()
 
     def flush(self):
-        pass
+        self.cache.write_back()
+        self.img_file.flush()
 
     def close(self):
+        self.cache.write_back()
         self.img_file.close()
 
     def read_block(self, blk_num):
-        return self.img_file.read_blk(blk_num)
+        return self.cache.read_blk(blk_num)
 
     def write_block(self, blk_num, data):
-        return self.img_file.write_blk(blk_num, data)
+        return self.cache.write_blk(blk_num, data)
+
+    def get_cache_stats(self):
+        return self.cache.get_stats()
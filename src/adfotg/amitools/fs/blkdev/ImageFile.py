@@ -65,6 +65,13 @@ class ImageFile:
         return data
 
     def write_blk(self, blk_num, data, num_blks=1):
+        self.check_write_blk(blk_num, data, num_blks)
+        off = blk_num * self.block_bytes
+        if off != self.fobj.tell():
+            self.fobj.seek(off, os.SEEK_SET)
+        self.fobj.write(data)
+
+    def check_write_blk(self, blk_num, data, num_blks=1):
         if self.read_only:
             raise IOError("Can't write block: image file is read-only")
         if blk_num >= self.num_blocks:
@@ -77,10 +84,6 @@ class ImageFile:
                 "Invalid block size written: got %d but size is %d"
                 % (len(data), self.block_bytes)
             )
-        off = blk_num * self.block_bytes
-        if off != self.fobj.tell():
-            self.fobj.seek(off, os.SEEK_SET)
-        self.fobj.write(data)
 
     def flush(self):
         self.fobj.flush()
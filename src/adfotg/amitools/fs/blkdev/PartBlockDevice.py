@@ -37,10 +37,15 @@ class PartBlockDevice(BlockDevice):
     def flush(self):
         self.raw_blkdev.flush()
 
+    def get_cache_stats(self):
+        return self.raw_blkdev.get_cache_stats()
+
     def close(self):
         # auto close containing rdisk
         if self.auto_close:
             self.raw_blkdev.close()
+        else:
+            self.raw_blkdev.flush()
 
     def read_block(self, blk_num):
         if blk_num >= self.num_blocks:
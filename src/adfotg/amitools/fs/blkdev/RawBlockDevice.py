@@ -1,20 +1,32 @@
+from .BlockCache import BlockCache, DEFAULT_CACHE_BLOCKS
 from .BlockDevice import BlockDevice
 from .ImageFile import ImageFile
 
 
 class RawBlockDevice(BlockDevice):
-    def __init__(self, raw_file, read_only=False, block_bytes=512, fobj=None):
+    def __init__(
+        self,
+        raw_file,
+        read_only=False,
+        block_bytes=512,
+        fobj=None,
+        cache_blocks=DEFAULT_CACHE_BLOCKS,
+    ):
         self.img_file = ImageFile(raw_file, read_only, block_bytes, fobj)
+        self.cache = BlockCache(self.img_file, cache_blocks)
 
     def create(self, num_blocks):
+        self.cache.invalidate()
         self.img_file.create(num_blocks)
         self.open()
 
     def resize(self, new_blocks):
+        self.cache.write_back()
         self.img_file.resize(new_blocks)
         self.open()
 
     def open(self):
+        self.cache.invalidate()
         self.img_file.open()
         # calc block longs
         self.block_bytes = self.img_file.block_bytes
@@ -22,13 +34,18 @@ class RawBlockDevice(BlockDevice):
         self.num_blocks = self.img_file.num_blocks
 
     def flush(self):
+        self.cache.write_back()
         self.img_file.flush()
 
     def close(self):
+        self.cache.write_back()
         self.img_file.close()
 
     def read_block(self, blk_num, num_blks=1):
-        return self.img_file.read_blk(blk_num, num_blks)
+        return self.cache.read_blk(blk_num, num_blks)
 
     def write_block(self, blk_num, data, num_blks=1):
-        self.img_file.write_blk(blk_num, data, num_blks)
+        self.cache.write_blk(blk_num, data, num_blks)
+
+    def get_cache_stats(self):
+        return self.cache.get_stats()
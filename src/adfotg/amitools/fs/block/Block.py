@@ -1,6 +1,7 @@
 import struct
 from ..TimeStamp import TimeStamp
 from ..FSString import FSString
+from .Checksum import block_chksum
 
 
 class Block:
@@ -149,11 +150,7 @@ class Block:
         self._put_long(self.chk_loc, self.calc_chksum)
 
     def _calc_chksum(self):
-        chksum = 0
-        for i in range(self.block_longs):
-            if i != self.chk_loc:
-                chksum += self._get_long(i)
-        return (-chksum) & 0xFFFFFFFF
+        return block_chksum(self.data, self.chk_loc)
 
     def _get_timestamp(self, loc):
         days = self._get_long(loc)
@@ -162,11 +159,49 @@ class Block:
         return TimeStamp(days, mins, ticks)
 
     def _put_timestamp(self, loc, ts):
+        days, mins, ticks = self._ts_longs(ts)
+        self._put_long(loc, days)
+        self._put_long(loc + 1, mins)
+        self._put_long(loc + 2, ticks)
+
+    @staticmethod
+    def _ts_longs(ts):
         if ts == None:
             ts = TimeStamp()
-        self._put_long(loc, ts.days)
-        self._put_long(loc + 1, ts.mins)
-        self._put_long(loc + 2, ts.ticks)
+        return ts.days, ts.mins, ts.ticks
+
+    # Layouts are struct.Structs over the fixed fields at the head of
+    # a block, starting at long 0, or at its tail, ending at long -1.
+    # Block types declare them once, as class attributes, so that all
+    # their fields are read or written with one call for each end.
+
+    def _unpack_head(self, layout):
+        return layout.unpack_from(self.data, 0)
+
+    def _pack_head(self, layout, *values):
+        layout.pack_into(self.data, 0, *values)
+
+    def _unpack_tail(self, layout):
+        return layout.unpack_from(self.data, len(self.data) - layout.size)
+
+    def _pack_tail(self, layout, *values):
+        layout.pack_into(self.data, len(self.data) - layout.size, *values)
+
+    # The tables between the head and the tail depend on the block size.
+    _table_layouts = {}
+
+    def _table_layout(self, num):
+        layout = self._table_layouts.get(num)
+        if layout is None:
+            layout = self._table_layouts[num] = struct.Struct(">%dI" % num)
+        return layout
+
+    def _get_table(self, loc, num):
+        """Returns num longs starting at long loc as a tuple."""
+        return self._table_layout(num).unpack_from(self.data, loc * 4)
+
+    def _put_table(self, loc, values):
+        self._table_layout(len(values)).pack_into(self.data, loc * 4, *values)
 
     def _get_bytes(self, loc, size):
         if loc < 0:
@@ -185,15 +220,26 @@ class Block:
         if loc < 0:
             loc = self.block_longs + loc
         loc = loc * 4
-        size = self.data[loc]
+        return self._decode_bstr(self.data[loc : loc + 1 + max_size], max_size)
+
+    def _put_bstr(self, loc, max_size, fs_str):
+        bstr = self._encode_bstr(fs_str, max_size)
+        if loc < 0:
+            loc = self.block_longs + loc
+        loc = loc * 4
+        self.data[loc : loc + len(bstr)] = bstr
+
+    @staticmethod
+    def _decode_bstr(raw, max_size):
+        size = raw[0]
         if size > max_size:
             return None
         if size == 0:
             return FSString()
-        name = self.data[loc + 1 : loc + 1 + size]
-        return FSString(name)
+        return FSString(raw[1 : 1 + size])
 
-    def _put_bstr(self, loc, max_size, fs_str):
+    @staticmethod
+    def _encode_bstr(fs_str, max_size):
         if fs_str is None:
             fs_str = FSString()
         assert isinstance(fs_str, FSString)
@@ -202,12 +248,7 @@ class Block:
         n = len(bstr)
         if n > max_size:
             bstr = bstr[:max_size]
-        if loc < 0:
-            loc = self.block_longs + loc
-        loc = loc * 4
-        self.data[loc] = len(bstr)
-        if len(bstr) > 0:
-            self.data[loc + 1 : loc + 1 + len(bstr)] = bstr
+        return bytes([len(bstr)]) + bstr
 
     def _get_cstr(self, loc, max_size):
         n = 0
@@ -1,6 +1,7 @@
 import os.path
 
 from .Block import Block
+from .Checksum import boot_chksum
 import adfotg.amitools.fs.DosType as DosType
 
 
@@ -50,16 +51,7 @@ class BootBlock(Block):
 
     def _calc_chksum(self):
         all_blks = [self] + self.extra_blks
-        n = self.blkdev.block_longs
-        chksum = 0
-        for blk in all_blks:
-            for i in range(n):
-                if i != 1:  # skip chksum
-                    chksum += blk._get_long(i)
-                    if chksum > 0xFFFFFFFF:
-                        chksum += 1
-                        chksum &= 0xFFFFFFFF
-        return (~chksum) & 0xFFFFFFFF
+        return boot_chksum([blk.data for blk in all_blks])
 
     def read(self):
         self._read_data()
@@ -8,6 +8,9 @@ from ..FSString import FSString
 
 
 class DirCacheRecord:
+    # entry, size, protect, (uid, gid), mod_ts (days, mins, ticks)
+    _header_layout = struct.Struct(">IIIHHHHH")
+
     def __init__(
         self, entry=0, size=0, protect=0, mod_ts=None, sub_type=0, name="", comment=None
     ):
@@ -31,7 +34,7 @@ class DirCacheRecord:
     def get(self, data, off):
         self.offset = off
         # header
-        d = struct.unpack_from(">IIIHHHHH", data, offset=off)
+        d = self._header_layout.unpack_from(data, off)
         self.entry = d[0]
         self.size = d[1]
         self.protect = d[2]
@@ -51,8 +54,7 @@ class DirCacheRecord:
         self.offset = off
         # header
         ts = self.mod_ts
-        struct.pack_into(
-            ">IIIHHHHH",
+        self._header_layout.pack_into(
             data,
             off,
             self.entry,
@@ -91,6 +93,9 @@ class DirCacheRecord:
 
 
 class DirCacheBlock(Block):
+    # longs 1 to 4: own_key, parent, num_records, next_cache
+    _head_layout = struct.Struct(">4x4I")
+
     def __init__(self, blkdev, blk_num):
         Block.__init__(self, blkdev, blk_num, is_type=Block.T_DIR_CACHE)
 
@@ -108,10 +113,12 @@ class DirCacheBlock(Block):
             return False
 
         # fields
-        self.own_key = self._get_long(1)
-        self.parent = self._get_long(2)
-        self.num_records = self._get_long(3)
-        self.next_cache = self._get_long(4)
+        (
+            self.own_key,
+            self.parent,
+            self.num_records,
+            self.next_cache,
+        ) = self._unpack_head(self._head_layout)
         self.records = []
 
         # get records
@@ -171,10 +178,13 @@ class DirCacheBlock(Block):
 
     def write(self):
         Block._create_data(self)
-        self._put_long(1, self.own_key)
-        self._put_long(2, self.parent)
-        self._put_long(3, self.num_records)
-        self._put_long(4, self.next_cache)
+        self._pack_head(
+            self._head_layout,
+            self.own_key,
+            self.parent,
+            self.num_records,
+            self.next_cache,
+        )
 
         # put records
         off = 24
@@ -1,6 +1,9 @@
+import struct
+
 from .Block import Block
 from .CommentBlock import CommentBlock
 from ..FSString import FSString
+from ..TimeStamp import TimeStamp
 
 
 class EntryBlock(Block):
@@ -11,13 +14,36 @@ class EntryBlock(Block):
         self.is_longname = is_longname
         self.comment_block_id = 0
 
-    def _read_nac_modts(self):
-        """Reads the name, comment, and modifcation timestamp"""
+    # The tail of the entry blocks, longs -50 to -1:
+    # protect, byte_size, comment, mod_ts (3 longs), name,
+    # hash_chain, parent, extension
+    _tail_layout = struct.Struct(">8x2I92s3I32s32x3I4x")
+    # The same in long filename mode: protect, byte_size,
+    # name and comment, comment_block_id, mod_ts (3 longs),
+    # hash_chain, parent, extension
+    _longname_tail_layout = struct.Struct(">8x2I112sI8x3I32x3I4x")
+
+    def _read_tail(self):
+        """Reads the fields at the tail of the block, including the name,
+        comment, and modification timestamp. Returns the byte size, which is
+        only meaningful for files.
+        """
         if self.is_longname:
+            (
+                self.protect,
+                byte_size,
+                nac,
+                comment_block_id,
+                days,
+                mins,
+                ticks,
+                self.hash_chain,
+                self.parent,
+                self.extension,
+            ) = self._unpack_tail(self._longname_tail_layout)
             # In long filename mode, we have a combined field that contains
             # the filename and the comment as consequtive BSTR. If the comment does
             # not fit in, it is stored in an extra block
-            nac = self._get_bytes(-46, 112)
             name_len = nac[0]
             self.name = FSString(nac[1 : name_len + 1])
             comment_len = nac[name_len + 1]
@@ -25,16 +51,30 @@ class EntryBlock(Block):
                 self.comment = FSString(nac[name_len + 2 : name_len + 2 + comment_len])
             else:
                 # Comment is located in an extra block
-                self.comment_block_id = self._get_long(-18)
+                self.comment_block_id = comment_block_id
                 self.comment = FSString()
-            self.mod_ts = self._get_timestamp(-15)
         else:
-            self.comment = self._get_bstr(-46, 79)
-            self.name = self._get_bstr(-20, 30)
-            self.mod_ts = self._get_timestamp(-23)
+            (
+                self.protect,
+                byte_size,
+                comment,
+                days,
+                mins,
+                ticks,
+                name,
+                self.hash_chain,
+                self.parent,
+                self.extension,
+            ) = self._unpack_tail(self._tail_layout)
+            self.comment = self._decode_bstr(comment, 79)
+            self.name = self._decode_bstr(name, 30)
+        self.mod_ts = TimeStamp(days, mins, ticks)
+        return byte_size
 
-    def _write_nac_modts(self):
-        """Writes the name, comment, and modifcation timestamp"""
+    def _write_tail(self, byte_size=0):
+        """Writes the fields at the tail of the block, including the name,
+        comment, and modification timestamp"""
+        days, mins, ticks = self._ts_longs(self.mod_ts)
         if self.is_longname:
             nac = bytearray()
             name = self.name.get_ami_str()
@@ -48,13 +88,33 @@ class EntryBlock(Block):
                 comment_len = len(comment)
                 nac.append(comment_len)
                 nac += comment
-            self._put_bytes(-46, nac)
-            self._put_long(-18, self.comment_block_id)
-            self._put_timestamp(-15, self.mod_ts)
+            self._pack_tail(
+                self._longname_tail_layout,
+                self.protect,
+                byte_size,
+                bytes(nac),
+                self.comment_block_id,
+                days,
+                mins,
+                ticks,
+                self.hash_chain,
+                self.parent,
+                self.extension,
+            )
         else:
-            self._put_bstr(-46, 79, self.comment)
-            self._put_timestamp(-23, self.mod_ts)
-            self._put_bstr(-20, 30, self.name)
+            self._pack_tail(
+                self._tail_layout,
+                self.protect,
+                byte_size,
+                self._encode_bstr(self.comment, 79),
+                days,
+                mins,
+                ticks,
+                self._encode_bstr(self.name, 30),
+                self.hash_chain,
+                self.parent,
+                self.extension,
+            )
 
     @staticmethod
     def needs_extra_comment_block(name, comment):
@@ -1,3 +1,4 @@
+import struct
 import time
 from .Block import Block
 from .EntryBlock import EntryBlock
@@ -8,6 +9,9 @@ from ..FSString import FSString
 
 
 class FileHeaderBlock(EntryBlock):
+    # longs 1 to 4: own_key, block_count, (data_size), first_data
+    _head_layout = struct.Struct(">4x2I4xI")
+
     def __init__(self, blkdev, blk_num, is_longname):
         EntryBlock.__init__(
             self,
@@ -32,48 +36,36 @@ class FileHeaderBlock(EntryBlock):
             return False
 
         # FileHeader fields
-        self.own_key = self._get_long(1)
-        self.block_count = self._get_long(2)
-        self.first_data = self._get_long(4)
+        self.own_key, self.block_count, self.first_data = self._unpack_head(
+            self._head_layout
+        )
 
-        # read (limited) data blocks table
+        # read (limited) data blocks table, stored backwards from long -51
         bc = self.block_count
         mbc = self.blkdev.block_longs - 56
         if bc > mbc:
             bc = mbc
-        self.data_blocks = []
-        for i in range(bc):
-            self.data_blocks.append(self._get_long(-51 - i))
+        table = self._get_table(6, mbc)
+        self.data_blocks = list(reversed(table[mbc - bc :]))
 
-        self.protect = self._get_long(-48)
+        self.byte_size = self._read_tail()
         self.protect_flags = ProtectFlags(self.protect)
-        self.byte_size = self._get_long(-47)
-        self._read_nac_modts()
-        self.hash_chain = self._get_long(-4)
-        self.parent = self._get_long(-3)
-        self.extension = self._get_long(-2)
 
         self.valid = self.own_key == self.blk_num
         return self.valid
 
     def write(self):
         Block._create_data(self)
-        self._put_long(1, self.own_key)
-        self._put_long(2, self.block_count)
-        self._put_long(4, self.first_data)
+        self._pack_head(
+            self._head_layout, self.own_key, self.block_count, self.first_data
+        )
 
         # data blocks
-        for i in range(len(self.data_blocks)):
-            self._put_long(-51 - i, self.data_blocks[i])
-
-        self._put_long(-48, self.protect)
-        self._put_long(-47, self.byte_size)
-
-        self._write_nac_modts()
+        n = len(self.data_blocks)
+        if n > 0:
+            self._put_table(self.blkdev.block_longs - 50 - n, self.data_blocks[::-1])
 
-        self._put_long(-4, self.hash_chain)
-        self._put_long(-3, self.parent)
-        self._put_long(-2, self.extension)
+        self._write_tail(self.byte_size)
         Block.write(self)
 
     def create(
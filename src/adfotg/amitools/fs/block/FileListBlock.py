@@ -1,7 +1,14 @@
+import struct
+
 from .Block import Block
 
 
 class FileListBlock(Block):
+    # longs 1 and 2: own_key, block_count
+    _head_layout = struct.Struct(">4x2I")
+    # longs -3 and -2: parent, extension
+    _tail_layout = struct.Struct(">2I4x")
+
     def __init__(self, blkdev, blk_num):
         Block.__init__(
             self, blkdev, blk_num, is_type=Block.T_LIST, is_sub_type=Block.ST_FILE
@@ -21,20 +28,17 @@ class FileListBlock(Block):
             return False
 
         # FileList fields
-        self.own_key = self._get_long(1)
-        self.block_count = self._get_long(2)
+        self.own_key, self.block_count = self._unpack_head(self._head_layout)
 
-        # read (limited) data blocks
+        # read (limited) data blocks, stored backwards from long -51
         bc = self.block_count
         mbc = self.blkdev.block_longs - 56
         if bc > mbc:
             bc = mbc
-        self.data_blocks = []
-        for i in range(bc):
-            self.data_blocks.append(self._get_long(-51 - i))
+        table = self._get_table(6, mbc)
+        self.data_blocks = list(reversed(table[mbc - bc :]))
 
-        self.parent = self._get_long(-3)
-        self.extension = self._get_long(-2)
+        self.parent, self.extension = self._unpack_tail(self._tail_layout)
 
         self.valid = self.own_key == self.blk_num
         return self.valid
@@ -51,15 +55,14 @@ class FileListBlock(Block):
 
     def write(self):
         Block._create_data(self)
-        self._put_long(1, self.own_key)
-        self._put_long(2, self.block_count)
+        self._pack_head(self._head_layout, self.own_key, self.block_count)
 
         # data blocks
-        for i in range(len(self.data_blocks)):
-            self._put_long(-51 - i, self.data_blocks[i])
+        n = len(self.data_blocks)
+        if n > 0:
+            self._put_table(self.blkdev.block_longs - 50 - n, self.data_blocks[::-1])
 
-        self._put_long(-3, self.parent)
-        self._put_long(-2, self.extension)
+        self._pack_tail(self._tail_layout, self.parent, self.extension)
         Block.write(self)
 
     def dump(self):
@@ -1,3 +1,4 @@
+import struct
 import time
 
 from .Block import Block
@@ -5,6 +6,13 @@ from ..TimeStamp import *
 
 
 class RootBlock(Block):
+    # long 3: hash_size
+    _head_layout = struct.Struct(">12xI")
+    # longs -50 to -1: bitmap_flag, bitmap_ptrs (25 longs), bitmap_ext_blk,
+    # mod_ts (3 longs), name, blocks_used, disk_ts (3 longs),
+    # create_ts (3 longs), fstype, extension
+    _tail_layout = struct.Struct(">I25II3I32s4xI3I3II4xI4x")
+
     def __init__(self, blkdev, blk_num):
         Block.__init__(
             self, blkdev, blk_num, is_type=Block.T_SHORT, is_sub_type=Block.ST_ROOT
@@ -45,28 +53,23 @@ class RootBlock(Block):
         self._create_data()
 
         # hash table
-        self._put_long(3, self.hash_size)
-        for i in range(self.hash_size):
-            self._put_long(6 + i, self.hash_table[i])
-
-        # bitmap
-        self._put_long(-50, self.bitmap_flag)
-        for i in range(25):
-            self._put_long(-49 + i, self.bitmap_ptrs[i])
-        self._put_long(-24, self.bitmap_ext_blk)
-
-        # timestamps
-        self._put_timestamp(-23, self.mod_ts)
-        self._put_timestamp(-10, self.disk_ts)
-        self._put_timestamp(-7, self.create_ts)
-
-        # name
-        self._put_bstr(-20, 30, self.name)
-        self._put_long(-2, self.extension)
-
-        # DOS6 and DOS7 stuff
-        self._put_long(-11, self.blocks_used)
-        self._put_long(-4, self.fstype)
+        self._pack_head(self._head_layout, self.hash_size)
+        self._put_table(6, self.hash_table[: self.hash_size])
+
+        # bitmap, timestamps, name, DOS6 and DOS7 stuff
+        self._pack_tail(
+            self._tail_layout,
+            self.bitmap_flag,
+            *self.bitmap_ptrs[:25],
+            self.bitmap_ext_blk,
+            *self._ts_longs(self.mod_ts),
+            self._encode_bstr(self.name, 30),
+            self.blocks_used,
+            *self._ts_longs(self.disk_ts),
+            *self._ts_longs(self.create_ts),
+            self.fstype,
+            self.extension,
+        )
 
         Block.write(self)
 
@@ -84,38 +87,34 @@ class RootBlock(Block):
             return False
 
         # name hash (limit to max size)
-        self.hash_size = self._get_long(3)
+        (self.hash_size,) = self._unpack_head(self._head_layout)
 
         # read (limited) hash
         hs = self.hash_size
         mhs = self.blkdev.block_longs - 56
         if hs > mhs:
             hs = mhs
-        self.hash_table = []
-        for i in range(hs):
-            self.hash_table.append(self._get_long(6 + i))
+        self.hash_table = list(self._get_table(6, hs))
 
+        tail = self._unpack_tail(self._tail_layout)
         # bitmap
-        self.bitmap_flag = self._get_long(-50)
-        self.bitmap_ptrs = []
-        for i in range(25):
-            bm_blk = self._get_long(-49 + i)
-            self.bitmap_ptrs.append(bm_blk)
-        self.bitmap_ext_blk = self._get_long(-24)
+        self.bitmap_flag = tail[0]
+        self.bitmap_ptrs = list(tail[1:26])
+        self.bitmap_ext_blk = tail[26]
 
         # timestamps
-        self.mod_ts = self._get_timestamp(-23)
-        self.disk_ts = self._get_timestamp(-10)
-        self.create_ts = self._get_timestamp(-7)
+        self.mod_ts = TimeStamp(*tail[27:30])
+        self.disk_ts = TimeStamp(*tail[32:35])
+        self.create_ts = TimeStamp(*tail[35:38])
 
         # name
-        self.name = self._get_bstr(-20, 30)
-        self.extension = self._get_long(-2)
+        self.name = self._decode_bstr(tail[30], 30)
+        self.extension = tail[39]
 
         # Number of used blocks (new in DOS6 and DOS7)
-        self.blocks_used = self._get_long(-11)
+        self.blocks_used = tail[31]
         # filesystem type (new in DOS6 and DOS7, 0 in others)
-        self.fstype = self._get_long(-4)
+        self.fstype = tail[38]
 
         # check validity
         self.valid = True
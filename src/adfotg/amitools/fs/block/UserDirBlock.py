@@ -1,3 +1,4 @@
+import struct
 import time
 from .Block import Block
 from .EntryBlock import EntryBlock
@@ -6,6 +7,9 @@ from ..FSString import FSString
 
 
 class UserDirBlock(EntryBlock):
+    # long 1: own_key
+    _head_layout = struct.Struct(">4xI")
+
     def __init__(self, blkdev, blk_num, is_longname):
         EntryBlock.__init__(
             self,
@@ -30,18 +34,12 @@ class UserDirBlock(EntryBlock):
             return False
 
         # UserDir fields
-        self.own_key = self._get_long(1)
-        self.protect = self._get_long(-48)
-        self._read_nac_modts()
-        self.hash_chain = self._get_long(-4)
-        self.parent = self._get_long(-3)
-        self.extension = self._get_long(-2)
+        (self.own_key,) = self._unpack_head(self._head_layout)
+        self._read_tail()
 
         # hash table of entries
-        self.hash_table = []
         self.hash_size = self.blkdev.block_longs - 56
-        for i in range(self.hash_size):
-            self.hash_table.append(self._get_long(6 + i))
+        self.hash_table = list(self._get_table(6, self.hash_size))
 
         self.valid = self.own_key == self.blk_num
         return self.valid
@@ -79,15 +77,10 @@ class UserDirBlock(EntryBlock):
 
     def write(self):
         Block._create_data(self)
-        self._put_long(1, self.own_key)
-        self._put_long(-48, self.protect)
-        self._write_nac_modts()
-        self._put_long(-4, self.hash_chain)
-        self._put_long(-3, self.parent)
-        self._put_long(-2, self.extension)
+        self._pack_head(self._head_layout, self.own_key)
+        self._write_tail()
         # hash table
-        for i in range(self.hash_size):
-            self._put_long(6 + i, self.hash_table[i])
+        self._put_table(6, self.hash_table[: self.hash_size])
         Block.write(self)
 
     def dump(self):
@@ -7,6 +7,7 @@ import sys
 import argparse
 import os.path
 
+from adfotg.amitools.fs.ADFSBitmap import ALLOC_FIRST_FIT, ALLOC_POLICIES
 from adfotg.amitools.fs.ADFSVolume import ADFSVolume
 from adfotg.amitools.fs.blkdev.BlkDevFactory import BlkDevFactory
 from adfotg.amitools.fs.FSError import *
@@ -183,7 +184,7 @@ class OpenCmd(Command):
         return f.open(image_file, options=opts, read_only=self.args.read_only)
 
     def init_vol(self, blkdev):
-        vol = ADFSVolume(blkdev)
+        vol = ADFSVolume(blkdev, self.args.alloc_policy)
         vol.open()
         return vol
 
@@ -209,7 +210,7 @@ class FormatCmd(Command):
             return blkdev
 
     def init_vol(self, blkdev):
-        vol = ADFSVolume(blkdev)
+        vol = ADFSVolume(blkdev, self.args.alloc_policy)
         n = len(self.opts)
         if n < 1 or n > 2:
             print("Usage: format <volume_name> [dos_type]")
@@ -268,7 +269,10 @@ class PackCmd(Command):
 
     def init_vol(self, blkdev):
         return self.imager.pack_create_volume(
-            self.in_path, blkdev, dos_type=self.dos_type
+            self.in_path,
+            blkdev,
+            dos_type=self.dos_type,
+            alloc_policy=self.args.alloc_policy,
         )
 
     def handle_vol(self, volume):
@@ -276,6 +280,8 @@ class PackCmd(Command):
         self.imager.pack_end(self.in_path, volume)
         if self.args.verbose:
             print("Packed %d bytes" % (self.imager.get_total_bytes()))
+            for line in volume.get_frag_info():
+                print(line)
         return 0
 
 
@@ -314,7 +320,7 @@ class RepackCmd(Command):
         return self.repacker.create_out_blkdev(image_file)
 
     def init_vol(self, blkdev):
-        return self.repacker.create_out_volume(blkdev)
+        return self.repacker.create_out_volume(blkdev, self.args.alloc_policy)
 
     def handle_vol(self, vol):
         self.repacker.repack()
@@ -407,6 +413,24 @@ class InfoCmd(Command):
         return 0
 
 
+class FragCmd(Command):
+    def handle_vol(self, vol):
+        if "files" in self.opts:
+            for node in vol.get_files():
+                extents = node.get_block_extents()
+                print(
+                    "%-40s  %4d  %s"
+                    % (
+                        node.get_node_path_name(),
+                        len(extents),
+                        " ".join("%d+%d" % extent for extent in extents),
+                    )
+                )
+        for line in vol.get_frag_info():
+            print(line)
+        return 0
+
+
 # ----- Edit Image -----
 
 
@@ -875,6 +899,7 @@ def main(args=None, defaults=None):
         "boot": BootCmd,
         "root": RootCmd,
         "info": InfoCmd,
+        "frag": FragCmd,
         "relabel": RelabelCmd,
     }
 
@@ -903,6 +928,13 @@ def main(args=None, defaults=None):
         default=False,
         help="force overwrite existing image",
     )
+    parser.add_argument(
+        "-a",
+        "--alloc-policy",
+        choices=ALLOC_POLICIES,
+        default=ALLOC_FIRST_FIT,
+        help="how blocks are allocated for new files",
+    )
     if defaults:
         parser.set_defaults(defaults)
     args = parser.parse_args(args)
@@ -42,7 +42,7 @@ object format.
 
 -- Mount Image --
 
-A mount image is a file that serves as a FAT32 formatted container.
+A mount image is a file that serves as a FAT formatted container.
 It can be mounted on a directory in a Linux filesystem, manipulated
 with mtools and, most importantly, mounted as a mass storage device
 through USB On-The-Go using the g_mass_storage Kernel module.
@@ -72,14 +72,42 @@ to a generic URL handler which tries to see if there's a static file
 or a web page that matches the requested path. If yes, then this
 static file or web page is served. If there's no such fall-back,
 then 404 is returned.
+
+
+== Conditional Requests ==
+
+The listings of the zones, the mount image contents, the mount state
+and the file-system stats are returned with an ETag header. Clients
+that send the ETag back in the If-None-Match header get an empty
+response with code 304 if the data hasn't changed since.
+
+
+== Jobs ==
+
+Packing mount images, creating ADFs and quickmounting run as jobs
+in a small pool of workers, so that only a few of them use the storage
+at the same time. By default the request waits for its job to finish.
+With the 'async=1' query arg the request returns 202 right away with
+a Job object, and the job's progress can be followed, and the job
+cancelled, through the /jobs endpoints.
+
+
+== Events ==
+
+Instead of polling, clients can listen to the server-sent events
+of /events to learn when the mount state, the jobs or the zones change.
 '''
-from flask import jsonify, Blueprint
+import json
 
-from . import storage, version
+from flask import jsonify, request, Blueprint, Response
+
+from . import events, storage, version, watcher
+from .apiutil import apierr, conditional
 from .config import config
 
 # Import APIs so that they can mount their routes
 from .adf.api import api as adf_api
+from .jobs.api import api as jobs_api
 from .mount.api import api as mount_api
 from .mountimg.api import api as mountimg_api
 from .quickmount.api import api as quickmount_api
@@ -88,7 +116,7 @@ from .upload.api import api as upload_api
 
 
 api = Blueprint("api", __name__, url_prefix="/api")
-for subapi in [adf_api, mount_api, mountimg_api, quickmount_api,
+for subapi in [adf_api, jobs_api, mount_api, mountimg_api, quickmount_api,
                selfcheck_api, upload_api]:
     api.register_blueprint(subapi)
 
@@ -114,11 +142,105 @@ def get_free_space():
     mount_points = set([storage.mount_point(p) for p in paths])
     fs_stats = [storage.fs_stats(mp) for mp in mount_points]
     fs_stats = sorted(fs_stats, key=lambda ss: ss.name)
-    return jsonify([{
+    return conditional(fs_stats, lambda: jsonify([{
         'name': fs.name,
         'total': fs.total,
         'avail': fs.avail
-    } for fs in fs_stats])
+    } for fs in fs_stats]))
+
+
+@api.route("/changes", methods=['GET'])
+def get_changes():
+    '''Change sequence numbers of the zones.
+
+    The numbers grow each time a file is added, removed, renamed or
+    modified in any zone, also by programs other than adfotg. Clients
+    can poll this cheaply to learn if they should list the zone again.
+
+    Returns: an object {
+      seq: int; sequence number of the last change in any zone
+      zones: {
+        adf: int; sequence number of the last change in ADF library
+        upload: int; ... in the upload zone
+        mountimg: int; ... in the mount images zone
+      }
+    }
+    A zone's number is null if its directory doesn't exist.
+    '''
+    zone_watcher = watcher.get_watcher()
+    generations = zone_watcher.generations()
+    return jsonify(
+        seq=zone_watcher.seq,
+        zones={zone: generations.get(dirpath)
+               for zone, dirpath in watcher.zone_dirs().items()}
+    )
+
+
+@api.route("/events", methods=['GET'])
+def get_events():
+    '''Stream of server-sent events (text/event-stream) of the changes.
+
+    Each event has an id, a type and a JSON object as data:
+
+    - mount -- the mount state has changed; {
+        status: a MountStatus value as string, as in GET /mount
+        file: string or null; name of the mounted image
+      }
+    - job -- a job has been queued, started, has made progress or has
+      finished; a Job object as in GET /jobs/<id>. Progress events
+      are sent at most twice a second for each job.
+    - zone -- files in a zone have changed; {
+        zone: string; adf, upload or mountimg
+        seq: int; the zone's new number, as in GET /changes
+      }
+      The listings of the zone, and the /filesystem stats, should be
+      fetched again.
+    - resync -- some events were lost, because the client was too
+      slow or it reconnected too late; everything should be fetched
+      again.
+
+    Each client of the stream takes one of the server's threads for
+    as long as it's connected, so the stream serves at most half as many
+    clients as there are 'server_threads'. Other clients get 503.
+
+    The events are sent as they happen, from the moment the client
+    connects. Clients should connect before they fetch what they show,
+    so that they don't miss any change. A client that reconnects with
+    the Last-Event-ID header gets the events that it has missed, or
+    a resync if the server has been restarted since.
+    A comment is sent every 15 seconds when there are no events,
+    to keep the connection alive.
+    '''
+    # Zones send their events only when they are watched.
+    watcher.get_watcher()
+    last_id = request.headers.get("Last-Event-ID") or None
+    subscription = events.subscribe(
+        last_id, limit=config.server_threads // 2)
+    if subscription is None:
+        return apierr(503, "too many clients are listening to the events")
+
+    def stream():
+        yield "retry: 5000\n\n"
+        while True:
+            event = subscription.get(timeout=_EVENTS_KEEPALIVE)
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            message = "event: {}\ndata: {}\n\n".format(
+                event.type, json.dumps(event.data))
+            if event.id is not None:
+                message = "id: {}\n".format(events.event_id(event)) \
+                    + message
+            yield message
+    response = Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"})
+    # Also when the stream is closed before it has started.
+    response.call_on_close(subscription.close)
+    return response
+
+
+_EVENTS_KEEPALIVE = 15
 
 
 @api.route("/version")
@@ -1,9 +1,17 @@
-from flask import jsonify
+import hashlib
+import os
+import secrets
+
+from flask import jsonify, make_response, request, url_for
 from werkzeug.utils import safe_join
 
-from adfotg import storage
+from adfotg import jobs, storage, watcher
 from adfotg.error import ActionError
 
+# Mixed into the ETags, because the zone generations start over in
+# every process and could repeat for different contents after a restart.
+_BOOT_TOKEN = secrets.token_hex(8)
+
 
 class Listing:
     def __init__(self, request):
@@ -21,21 +29,33 @@ class Listing:
         limit = self._request.args.get("limit")
         return self._validate_start(start), self._validate_limit(limit)
 
-    def filter_name(self, name):
+    @property
+    def name_pattern(self):
         pattern = self._request.args.get("filter")
         if pattern:
-            pattern = pattern.strip().lower()
-            if pattern:
-                return pattern in name.lower()
-        return True
+            pattern = pattern.strip()
+        return pattern or None
 
-    def limit(self, list_):
+    def query(self, dirpath):
+        '''List the directory as requested.
+
+        Returns: a tuple of a list of FileEntry dicts and the total
+        amount of files matching the filter.
+        '''
         start, limit = self.pagination
-        if start is not None:
-            list_ = list_[start:]
-        if limit is not None:
-            list_ = list_[:limit]
-        return list_
+        return storage.query(dirpath, name_pattern=self.name_pattern,
+                             sort=self.sorting, start=start, limit=limit)
+
+    def response(self, dirpath):
+        '''Respond with the listing of the directory, or with 304 if
+        the client's listing is still up to date.
+        '''
+        self.pagination  # validate before the client gets a 304
+
+        def build():
+            entries, total = self.query(dirpath)
+            return jsonify(listing=entries, total=total)
+        return conditional(zone_generation(dirpath), build)
 
     def _validate_start(self, start):
         if start is not None:
@@ -66,6 +86,70 @@ def apierr(code, message):
     )
 
 
+def conditional(etag_source, build):
+    '''Build the response only if the client's copy is outdated.
+
+    etag_source -- any value with a stable repr() that changes whenever
+      the response would change; the ETag is derived from it
+    build -- function that builds the response; it's not called if
+      the client's If-None-Match matches the ETag
+
+    Returns: the response, or an empty 304 response.
+    '''
+    etag = hashlib.sha1(repr((_BOOT_TOKEN, request.full_path,
+                              etag_source)).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    # Let the browsers cache, but revalidate each time.
+    response.cache_control.no_cache = True
+    return response
+
+
+def run_job(kind, func, respond=lambda result: ""):
+    '''Run the operation as a job.
+
+    kind -- what the job does, reported by the jobs API
+    func -- func(progress) that performs the operation
+    respond -- builds the response from what func returns
+
+    With the 'async' query arg set to 1, the response is 202 with the
+    Job object and its URL in the Location header, and the job runs
+    in the background. Otherwise, the job is waited for and the response
+    is the same as if the operation was run directly.
+    '''
+    if request.args.get("async") in ("1", "true", "yes"):
+        job = jobs.submit(kind, func)
+        response = jsonify(job.info())
+        response.status_code = 202
+        response.headers["Location"] = url_for("api.jobs.get_job",
+                                               job_id=job.id)
+        return response
+    return respond(jobs.run(kind, func))
+
+
+def zone_generation(dirpath):
+    '''A value that changes whenever the files in the zone change.'''
+    generation = watcher.get_watcher().generations().get(dirpath)
+    if generation is None:
+        try:
+            generation = os.stat(dirpath).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return generation
+
+
+def file_generation(filepath):
+    '''A value that changes whenever the file changes.'''
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
 def del_files(dirpath, filenames):
     deleted = []
     for filename in filenames:
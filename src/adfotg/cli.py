@@ -1,5 +1,5 @@
 # coding: utf-8
-from . import config, version
+from . import config, quickmount, version, watcher
 from .os_install import install, InstallError
 import adfotg
 
@@ -34,9 +34,11 @@ def main():
         except config.ConfigError as cfg_error:
             print(cfg_error, file=sys.stderr)
             exit(1)
+        watcher.get_watcher()
+        quickmount.prepare_in_background()
         # Run app.
         port = options.port or config.config.port
-        adfotg.app.run(host='0.0.0.0', port=port)
+        serve(port)
     finally:
         if profile_file:
             # If profiling was enabled, stop it and generate reports.
@@ -47,6 +49,32 @@ def main():
                 yappi.get_thread_stats().print_all(threads_file)
 
 
+def serve(port):
+    '''Serve the app with waitress, unless the development server
+    is configured or waitress is not installed.
+    '''
+    server = config.config.server
+    waitress = None
+    if server != "development":
+        try:
+            import waitress
+        except ImportError:
+            if server == "waitress":
+                print("waitress is not installed; install it or set "
+                      "'server = development'", file=sys.stderr)
+                exit(1)
+    if waitress is None:
+        print("serving with the development server", file=sys.stderr)
+        adfotg.app.run(host='0.0.0.0', port=port, threaded=True)
+        return
+    print("serving with waitress, {} threads".format(
+        config.config.server_threads), file=sys.stderr)
+    waitress.serve(adfotg.app, host='0.0.0.0', port=port,
+                   threads=config.config.server_threads,
+                   connection_limit=config.config.server_connection_limit,
+                   ident=version.SHORTNAME)
+
+
 def print_version(file=sys.stderr):
     print("{} ({}) {} ({})".format(
         version.FULLNAME, version.SHORTNAME,
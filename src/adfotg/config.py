@@ -23,6 +23,22 @@ DEFAULT_ADF_DIR = os.path.join(_DATA_DIR, 'adf')
 DEFAULT_UPLOAD_DIR = os.path.join(_DATA_DIR, 'upload')
 DEFAULT_WORK_DIR = _DATA_DIR
 
+ADF_BUILDERS = ["native", "xdftool"]
+DEFAULT_ADF_BUILDER = ADF_BUILDERS[0]
+
+ADF_ALLOC_POLICIES = ["first-fit", "best-fit", "legacy"]
+DEFAULT_ADF_ALLOC_POLICY = ADF_ALLOC_POLICIES[0]
+
+MOUNTIMG_BUILDERS = ["native", "mtools"]
+DEFAULT_MOUNTIMG_BUILDER = MOUNTIMG_BUILDERS[0]
+
+MOUNTERS = ["modprobe", "configfs"]
+DEFAULT_MOUNTER = MOUNTERS[0]
+DEFAULT_CONFIGFS_DIR = '/sys/kernel/config'
+
+SERVERS = ["auto", "waitress", "development"]
+DEFAULT_SERVER = SERVERS[0]
+
 
 class ConfigError(error.AdfotgError):
     pass
@@ -34,6 +50,16 @@ class _Config:
         self.adf_dir = DEFAULT_ADF_DIR
         self.upload_dir = DEFAULT_UPLOAD_DIR
         self.work_dir = DEFAULT_WORK_DIR
+        self.adf_builder = DEFAULT_ADF_BUILDER
+        self.adf_alloc_policy = DEFAULT_ADF_ALLOC_POLICY
+        self.mountimg_builder = DEFAULT_MOUNTIMG_BUILDER
+        self.preallocate_images = False
+        self.mounter = DEFAULT_MOUNTER
+        self.configfs_dir = DEFAULT_CONFIGFS_DIR
+        self.max_jobs = 1
+        self.server = DEFAULT_SERVER
+        self.server_threads = 8
+        self.server_connection_limit = 100
 
     def load(self, parser):
         SECTION = _PROGNAME
@@ -44,22 +70,55 @@ class _Config:
             expanded_path = os.path.expanduser(path_from_cfg)
             setattr(self, attr, expanded_path)
 
+        def _load_choice(attr, choices):
+            value = parser.get(SECTION, attr, fallback=getattr(self, attr))
+            if value not in choices:
+                raise ConfigError(
+                    "invalid '{}' value '{}'; valid values: {}".format(
+                        attr, value, ', '.join(choices)))
+            setattr(self, attr, value)
+
         self.port = parser.getint(SECTION, 'port', fallback=self.port)
+        self.preallocate_images = parser.getboolean(
+            SECTION, 'preallocate_images', fallback=self.preallocate_images)
+        self.max_jobs = parser.getint(
+            SECTION, 'max_jobs', fallback=self.max_jobs)
+        if self.max_jobs < 1:
+            raise ConfigError("'max_jobs' must be 1 or greater")
+        self.server_threads = parser.getint(
+            SECTION, 'server_threads', fallback=self.server_threads)
+        self.server_connection_limit = parser.getint(
+            SECTION, 'server_connection_limit',
+            fallback=self.server_connection_limit)
+        if self.server_threads < 1 or self.server_connection_limit < 1:
+            raise ConfigError("'server_threads' and 'server_connection_limit'"
+                              " must be 1 or greater")
         _load('adf_dir')
         _load('upload_dir')
         _load('work_dir')
+        _load('configfs_dir')
+        _load_choice('adf_builder', ADF_BUILDERS)
+        _load_choice('adf_alloc_policy', ADF_ALLOC_POLICIES)
+        _load_choice('mountimg_builder', MOUNTIMG_BUILDERS)
+        _load_choice('mounter', MOUNTERS)
+        _load_choice('server', SERVERS)
 
     @property
     def mount_images_dir(self):
         return os.path.join(self.work_dir, "mount_images")
 
+    @property
+    def cache_dir(self):
+        return os.path.join(self.work_dir, "cache")
+
     @property
     def all_workspace_dirs(self):
         return [
             self.work_dir,
             self.adf_dir,
             self.upload_dir,
-            self.mount_images_dir
+            self.mount_images_dir,
+            self.cache_dir
         ]
 
 
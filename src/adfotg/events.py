@@ -0,0 +1,141 @@
+'''Event bus behind the server-sent events of GET /api/events.
+
+Parts of the app publish an event when the mount state changes, when
+a job makes progress or when the files in a zone change. Each client
+of the stream has its own queue of events. A client that doesn't keep
+up, or that reconnects after too many events, gets a 'resync' event
+instead of the events that it has missed, and should then reload
+everything that it shows. The event ids are unique to the process,
+so a client that reconnects after a restart gets a 'resync' too.
+'''
+import secrets
+import threading
+from collections import deque, namedtuple
+
+# Events remembered for the clients that reconnect.
+HISTORY_SIZE = 256
+# Events queued for a client before it's told to resync.
+QUEUE_SIZE = 256
+
+Event = namedtuple("Event", ["id", "type", "data"])
+
+RESYNC = Event(None, "resync", None)
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boot = secrets.token_hex(4)
+        self._seq = 0
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._subscriptions = set()
+
+    def publish(self, type, data):
+        '''Send the event to all subscribers; never blocks for long.'''
+        with self._lock:
+            self._seq += 1
+            event = Event(self._seq, type, data)
+            self._history.append(event)
+            for subscription in self._subscriptions:
+                subscription._put(event)
+
+    def subscribe(self, last_id=None, limit=None):
+        '''Subscribe to the events published from now on.
+
+        last_id -- event_id() of the last event that the subscriber
+          has received before; the events published since are queued
+          right away
+        limit -- maximum number of subscribers, None for no limit
+
+        Returns: a Subscription, or None if there already are limit
+        subscribers; close the Subscription when done.
+        '''
+        last_seq = self._parse_id(last_id)
+        subscription = Subscription(self)
+        with self._lock:
+            if limit is not None and len(self._subscriptions) >= limit:
+                return None
+            if last_id is not None and last_seq != self._seq:
+                if (last_seq is None or not self._history
+                        or last_seq > self._seq
+                        or self._history[0].id > last_seq + 1):
+                    subscription._lost = True
+                else:
+                    for event in self._history:
+                        if event.id > last_seq:
+                            subscription._put(event)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def event_id(self, event):
+        '''The id of the event as sent to the clients.'''
+        return "{}.{}".format(self._boot, event.id)
+
+    def _parse_id(self, event_id):
+        '''The event number from event_id(), or None if the id is
+        malformed or comes from another process.
+        '''
+        if event_id is None:
+            return None
+        boot, _, seq = event_id.partition(".")
+        if boot != self._boot or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+
+class Subscription:
+    def __init__(self, bus):
+        self._bus = bus
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._lost = False
+
+    def get(self, timeout=None):
+        '''Wait for the next event.
+
+        Returns: the Event, RESYNC if some events were lost, or None
+        on timeout.
+        '''
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self._lost, timeout)
+            if self._lost:
+                self._lost = False
+                return RESYNC
+            return self._queue.popleft() if self._queue else None
+
+    def close(self):
+        self._bus._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _put(self, event):
+        with self._cond:
+            if len(self._queue) >= QUEUE_SIZE:
+                self._queue.clear()
+                self._lost = True
+            elif not self._lost:
+                self._queue.append(event)
+            self._cond.notify()
+
+
+bus = EventBus()
+
+
+def publish(type, data):
+    bus.publish(type, data)
+
+
+def subscribe(last_id=None, limit=None):
+    return bus.subscribe(last_id, limit)
+
+
+def event_id(event):
+    return bus.event_id(event)
@@ -0,0 +1,187 @@
+'''Persistent index of the files stored in the app's zones.
+
+The index keeps the metadata of the files in a SQLite database, so
+that the listings can be filtered, sorted and paginated with indexed
+queries, and so that the zones don't have to be rescanned when adfotg
+starts. It's the backing store of the watcher's zone views, which keep
+it up to date as the files change. A zone is rescanned at the start
+only if its directory's mtime differs from the one stored in the index,
+which happens whenever a file was added, removed or renamed in it.
+Files modified in place while adfotg wasn't running don't change the
+directory's mtime and are noticed only when they change again.
+'''
+import os
+import sqlite3
+import sys
+import time
+
+from adfotg.config import config
+
+_INDEX_FILENAME = "index.sqlite3"
+
+# Directory mtimes this recent are not stored, because a change in
+# the same mtime tick could be missed.
+_RACY_NS = 2 * 10**9
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS zones (
+    dirpath TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    dirpath TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    checksum TEXT,
+    label TEXT,
+    PRIMARY KEY (dirpath, name)
+);
+CREATE INDEX IF NOT EXISTS files_by_name ON files (dirpath, name_key, name);
+CREATE INDEX IF NOT EXISTS files_by_size ON files (dirpath, size);
+CREATE INDEX IF NOT EXISTS files_by_mtime ON files (dirpath, mtime);
+'''
+
+_SORT_COLUMNS = {
+    "name": "name_key",
+    "size": "size",
+    "mtime": "mtime",
+}
+
+
+class FileIndex:
+    '''The files of the directories, in a SQLite database.
+
+    The index is not thread-safe; its users serialize the calls.
+    '''
+    def __init__(self, dbpath=":memory:"):
+        self.dbpath = dbpath
+        self._db = self._connect()
+
+    def close(self):
+        self._db.close()
+
+    def query(self, dirpath, name_pattern=None, sort_field="name",
+              ascending=True, start=None, limit=None):
+        '''Query the files in the directory.
+
+        name_pattern -- lower-case substring that the lower-cased
+          file names must contain; None matches all files.
+        sort_field -- "name", "size" or "mtime"
+
+        Returns: a tuple of a list of (name, size, mtime) tuples and
+        the total amount of files matching the pattern, regardless
+        of start and limit.
+        '''
+        where = "dirpath = ?"
+        args = [dirpath]
+        if name_pattern:
+            where += " AND instr(name_key, ?) > 0"
+            args.append(name_pattern)
+        direction = "ASC" if ascending else "DESC"
+        order = "{col} {dir}, name_key {dir}, name {dir}".format(
+            col=_SORT_COLUMNS[sort_field], dir=direction)
+        total = self._db.execute(
+            "SELECT COUNT(*) FROM files WHERE " + where, args).fetchone()[0]
+        rows = self._db.execute(
+            "SELECT name, size, mtime FROM files WHERE {} "
+            "ORDER BY {} LIMIT ? OFFSET ?".format(where, order),
+            args + [-1 if limit is None else limit, start or 0]
+        ).fetchall()
+        return rows, total
+
+    def get(self, dirpath, name):
+        '''Returns: a (name, size, mtime) tuple or None if there's
+        no such file.
+        '''
+        return self._db.execute(
+            "SELECT name, size, mtime FROM files "
+            "WHERE dirpath = ? AND name = ?", (dirpath, name)).fetchone()
+
+    def names(self, dirpath):
+        return [name for name, in self._db.execute(
+            "SELECT name FROM files WHERE dirpath = ?", (dirpath,))]
+
+    def put(self, dirpath, row):
+        with self._db:
+            self._put(dirpath, row)
+
+    def delete(self, dirpath, name):
+        '''Returns: True if the file was in the index.'''
+        with self._db:
+            return self._db.execute(
+                "DELETE FROM files WHERE dirpath = ? AND name = ?",
+                (dirpath, name)).rowcount > 0
+
+    def replace(self, dirpath, rows):
+        '''Replace all files of the directory with the rows, keeping
+        the checksums and labels of the files that haven't changed.
+        '''
+        indexed = {row[0]: tuple(row) for row in self._db.execute(
+            "SELECT name, size, mtime FROM files WHERE dirpath = ?",
+            (dirpath,))}
+        with self._db:
+            for row in rows:
+                if indexed.pop(row[0], None) != row:
+                    self._put(dirpath, row)
+            self._db.executemany(
+                "DELETE FROM files WHERE dirpath = ? AND name = ?",
+                [(dirpath, name) for name in indexed])
+
+    def dir_mtime(self, dirpath):
+        '''Returns: the mtime of the directory when the index was last
+        known to be complete, or None.
+        '''
+        row = self._db.execute("SELECT mtime_ns FROM zones WHERE dirpath = ?",
+                               (dirpath,)).fetchone()
+        return row[0] if row else None
+
+    def set_dir_mtime(self, dirpath, mtime_ns):
+        '''Store the mtime of the directory whose files are all indexed;
+        None if they might not be.
+        '''
+        if mtime_ns is not None and time.time_ns() - mtime_ns < _RACY_NS:
+            mtime_ns = None
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO zones (dirpath, mtime_ns) "
+                "VALUES (?, ?)", (dirpath, mtime_ns))
+
+    def _put(self, dirpath, row):
+        name, size, mtime = row
+        self._db.execute(
+            "INSERT OR REPLACE INTO files "
+            "(dirpath, name, name_key, size, mtime) VALUES (?, ?, ?, ?, ?)",
+            (dirpath, name, name.lower(), size, mtime))
+
+    def _connect(self):
+        try:
+            return self._open()
+        except sqlite3.DatabaseError:
+            # The index holds nothing that can't be rebuilt.
+            os.unlink(self.dbpath)
+            return self._open()
+
+    def _open(self):
+        db = sqlite3.connect(self.dbpath, check_same_thread=False)
+        try:
+            db.executescript(_SCHEMA)
+        except Exception:
+            db.close()
+            raise
+        return db
+
+
+def open_index():
+    '''Open the FileIndex stored in the configured cache dir. If it
+    can't be opened, the files are indexed in memory only.
+    '''
+    dbpath = os.path.join(config.cache_dir, _INDEX_FILENAME)
+    try:
+        os.makedirs(config.cache_dir, exist_ok=True)
+        return FileIndex(dbpath)
+    except (OSError, sqlite3.Error) as e:
+        print("cannot open the file index '{}': {}".format(dbpath, e),
+              file=sys.stderr)
+        return FileIndex()
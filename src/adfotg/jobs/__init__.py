@@ -0,0 +1,232 @@
+'''Background jobs for the long-running operations.
+
+Packing a mount image or building ADFs can take longer than a client
+is willing to wait for a response. Such operations run as jobs in
+a small pool of worker threads, which reports their progress and
+lets them be cancelled. The pool is capped by the 'max_jobs' config
+option, because the jobs are bound by the SD card, not by the CPU,
+and running many of them at once only makes all of them slower.
+
+A job reports its progress by calling progress(done, total) with the
+number of bytes processed so far and the total number of bytes. This
+call raises JobCancelled if the job was cancelled, which aborts
+the operation at that point. The changes of the job's state and its
+progress are published as 'job' events.
+'''
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+from adfotg import events
+from adfotg.config import config
+from adfotg.error import ActionError
+
+# Finished jobs are remembered, so that their clients can learn
+# the result, but only this many of them.
+KEEP_FINISHED = 100
+
+# Progress events of a job are published at most this often, in seconds.
+PROGRESS_EVENT_INTERVAL = 0.5
+
+
+class JobState(Enum):
+    Queued = "queued"
+    Running = "running"
+    Done = "done"
+    Failed = "failed"
+    Cancelled = "cancelled"
+
+
+_FINISHED_STATES = (JobState.Done, JobState.Failed, JobState.Cancelled)
+
+
+class JobCancelled(ActionError):
+    pass
+
+
+class Job:
+    def __init__(self, kind, func):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = JobState.Queued
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.exception = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._func = func
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._published = 0
+
+    @property
+    def is_finished(self):
+        return self.state in _FINISHED_STATES
+
+    def progress(self, done, total=None):
+        '''Report the progress; raises JobCancelled if the job
+        was cancelled.
+        '''
+        if self._cancelled.is_set():
+            raise JobCancelled("job was cancelled")
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+        now = time.monotonic()
+        if now - self._published >= PROGRESS_EVENT_INTERVAL:
+            self._published = now
+            self.publish()
+
+    def cancel(self):
+        '''Cancel the job. A queued job is cancelled right away,
+        a running one at its next progress report.
+        '''
+        self._cancelled.set()
+        with self._lock:
+            if self.state != JobState.Queued:
+                return
+            self._finish(JobState.Cancelled)
+        self.publish()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def run(self):
+        with self._lock:
+            if self.state != JobState.Queued:
+                return
+            self.state = JobState.Running
+            self.started = time.time()
+        self.publish()
+        try:
+            result = self._func(self.progress)
+        except JobCancelled as e:
+            self.exception = e
+            state = JobState.Cancelled
+        except Exception as e:
+            traceback.print_exc()
+            self.exception = e
+            state = JobState.Failed
+        else:
+            self.result = result
+            state = JobState.Done
+        with self._lock:
+            self._finish(state)
+        self.publish()
+        print("job {} {} {} in {:.3f}s".format(
+            self.kind, self.id, self.state.value,
+            self.finished - self.started), file=sys.stderr)
+
+    def _finish(self, state):
+        self.state = state
+        self.finished = time.time()
+        self._func = None
+        self._finished.set()
+
+    def publish(self):
+        events.publish("job", self.info())
+
+    def info(self):
+        '''Returns: a Job dict as described by the jobs API.'''
+        with self._lock:
+            info = {
+                "id": self.id,
+                "kind": self.kind,
+                "state": self.state.value,
+                "done": self.done,
+                "total": self.total,
+                "percent": (min(100, 100 * self.done // self.total)
+                            if self.total else None),
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+            }
+            if self.state == JobState.Done:
+                info["result"] = self.result
+            elif self.exception is not None:
+                info["error"] = str(self.exception)
+                info["code"] = (400 if isinstance(self.exception, ActionError)
+                                else 500)
+            return info
+
+
+class JobQueue:
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix="job")
+
+    def submit(self, kind, func):
+        '''Queue func(progress) to be run by a worker.
+
+        Returns: the Job.
+        '''
+        job = Job(kind, func)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.publish()
+        self._pool.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self._jobs[job_id]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    '''Returns: the JobQueue with the configured number of workers.'''
+    global _queue
+    with _queue_lock:
+        if _queue is None or _queue.workers != config.max_jobs:
+            _queue = JobQueue(config.max_jobs)
+        return _queue
+
+
+def submit(kind, func):
+    '''Run func(progress) in the background.
+
+    Returns: the Job.
+    '''
+    return get_queue().submit(kind, func)
+
+
+def run(kind, func):
+    '''Run func(progress) as a job and wait for it to finish.
+
+    Returns: what func returns; raises what func raises.
+    '''
+    job = submit(kind, func)
+    job.wait()
+    if job.exception is not None:
+        raise job.exception
+    return job.result
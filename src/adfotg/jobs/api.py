@@ -0,0 +1,79 @@
+from flask import jsonify, Blueprint
+
+from adfotg.apiutil import apierr
+from adfotg.jobs import get_queue
+
+
+api = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+
+@api.route("", methods=["GET"])
+def list_jobs():
+    '''List the jobs, both the unfinished and the recently finished ones.
+
+    Returns: a list of Job objects, oldest first.
+    '''
+    return jsonify([job.info() for job in get_queue().list()])
+
+
+@api.route("/<job_id>", methods=["GET"])
+def get_job(job_id):
+    '''Get the state and progress of a job.
+
+    URL args:
+    - job_id -- the id of the job
+
+    Returns: Job object {
+      id: string
+      kind: string; what the job does, e.g. 'pack_adfs'
+      state: string; one of queued, running, done, failed, cancelled
+      done: int; bytes processed so far
+      total: int or null; bytes to process in total, if known
+      percent: int or null; done as a percentage of total
+      created: number; when the job was submitted, in seconds since
+          the 1970 epoch
+      started: number or null; when the job started to run
+      finished: number or null; when the job finished
+      result: optional; present only if the job is done; this is the
+          same thing that the operation returns when it's requested
+          without 'async'
+      error: string, optional; present if the job failed or was
+          cancelled
+      code: int, optional; the HTTP error code that the operation would
+          have returned without 'async'
+    }
+
+    Errors:
+    - 404 -- if there's no such job
+    '''
+    job = get_queue().get(job_id)
+    if job is None:
+        return apierr(404, "job not found")
+    return jsonify(job.info())
+
+
+@api.route("/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    '''Cancel an unfinished job or forget a finished one.
+
+    A queued job is cancelled right away. A running job stops as soon
+    as it reports its progress next; the operation's partial results
+    are discarded.
+
+    URL args:
+    - job_id -- the id of the job
+
+    Returns: Job object, as by GET /jobs/<job_id>.
+
+    Errors:
+    - 404 -- if there's no such job
+    '''
+    queue = get_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return apierr(404, "job not found")
+    if job.is_finished:
+        queue.forget(job_id)
+    else:
+        job.cancel()
+    return jsonify(job.info())
@@ -2,10 +2,15 @@ import os
 import platform
 import shlex
 import subprocess
+import sys
+import threading
 from enum import Enum
 
+from adfotg import events
+from adfotg.config import config
 from adfotg.error import ActionError
 from adfotg.mountimg import MountImage
+from adfotg.util import Interpretable
 
 
 class MountStatus(Enum):
@@ -16,6 +21,17 @@ class MountStatus(Enum):
     OtherImageMounted = "other_image_mounted"
 
 
+class Mounter(Interpretable, Enum):
+    '''How the mount images are presented to the USB host.
+
+    MODPROBE loads the g_mass_storage module with the image and
+    unloads it to unmount; CONFIGFS sets up a USB gadget through
+    configfs once and then only changes the medium of its LUN.
+    '''
+    MODPROBE = "modprobe"
+    CONFIGFS = "configfs"
+
+
 class Mount:
     @classmethod
     def current(cls):
@@ -63,12 +79,18 @@ class Mount:
             raise ActionError("an image is already mounted; unmount it first")
         elif mount_state == MountStatus.NoImage:
             raise ActionError("image doesn't exist, cannot mount")
-        self._mounter.mount(self._mountimage.imagefile)
+        try:
+            self._mounter.mount(self._mountimage.imagefile)
+        finally:
+            _publish_mount_state()
 
     def unmount(self):
         if self.state() != MountStatus.Mounted:
             raise ActionError("cannot unmount when not mounted")
-        self._mounter.unmount()
+        try:
+            self._mounter.unmount()
+        finally:
+            _publish_mount_state()
 
     def list(self):
         if self._mountimage.exists():
@@ -108,6 +130,183 @@ class _RealMount:
         subprocess.check_call(['sudo', 'modprobe', '-r', 'g_mass_storage'])
 
 
+class _ConfigfsMount:
+    '''USB mass storage gadget made through configfs (libcomposite).
+
+    The gadget is set up once, with root privileges, and its LUN's
+    'file' attribute is handed over to the adfotg user. Changing
+    the mounted image is then just a write to this attribute, without
+    reloading any kernel modules.
+
+    The configfs root is configurable, so a plain directory tree can
+    stand in for it where there's no USB device controller. Only such
+    a tree may have its gadget left unbound; on the real configfs,
+    the host wouldn't see any device.
+    '''
+    GADGET = "adfotg"
+    FUNCTION = "mass_storage.usb0"
+    _ID_VENDOR = "0x1d6b"  # Linux Foundation
+    _ID_PRODUCT = "0x0104"  # Multifunction Composite Gadget
+    _UDC_DIR = "/sys/class/udc"
+
+    # Gadgets known to be set up, so that it's checked only once.
+    _ready = set()
+    _setup_lock = threading.Lock()
+
+    def __init__(self, configfs_dir):
+        self._configfs_dir = configfs_dir
+        self._gadget_dir = os.path.join(
+            configfs_dir, "usb_gadget", self.GADGET)
+        self._function_dir = os.path.join(
+            self._gadget_dir, "functions", self.FUNCTION)
+        self._lun_file = os.path.join(self._function_dir, "lun.0", "file")
+
+    def mounted(self):
+        try:
+            with open(self._lun_file, 'r') as f:
+                return f.read().rstrip("\n") or None
+        except FileNotFoundError:
+            return None
+
+    def mount(self, imagefile):
+        self._setup()
+        # The kernel swaps the medium of a removable LUN on its own.
+        self._write_lun(imagefile)
+
+    def unmount(self):
+        if self.mounted() is not None:
+            self._write_lun("")
+
+    def _write_lun(self, value):
+        try:
+            with open(self._lun_file, 'w') as f:
+                f.write(value + "\n")
+        except PermissionError:
+            # The attribute wasn't handed over; write it as root.
+            subprocess.run(['sudo', 'tee', self._lun_file],
+                           input=(value + "\n").encode(),
+                           stdout=subprocess.DEVNULL, check=True)
+        except OSError as e:
+            raise ActionError("cannot change the gadget medium: {}".format(
+                e.strerror)) from e
+
+    def _setup(self):
+        with self._setup_lock:
+            if self._gadget_dir in self._ready:
+                return
+            if not self._is_bound():
+                self._create_gadget()
+            self._ready.add(self._gadget_dir)
+
+    def _is_bound(self):
+        try:
+            with open(os.path.join(self._gadget_dir, "UDC"), 'r') as f:
+                bound = f.read().strip()
+        except FileNotFoundError:
+            return False
+        return bool(bound) and os.path.exists(self._lun_file)
+
+    def _create_gadget(self):
+        udc = self._find_udc()
+        if udc is None and self._is_configfs():
+            raise ActionError("cannot set up USB gadget: no USB device "
+                              "controller found in '{}'".format(self._UDC_DIR))
+        gadget = self._gadget_dir
+        strings = os.path.join(gadget, "strings", "0x409")
+        config_dir = os.path.join(gadget, "configs", "c.1")
+        lun_dir = os.path.dirname(self._lun_file)
+        dirs = [gadget, strings, config_dir, self._function_dir, lun_dir]
+        attrs = [
+            (os.path.join(gadget, "idVendor"), self._ID_VENDOR),
+            (os.path.join(gadget, "idProduct"), self._ID_PRODUCT),
+            (os.path.join(strings, "manufacturer"), "adfotg"),
+            (os.path.join(strings, "product"), "ADF On-The-Go"),
+            (os.path.join(lun_dir, "removable"), "1"),
+            (os.path.join(self._function_dir, "stall"), "0"),
+        ]
+        link = (self._function_dir,
+                os.path.join(config_dir, self.FUNCTION))
+        bind = (os.path.join(gadget, "UDC"), udc)
+        print("setting up USB gadget '{}' on {}".format(
+            gadget, udc or "no USB device controller"), file=sys.stderr)
+        parent = os.path.dirname(gadget)
+        if not os.path.isdir(parent):
+            parent = os.path.dirname(parent)
+        if os.access(parent, os.W_OK):
+            self._create_gadget_directly(dirs, attrs, link, bind)
+        else:
+            self._create_gadget_as_root(dirs, attrs, link, bind)
+
+    def _create_gadget_directly(self, dirs, attrs, link, bind):
+        try:
+            for dirpath in dirs:
+                os.makedirs(dirpath, exist_ok=True)
+            for path, value in attrs:
+                with open(path, 'w') as f:
+                    f.write(value + "\n")
+            if not os.path.lexists(link[1]):
+                os.symlink(*link)
+            if bind[1] is not None:
+                with open(bind[0], 'w') as f:
+                    f.write(bind[1] + "\n")
+        except OSError as e:
+            raise ActionError("cannot set up USB gadget: {}".format(e)) from e
+
+    def _create_gadget_as_root(self, dirs, attrs, link, bind):
+        if bind[1] is None:
+            raise ActionError("cannot set up USB gadget: no USB device "
+                              "controller found in '{}'".format(self._UDC_DIR))
+        q = shlex.quote
+        script = [
+            "set -e",
+            # The legacy gadget would hold the USB device controller.
+            "modprobe -r g_mass_storage || true",
+            "modprobe libcomposite",
+        ]
+        script += ["mkdir -p {}".format(q(dirpath)) for dirpath in dirs]
+        script += ["echo {} > {}".format(q(value), q(path))
+                   for path, value in attrs]
+        script += [
+            "[ -e {1} ] || ln -s {0} {1}".format(q(link[0]), q(link[1])),
+            "echo {} > {}".format(q(bind[1]), q(bind[0])),
+            "chown {} {}".format(os.getuid(), q(self._lun_file)),
+        ]
+        try:
+            subprocess.check_call(['sudo', 'sh', '-c', "\n".join(script)])
+        except subprocess.CalledProcessError as e:
+            raise ActionError("cannot set up USB gadget: {}".format(e)) from e
+
+    def _is_configfs(self):
+        '''Is the configfs root on the real configfs, not a stand-in?'''
+        path = os.path.realpath(self._configfs_dir)
+        fs_type = None
+        longest = -1
+        try:
+            with open("/proc/self/mounts", 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    # Spaces and the like are octal-escaped.
+                    mountpoint = fields[1].encode().decode("unicode_escape")
+                    if (path == mountpoint or path.startswith(
+                            mountpoint.rstrip("/") + "/")) \
+                            and len(mountpoint) > longest:
+                        fs_type = fields[2]
+                        longest = len(mountpoint)
+        except OSError:
+            # Without the mount table, assume the real thing.
+            return True
+        return fs_type == "configfs"
+
+    def _find_udc(self):
+        try:
+            udcs = sorted(os.listdir(self._UDC_DIR))
+        except FileNotFoundError:
+            udcs = []
+        return udcs[0] if udcs else None
+
+
 class _FakeMount:
     # Mount state is global, this is true on the real
     # system, and should be true in the faker as well.
@@ -125,8 +324,19 @@ class _FakeMount:
         self._state['mounted'] = None
 
 
+def _publish_mount_state():
+    mount = Mount.current()
+    events.publish("mount", {
+        "status": mount.state().value,
+        "file": (os.path.basename(mount.imagefile)
+                 if mount.has_image() else None),
+    })
+
+
 def _mk_mounter():
-    if _is_faking_it():
+    if Mounter.interpret(config.mounter) == Mounter.CONFIGFS:
+        return _ConfigfsMount(config.configfs_dir)
+    elif _is_faking_it():
         return _FakeMount()
     else:
         return _RealMount()
@@ -3,7 +3,7 @@ import traceback
 from flask import jsonify, Blueprint
 from werkzeug.utils import safe_join
 
-from adfotg.apiutil import apierr
+from adfotg.apiutil import apierr, conditional, file_generation
 from adfotg.config import config
 from adfotg.error import AdfotgError
 from adfotg.mount import Mount, MountStatus
@@ -49,25 +49,10 @@ def get_mounted_flash_drive():
 
     '''
     mount = Mount.current()
-    imagefile = None
-    listing = []
-    try:
-        if mount.has_image():
-            imagefile = mount.imagefile
-            if not imagefile.startswith(config.mount_images_dir):
-                return jsonify(status=MountStatus.OtherImageMounted.value,
-                               error="mounted image is unknown to the app")
-            imagefile = imagefile[len(config.mount_images_dir):].lstrip("/")
-            listing = mount.list()
-    except AdfotgError as e:
-        traceback.print_exc()
-        return jsonify(status=MountStatus.BadImage.value,
-                       file=imagefile,
-                       error=str(e))
-    else:
-        return jsonify(status=mount.state().value,
-                       file=imagefile,
-                       listing=listing)
+    generation = (file_generation(mount.imagefile)
+                  if mount.has_image() else None)
+    return conditional((mount.imagefile, generation),
+                       lambda: _mount_info(mount))
 
 
 @api.route("/<imgname>", methods=["POST"])
@@ -115,3 +100,25 @@ def unmount_flash_drive():
     else:
         return apierr(400, "cannot unmount as nothing is mounted")
     return 'OK'
+
+
+def _mount_info(mount):
+    imagefile = None
+    listing = []
+    try:
+        if mount.has_image():
+            imagefile = mount.imagefile
+            if not imagefile.startswith(config.mount_images_dir):
+                return jsonify(status=MountStatus.OtherImageMounted.value,
+                               error="mounted image is unknown to the app")
+            imagefile = imagefile[len(config.mount_images_dir):].lstrip("/")
+            listing = mount.list()
+    except AdfotgError as e:
+        traceback.print_exc()
+        return jsonify(status=MountStatus.BadImage.value,
+                       file=imagefile,
+                       error=str(e))
+    else:
+        return jsonify(status=mount.state().value,
+                       file=imagefile,
+                       listing=listing)
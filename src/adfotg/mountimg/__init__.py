@@ -1,13 +1,36 @@
 import os
+import shutil
+import sys
 import time
 import subprocess
+from enum import Enum
 
+from adfotg import storage
+from adfotg.config import config
 from adfotg.error import AdfotgError
+from adfotg.mountimg import fat
+from adfotg.mountimg.manifest import manifests
 from adfotg.storage import FileEntryField
+from adfotg.util import Interpretable
+
+
+class MountImageBuilder(Interpretable, Enum):
+    '''How the mount images are packed.
+
+    NATIVE writes the FAT image in-process, MTOOLS formats it with
+    mkdosfs and copies each file with mcopy.
+    '''
+    NATIVE = "native"
+    MTOOLS = "mtools"
 
 
 class MountImage:
-    '''Requires mtools, because 'mount' requires root and mtools don't.'''
+    '''FAT image with the files for Gotek.
+
+    The images are read and edited in-process, as 'mount' would
+    require root. mtools is needed only to pack them with
+    the mountimg_builder = mtools config option.
+    '''
     # TODO do we need that? How much do we need that?
     _BUFFER_SPACE = 1024 * 1024
     _SECTORS_PER_TRACK = 32
@@ -22,6 +45,7 @@ class MountImage:
         return self._imagefile
 
     def delete(self):
+        manifests.invalidate(self._imagefile)
         try:
             os.unlink(self._imagefile)
         except FileNotFoundError:
@@ -43,139 +67,138 @@ class MountImage:
     def list(self):
         '''
         List contents of the image as FileEntry-compatible list
-        of dicts.
+        of dicts, in the order in which they are stored in the image.
+        '''
+        try:
+            return manifests.get(self._imagefile, self._read_listing)
+        except OSError as e:
+            raise AdfotgError("cannot read image '{}': {}".format(
+                self._imagefile, e.strerror)) from e
+
+    def _read_listing(self):
+        with fat.FatImage(self._imagefile) as image:
+            return [FileEntryField.dictify(entry.name, entry.size,
+                                           entry.mtime)
+                    for entry in image.files()]
+
+    def pack(self, files, builder=None, progress=None):
+        '''Create the image anew with the files in it.
+
+        builder -- a MountImageBuilder; defaults to the configured
+          'mountimg_builder'
+        progress -- optional progress(done, total) callback, called with
+          the number of bytes of the files packed so far
         '''
-        p = subprocess.Popen(['mdir', '-i', self._imagefile],
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = p.communicate()
-        if p.wait() != 0:
-            raise AdfotgError("'mdir' ended with non-zero exit code: {}".format(
-                stderr))
-        stdout = stdout.decode('utf-8')
-        return _MdirParser().parse(stdout)
-
-    def pack(self, files):
         if not isinstance(files, list):
             raise ValueError("files argument must be a list")
-        sum_size = 0
-        for file in files:
-            sum_size += os.path.getsize(file)
-        sum_size -= sum_size % self._SECTOR_ALIGNMENT
+        builder = MountImageBuilder.interpret(
+            builder or config.mountimg_builder)
+        started = time.monotonic()
+        try:
+            if builder == MountImageBuilder.NATIVE:
+                self.delete()
+                fat.build_image(self._imagefile, files,
+                                free_space=self._BUFFER_SPACE,
+                                preallocate=config.preallocate_images,
+                                progress=progress)
+            else:
+                self._pack_mtools(files, progress)
+        finally:
+            manifests.invalidate(self._imagefile)
+        print("packed {} files into '{}' with {} builder in {:.3f}s".format(
+            len(files), self._imagefile, builder.value,
+            time.monotonic() - started), file=sys.stderr)
+
+    def append(self, files, progress=None):
+        '''Add the files at the end of the image without repacking it.
+        The image grows only if it doesn't have enough free space.
+
+        progress -- optional progress(done, total) callback, called with
+          the number of bytes of the files added so far
+        '''
+        self._edit("appended {} files to".format(len(files)),
+                   lambda editor: [editor.add(file) for file in files],
+                   progress)
+
+    def remove(self, names):
+        '''Remove the files from the image without repacking it.'''
+        self._edit("removed {} files from".format(len(names)),
+                   lambda editor: [editor.remove(name) for name in names])
+
+    def reorder(self, names):
+        '''Change the order of the files in the image; only the directory
+        is rewritten.
+        '''
+        self._edit("reordered", lambda editor: editor.reorder(names))
+
+    def _edit(self, what, edit, progress=None):
+        started = time.monotonic()
+        try:
+            editor = fat.FatEditor(self._imagefile,
+                                   preallocate=config.preallocate_images)
+            edit(editor)
+            editor.commit(progress)
+        finally:
+            manifests.invalidate(self._imagefile)
+        print("{} '{}' in {:.3f}s".format(
+            what, self._imagefile, time.monotonic() - started),
+            file=sys.stderr)
+
+    def _pack_mtools(self, files, progress=None):
+        sizes = [os.path.getsize(file) for file in files]
+        total = sum(sizes)
+        sum_size = total - total % self._SECTOR_ALIGNMENT
         sum_size += self._BUFFER_SPACE
         self.delete()
         self._create(size=sum_size)
-        for file in files:
-            subprocess.check_call(['mcopy', '-i', self._imagefile,
-                                   file, '::'])
+        done = 0
+        try:
+            for file, size in zip(files, sizes):
+                if progress:
+                    progress(done, total)
+                subprocess.check_call(['mcopy', '-i', self._imagefile,
+                                       file, '::'])
+                done += size
+            if progress:
+                progress(done, total)
+        except BaseException:
+            self.delete()
+            raise
+
+    def open_file(self, name):
+        '''Open a file inside the image for reading.
+
+        Returns: a seekable binary file object with 'name', 'size' and
+        'mtime' attributes, or None if there's no such file in the image.
+        '''
+        image = fat.FatImage(self._imagefile)
+        try:
+            entry = image.find(name)
+            if entry is None:
+                image.close()
+                return None
+            return fat.FatFileReader(image, entry, close_image=True)
+        except Exception:
+            image.close()
+            raise
 
     def unpack(self, destdir):
-        files = self.list()
-        for file in files:
-            self._mcopy(file, destdir)
+        for file in self.list():
+            name = file[FileEntryField.NAME.value]
+            self.unpack_file(name, os.path.join(destdir, name))
 
     def unpack_file(self, file, destfile):
         if os.path.isdir(destfile):
             raise AdfotgError("target path '{}' is a directory".format(
                 destfile))
-        self._mcopy(file, destfile)
-
-    def _mcopy(self, file, dest):
-        subprocess.check_call(['mcopy', '-i', self._imagefile, '-n',
-                               '::/{}'.format(file), dest])
+        source = self.open_file(file)
+        if source is None:
+            raise AdfotgError("file '{}' not found in the image".format(file))
+        with source, open(destfile, 'wb') as dest:
+            shutil.copyfileobj(source, dest)
 
     def _create(self, size=64 * 1024 * 1024):
         with open(self._imagefile, 'wb') as f:
-            f.write(b'\0' * size)
+            storage.allocate(f, size, config.preallocate_images)
         subprocess.check_call(['mkdosfs', self._imagefile])
 
-
-class _MdirParser:
-    '''
-    Parses output like this one:
-
-      Volume in drive : has no label
-      Volume Serial Number is 6515-5815
-      Directory for ::/
-
-      5years1         901120 2018-12-02  20:30
-      5years1  adf    901120 2018-12-02  20:30
-      adfotg1  adf    901120 2018-12-02  20:30
-      BARBAR~1 ADF    901120 2018-11-24  22:44  Barbarian Plus 6.adf
-      EOBAGA~1 ADF    901120 2018-11-24  22:44  Eob AGA z ppa01.adf
-      GENESIA1 ADF    901120 2018-11-24  22:44  Genesia1.adf
-              3 files           2 703 360 bytes
-                                1 024 000 bytes free
-
-    and returns it as storage.FileEntryField compatible list of dicts.
-    '''
-    def parse(self, output):
-        listing = []
-        has_directory = False
-        for line in output.split("\n"):
-            if not line:
-                continue
-            if "::/" in line:
-                # Detect line that says "Directory for ::/"
-                has_directory = True
-                continue
-            if not has_directory:
-                # Skip until directory listing begins.
-                continue
-            try:
-                entry = self.parse_entry(line)
-            except ValueError:
-                # This may be a bad idea.
-                pass
-            else:
-                if entry is not None:
-                    listing.append(entry)
-        return listing
-
-    def parse_entry(self, line):
-        '''
-        Example entry:
-          BARBAR~1 ADF    901120 2018-11-24  22:44  Barbarian Plus 6.adf
-
-        Another example entry:
-          5years1  adf    901120 2018-12-02  20:30
-
-        Yet another example entry without an extension:
-          5years1         901120 2018-12-02  20:30
-
-
-        The entry without the long name gets listed when the filename
-        fits in the 8.3 DOS limitation and doesn't have a whitespace
-        character.
-        '''
-        DOS_NAME_LEN = 8
-        DOS_EXT_LEN = 3
-        DOS_LEN = DOS_NAME_LEN + 1 + DOS_EXT_LEN  # NAME DOT EXT
-        dos_name = line[:DOS_LEN]
-
-        line = line[DOS_LEN:]
-        size_start_index = self._find_index_of_first_non_space(line, 0)
-        if size_start_index < 0:
-            raise ValueError("cannot parse line '{}' as file entry: "
-                             "size not found".format(line))
-        size_end_index = line.find(' ', size_start_index)
-        size = int(line[size_start_index:size_end_index])
-        line = line[size_end_index + 1:]  # +1 space
-        # Products of a drunken stupor.
-        date = line[:line.find('  ', line.find('  ') + 2)]
-        # Programmers know how to party hard.
-        name = line[len(date) + 2:]
-        if not name:
-            # We have the case where the name fit in the DOS limitations
-            # and we need to parse dos_name.
-            name = dos_name[:DOS_NAME_LEN].strip()
-            ext = dos_name[DOS_NAME_LEN + 1:].rstrip()  # 1 is for the dot
-            if ext:
-                name += "." + ext
-        timestamp = time.mktime(time.strptime(date, "%Y-%m-%d  %H:%M"))
-        return FileEntryField.dictify(name, size, int(timestamp))
-
-    def _find_index_of_first_non_space(self, haystack, start):
-        for i in range(start, len(haystack)):
-            if haystack[i] != ' ':
-                return i
-        return -1
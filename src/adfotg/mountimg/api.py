@@ -1,14 +1,15 @@
+import hashlib
 import os
-import tempfile
-import weakref
 
 from flask import jsonify, request, send_file, \
     send_from_directory, Blueprint
 from werkzeug.utils import safe_join
 
 from adfotg import storage
-from adfotg.apiutil import apierr, Listing
+from adfotg.apiutil import apierr, conditional, file_generation, \
+    run_job, Listing
 from adfotg.config import config
+from adfotg.mount import Mount
 from adfotg.mountimg import MountImage
 
 
@@ -43,13 +44,7 @@ def list_mount_images():
         # App controls this directory so if it doesn't exist
         # it's not necessarilly an error.
         return jsonify([])
-    full_list = storage.listdir(config.mount_images_dir,
-                                name_filter=listing.filter_name,
-                                sort=listing.sorting)
-    return jsonify(
-        listing=listing.limit(full_list),
-        total=len(full_list)
-    )
+    return listing.response(config.mount_images_dir)
 
 
 @api.route("/<imgname>", methods=["GET"])
@@ -82,7 +77,8 @@ def get_mount_image_contents(imgname):
     img = MountImage(safe_join(config.mount_images_dir, imgname))
     if not img.exists():
         return apierr(404, "image not found")
-    return jsonify(img.list())
+    return conditional(file_generation(img.imagefile),
+                       lambda: jsonify(img.list()))
 
 
 @api.route("/<imgname>/stat", methods=["GET"])
@@ -94,13 +90,10 @@ def get_mount_image_stat(imgname):
     Errors:
     - 404 -- if the mount image is not found
     '''
-    listing = Listing(request)
     if os.path.exists(config.mount_images_dir):
-        full_list = storage.listdir(config.mount_images_dir,
-                                    name_filter=lambda name: name == imgname)
-        for entry in full_list:
-            if entry["name"] == imgname:
-                return jsonify(entry)
+        entry = storage.stat(config.mount_images_dir, imgname)
+        if entry is not None:
+            return jsonify(entry)
     return apierr(404, "image not found")
 
 
@@ -114,27 +107,29 @@ def get_file_from_mount_image(imgname, filename):
     - imgname -- name of the image from which the file will be extracted.
     - filename -- name of the file inside the mount image to extract.
 
-    Returns: The file is sent as a HTTP attachment.
+    Returns: The file is sent as a HTTP attachment. Range requests
+    are supported.
 
     Errors:
     - 404 -- if the mount image is not found
+          -- if the file is not found in the mount image
     '''
     img = MountImage(safe_join(config.mount_images_dir, imgname))
     if not img.exists():
         return apierr(404, "image not found")
-
-    def cleanup():
-        tmpf.close()
-    tmpf = tempfile.NamedTemporaryFile()
-    weakref.finalize(tmpf, cleanup)
-    img.unpack_file(filename, tmpf.name)
-    os.fsync(tmpf)
-    tmpf.seek(0)
-    size = os.path.getsize(tmpf.name)
-    response = send_file(tmpf, as_attachment=True,
-                         attachment_filename=filename)
-    response.headers['Content-Length'] = size
-    return response
+    source = img.open_file(filename)
+    if source is None:
+        return apierr(404, "file '{}' not found in the image".format(
+            filename))
+    etag = hashlib.sha1(repr(
+        (file_generation(img.imagefile), source.name)).encode()).hexdigest()
+    response = send_file(source, as_attachment=True,
+                         download_name=source.name,
+                         conditional=False, etag=etag,
+                         last_modified=source.mtime)
+    response.content_length = source.size
+    return response.make_conditional(request, accept_ranges=True,
+                                     complete_length=source.size)
 
 
 @api.route("", methods=["DELETE"])
@@ -198,6 +193,10 @@ def mount_pack_flash_drive_image(imgname):
       Specify only the names here as they are returned
       by GET /adf.
 
+    Query args:
+    - async -- optional; if 1, the packing runs as a background job
+      and the response is 202 with the Job object, see GET /jobs/<id>
+
     Errors:
     - 400 -- if no ADF is specified
           -- if any of the ADFs is not found in the library
@@ -219,5 +218,110 @@ def mount_pack_flash_drive_image(imgname):
     image = MountImage(imagefile)
     if image.exists():
         return apierr(400, "image '{}' already exists".format(imgname))
-    image.pack(adfs_paths)
+    return run_job("pack_adfs", lambda progress: image.pack(
+        adfs_paths, progress=progress))
+
+
+@api.route("/<imgname>/contents", methods=["POST"])
+def append_adfs_to_mount_image(imgname):
+    '''Add ADFs from the ADF library at the end of an existing mount image.
+
+    The image is edited in place; the ADFs already in it are not
+    rewritten. The image grows only if it doesn't have enough free
+    space left.
+
+    Body args:
+    - adfs -- list of ADFs to add, as they are returned by GET /adf.
+
+    Query args:
+    - async -- optional; if 1, the adding runs as a background job
+      and the response is 202 with the Job object, see GET /jobs/<id>
+
+    Errors:
+    - 400 -- if no ADF is specified
+          -- if any of the ADFs is not found in the library
+          -- if any of the ADFs is already in the image
+          -- if the image is mounted
+          -- if the image cannot hold any more ADFs
+    - 404 -- if the mount image is not found
+    '''
+    image, error = _editable_image(imgname)
+    if error:
+        return error
+    adfs = request.get_json().get("adfs")
+    if not adfs:
+        return apierr(400, "no ADFs specified")
+    adfs_paths = [safe_join(config.adf_dir, adf) for adf in adfs]
+    for adf_, adf_path in zip(adfs, adfs_paths):
+        if not os.path.isfile(adf_path):
+            return apierr(400, "ADF '{}' not found".format(adf_))
+
+    def append(progress):
+        image.append(adfs_paths, progress)
+        storage.changed(config.mount_images_dir, imgname)
+    return run_job("append_adfs", append)
+
+
+@api.route("/<imgname>/contents/<filename>", methods=["DELETE"])
+def remove_file_from_mount_image(imgname, filename):
+    '''Remove a file from an existing mount image.
+
+    The image is edited in place and its size doesn't change;
+    the space taken by the file is reused by the next added ADFs.
+
+    URL args:
+    - imgname -- name of the mount image
+    - filename -- name of the file inside the mount image to remove
+
+    Errors:
+    - 400 -- if the image is mounted
+    - 404 -- if the mount image is not found
+          -- if the file is not found in the mount image
+    '''
+    image, error = _editable_image(imgname)
+    if error:
+        return error
+    if filename not in [entry["name"] for entry in image.list()]:
+        return apierr(404, "file '{}' not found in the image".format(
+            filename))
+    image.remove([filename])
+    storage.changed(config.mount_images_dir, imgname)
     return ""
+
+
+@api.route("/<imgname>/order", methods=["PUT"])
+def reorder_mount_image(imgname):
+    '''Change the order of the files in an existing mount image.
+
+    Gotek assigns the floppy indices in this order. Only the directory
+    of the image is rewritten.
+
+    Body args:
+    - files -- list of the names of all files in the image,
+      in the new order.
+
+    Errors:
+    - 400 -- if the list doesn't contain every file in the image
+             exactly once
+          -- if the image is mounted
+    - 404 -- if the mount image is not found
+    '''
+    image, error = _editable_image(imgname)
+    if error:
+        return error
+    files = request.get_json().get("files")
+    if not isinstance(files, list):
+        return apierr(400, "no files specified")
+    image.reorder(files)
+    storage.changed(config.mount_images_dir, imgname)
+    return ""
+
+
+def _editable_image(imgname):
+    image = MountImage(safe_join(config.mount_images_dir, imgname))
+    if not image.exists():
+        return None, apierr(404, "image not found")
+    if Mount.current().imagefile == image.imagefile:
+        return None, apierr(400, "image '{}' is mounted; unmount it "
+                            "first".format(imgname))
+    return image, None
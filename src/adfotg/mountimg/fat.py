@@ -0,0 +1,1261 @@
+'''FAT file-system images written and read without mtools.
+
+The image is laid out in a single sequential pass: the boot sector,
+the FATs, the root directory and then the files, each one in its own
+contiguous cluster chain. This is all that Gotek needs and it saves
+spawning a process per file.
+
+The FAT type is chosen the way mkdosfs does it: FAT32 for images of
+512 MiB and larger and FAT16 below that, because the type of a FAT
+volume is determined by its amount of clusters and a small volume
+simply cannot be a valid FAT32. Images too small even for FAT16 are
+padded, which costs nothing as the free space is left sparse. FAT12
+images, for example made by mkdosfs, can still be read and edited.
+
+The FAT, the root directory and the cluster size are chosen so that
+the images can later grow in place when files are added, up to as many
+HD ADFs as Gotek has slots. For FAT16 that takes 32 KiB clusters, so
+the smallest image is 128 MiB large, most of it a sparse hole.
+'''
+import array
+import io
+import mmap
+import os
+import struct
+import sys
+import time
+
+from adfotg import storage
+from adfotg.error import ActionError, AdfotgError
+
+SECTOR_SIZE = 512
+DIR_ENTRY_SIZE = 32
+
+FAT12 = 12
+FAT16 = 16
+FAT32 = 32
+
+# Amount of data clusters that determines the FAT type.
+_MIN_CLUSTERS = {FAT12: 1, FAT16: 4085, FAT32: 65525}
+_MAX_CLUSTERS = {FAT12: 4084, FAT16: 65524, FAT32: 0x0FFFFFF4}
+_EOC = {FAT12: 0xFFF, FAT16: 0xFFFF, FAT32: 0x0FFFFFFF}
+
+_FAT32_MIN_SIZE = 512 * 1024 * 1024
+_MEDIA = 0xF8
+_NUM_FATS = 2
+_SECTORS_PER_TRACK = 32
+_HEADS = 64
+_MIN_ROOT_ENTRIES = 512
+# The images have room to grow to this many HD ADFs, one per Gotek slot,
+_GOTEK_SLOTS = 1000
+_GROWTH_SIZE = _GOTEK_SLOTS * 1802240
+# and the fixed FAT16 root directory has room for their names of up to
+# 52 characters.
+_GROWTH_ROOT_ENTRIES = _GOTEK_SLOTS * 5
+_NO_LABEL = b"NO NAME    "
+
+# FAT32 tables are made this many times larger than needed, so that
+# the image can grow without relocating the data. FAT16 tables are
+# always made for the most clusters FAT16 can have.
+_FAT_GROWTH = 4
+# Extra space added when an edited image has to grow.
+_GROWTH_HEADROOM = 1024 * 1024
+
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0F
+
+# Windows NT flags telling that the 8.3 name is lower-case.
+_NT_LOWER_BASE = 0x08
+_NT_LOWER_EXT = 0x10
+
+_LFN_CHARS = 13
+_MAX_LFN = 255
+_LAST_LFN = 0x40
+_SHORT_CHARS = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&'()-@^_`{}~")
+_LFN_INVALID_CHARS = frozenset('\\/:*?"<>|')
+
+_BOOT = struct.Struct("<3s8sHBHBHHBHHHLL")
+_BOOT_EXT = struct.Struct("<BBBL11s8s")
+_BOOT_FAT32 = struct.Struct("<LHHLHH12s")
+_SHORT_ENTRY = struct.Struct("<11sBBBHHHHHHHL")
+_LFN_ENTRY = struct.Struct("<B10sBBB12sH4s")
+
+# INT 18h (no bootable disk, try the next one), then halt forever.
+_BOOT_CODE = b"\xcd\x18\xf4\xeb\xfd"
+
+
+class FatGeometry:
+    '''Layout of a FAT volume.'''
+    def __init__(self, fat_type, sectors_per_cluster, total_sectors,
+                 fat_sectors, root_entries, reserved_sectors,
+                 root_cluster=2, volume_id=0, num_fats=_NUM_FATS):
+        self.fat_type = fat_type
+        self.sectors_per_cluster = sectors_per_cluster
+        self.total_sectors = total_sectors
+        self.fat_sectors = fat_sectors
+        self.root_entries = root_entries
+        self.reserved_sectors = reserved_sectors
+        self.root_cluster = root_cluster
+        self.volume_id = volume_id
+        self.num_fats = num_fats
+
+    @classmethod
+    def plan(cls, file_sizes, dir_entries, free_space=0):
+        '''Find the geometry of the smallest volume that can contain
+        files of the given sizes, with at least free_space bytes
+        left free.
+
+        dir_entries -- amount of the 32-byte entries needed in
+          the root directory
+        '''
+        estimate = sum(file_sizes) + free_space
+        if estimate >= _FAT32_MIN_SIZE:
+            candidates = [(FAT32, spc) for spc in (8, 16, 32, 64)]
+        else:
+            candidates = [(FAT16, spc) for spc in (1, 2, 4, 8, 16, 32, 64)]
+        # Prefer the smallest clusters that still let the image grow
+        # to all Gotek slots or to twice its size, whichever is larger.
+        for need_room in (True, False):
+            for fat_type, spc in candidates:
+                geometry = cls._layout(fat_type, spc, file_sizes,
+                                       dir_entries, free_space)
+                if geometry is None:
+                    continue
+                room = max(2 * geometry.cluster_count,
+                           _div_up(_GROWTH_SIZE, geometry.cluster_size))
+                if not need_room or geometry.fat_capacity >= room:
+                    return geometry
+        raise AdfotgError("files are too large for a FAT image")
+
+    @classmethod
+    def _layout(cls, fat_type, spc, file_sizes, dir_entries, free_space):
+        cluster_size = spc * SECTOR_SIZE
+        clusters = sum(_div_up(size, cluster_size) for size in file_sizes)
+        clusters += _div_up(free_space, cluster_size)
+        # Leave room for adding more files; the FAT32 root directory
+        # is a cluster chain that grows as needed.
+        if fat_type == FAT32:
+            reserved_sectors = 32
+            root_sectors = 0
+            clusters += _div_up(max(_MIN_ROOT_ENTRIES, 2 * dir_entries)
+                                * DIR_ENTRY_SIZE, cluster_size)
+            root_entries = 0
+        else:
+            reserved_sectors = 1
+            root_entries = _round_up(max(_GROWTH_ROOT_ENTRIES,
+                                         2 * dir_entries),
+                                     SECTOR_SIZE // DIR_ENTRY_SIZE)
+            if root_entries > 0xFFF0:
+                return None
+            root_sectors = root_entries * DIR_ENTRY_SIZE // SECTOR_SIZE
+        # A small volume is padded to be a valid FAT16.
+        clusters = max(clusters, _MIN_CLUSTERS[fat_type])
+        if fat_type == FAT32:
+            capacity = min(_MAX_CLUSTERS[fat_type],
+                           max(clusters * _FAT_GROWTH,
+                               _div_up(_GROWTH_SIZE, cluster_size)))
+        else:
+            capacity = _MAX_CLUSTERS[fat_type]
+        fat_sectors = _div_up(_div_up((capacity + 2) * fat_type, 8),
+                              SECTOR_SIZE)
+        meta_sectors = (reserved_sectors + _NUM_FATS * fat_sectors
+                        + root_sectors)
+        total_sectors = _round_up(meta_sectors + clusters * spc,
+                                  _SECTORS_PER_TRACK)
+        geometry = cls(fat_type, spc, total_sectors, fat_sectors,
+                       root_entries, reserved_sectors,
+                       volume_id=_volume_id())
+        count = geometry.cluster_count
+        if not _MIN_CLUSTERS[fat_type] <= count <= capacity:
+            return None
+        return geometry
+
+    @classmethod
+    def parse(cls, sector):
+        '''Read the geometry from the boot sector.'''
+        if len(sector) < SECTOR_SIZE:
+            raise AdfotgError("image is too small to be a FAT volume")
+        (_, _, sector_size, spc, reserved_sectors, num_fats, root_entries,
+         total16, _, fat_sectors, _, _, _, total32) = _BOOT.unpack_from(sector)
+        if sector_size != SECTOR_SIZE:
+            raise AdfotgError("unsupported FAT sector size {}".format(
+                sector_size))
+        if spc == 0 or spc & (spc - 1) or not reserved_sectors \
+                or not num_fats:
+            raise AdfotgError("image is not a valid FAT volume")
+        root_cluster = 0
+        if fat_sectors == 0:
+            fat_sectors, _, _, root_cluster, _, _, _ = \
+                _BOOT_FAT32.unpack_from(sector, _BOOT.size)
+            ext_offset = _BOOT.size + _BOOT_FAT32.size
+        else:
+            ext_offset = _BOOT.size
+        volume_id = _BOOT_EXT.unpack_from(sector, ext_offset)[3]
+        geometry = cls(None, spc, total16 or total32, fat_sectors,
+                       root_entries, reserved_sectors,
+                       root_cluster=root_cluster, volume_id=volume_id,
+                       num_fats=num_fats)
+        count = geometry.cluster_count
+        if count < 1:
+            raise AdfotgError("image is not a valid FAT volume")
+        if count <= _MAX_CLUSTERS[FAT12]:
+            geometry.fat_type = FAT12
+        elif count <= _MAX_CLUSTERS[FAT16]:
+            geometry.fat_type = FAT16
+        else:
+            geometry.fat_type = FAT32
+        if (geometry.fat_type == FAT32) != (root_cluster != 0):
+            raise AdfotgError("image is not a valid FAT volume")
+        return geometry
+
+    @property
+    def cluster_size(self):
+        return self.sectors_per_cluster * SECTOR_SIZE
+
+    @property
+    def fat_offset(self):
+        return self.reserved_sectors * SECTOR_SIZE
+
+    @property
+    def fat_size(self):
+        return self.fat_sectors * SECTOR_SIZE
+
+    @property
+    def fat_capacity(self):
+        '''Amount of data clusters that the FAT can address.'''
+        return min(_MAX_CLUSTERS[self.fat_type],
+                   self.fat_size * 8 // self.fat_type - 2)
+
+    @property
+    def root_offset(self):
+        '''Offset of the fixed root directory of FAT12 and FAT16.'''
+        return self.fat_offset + self.num_fats * self.fat_size
+
+    @property
+    def root_size(self):
+        return self.root_entries * DIR_ENTRY_SIZE
+
+    @property
+    def data_offset(self):
+        return _round_up(self.root_offset + self.root_size, SECTOR_SIZE)
+
+    @property
+    def size(self):
+        return self.total_sectors * SECTOR_SIZE
+
+    @property
+    def cluster_count(self):
+        data_sectors = self.total_sectors - self.data_offset // SECTOR_SIZE
+        return data_sectors // self.sectors_per_cluster
+
+    def cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+    def pack_boot_sector(self):
+        sector = bytearray(SECTOR_SIZE)
+        small_total = self.total_sectors < 0x10000 and self.fat_type != FAT32
+        jump_target = 0x5A if self.fat_type == FAT32 else 0x3E
+        _BOOT.pack_into(
+            sector, 0,
+            bytes([0xEB, jump_target - 2, 0x90]),
+            b"MSWIN4.1",
+            SECTOR_SIZE,
+            self.sectors_per_cluster,
+            self.reserved_sectors,
+            self.num_fats,
+            self.root_entries,
+            self.total_sectors if small_total else 0,
+            _MEDIA,
+            0 if self.fat_type == FAT32 else self.fat_sectors,
+            _SECTORS_PER_TRACK,
+            _HEADS,
+            0,
+            0 if small_total else self.total_sectors)
+        if self.fat_type == FAT32:
+            _BOOT_FAT32.pack_into(
+                sector, _BOOT.size,
+                self.fat_sectors, 0, 0, self.root_cluster,
+                1, 6, bytes(12))
+            ext_offset = _BOOT.size + _BOOT_FAT32.size
+            fs_type = b"FAT32   "
+        else:
+            ext_offset = _BOOT.size
+            fs_type = "FAT{}".format(self.fat_type).encode().ljust(8)
+        _BOOT_EXT.pack_into(sector, ext_offset, 0x80, 0, 0x29,
+                            self.volume_id, _NO_LABEL, fs_type)
+        sector[jump_target:jump_target + len(_BOOT_CODE)] = _BOOT_CODE
+        sector[510:512] = b"\x55\xAA"
+        return sector
+
+    def pack_reserved_region(self, free_clusters, next_free):
+        '''The boot sector and, for FAT32, the FSInfo sector and their
+        backup copies.
+        '''
+        region = bytearray(self.reserved_sectors * SECTOR_SIZE)
+        region[:SECTOR_SIZE] = self.pack_boot_sector()
+        if self.fat_type == FAT32:
+            fsinfo = bytearray(SECTOR_SIZE)
+            struct.pack_into("<L", fsinfo, 0, 0x41615252)
+            struct.pack_into("<LLL", fsinfo, 484,
+                             0x61417272, free_clusters, next_free)
+            struct.pack_into("<L", fsinfo, 508, 0xAA550000)
+            region[SECTOR_SIZE:2 * SECTOR_SIZE] = fsinfo
+            backup = 6 * SECTOR_SIZE
+            region[backup:backup + 2 * SECTOR_SIZE] = \
+                region[:2 * SECTOR_SIZE]
+        return region
+
+
+class FatTable:
+    '''One copy of the File Allocation Table.'''
+    def __init__(self, fat_type, data):
+        self.fat_type = fat_type
+        self.data = data
+        # Byte range of the table modified since it was loaded.
+        self.dirty = None
+
+    @classmethod
+    def create(cls, geometry):
+        fat = cls(geometry.fat_type, bytearray(geometry.fat_size))
+        fat[0] = _EOC[geometry.fat_type] & ~0xFF | _MEDIA
+        fat[1] = _EOC[geometry.fat_type]
+        return fat
+
+    @property
+    def eoc(self):
+        return _EOC[self.fat_type]
+
+    def is_eoc(self, value):
+        return value >= self.eoc - 7
+
+    def __getitem__(self, cluster):
+        if self.fat_type == FAT12:
+            offset = cluster + cluster // 2
+            value = self.data[offset] | self.data[offset + 1] << 8
+            return value >> 4 if cluster & 1 else value & 0xFFF
+        elif self.fat_type == FAT16:
+            return struct.unpack_from("<H", self.data, cluster * 2)[0]
+        else:
+            return struct.unpack_from(
+                "<L", self.data, cluster * 4)[0] & 0x0FFFFFFF
+
+    def __setitem__(self, cluster, value):
+        offset = cluster * self.fat_type // 8
+        self._mark_dirty(offset, offset + 4)
+        if self.fat_type == FAT12:
+            offset = cluster + cluster // 2
+            if cluster & 1:
+                self.data[offset] = (self.data[offset] & 0x0F
+                                     | (value << 4) & 0xF0)
+                self.data[offset + 1] = value >> 4 & 0xFF
+            else:
+                self.data[offset] = value & 0xFF
+                self.data[offset + 1] = (self.data[offset + 1] & 0xF0
+                                         | value >> 8 & 0x0F)
+        elif self.fat_type == FAT16:
+            struct.pack_into("<H", self.data, cluster * 2, value)
+        else:
+            # The top 4 bits are reserved and must be preserved.
+            old = struct.unpack_from("<L", self.data, cluster * 4)[0]
+            struct.pack_into("<L", self.data, cluster * 4,
+                             old & 0xF0000000 | value & 0x0FFFFFFF)
+
+    def link(self, first, count):
+        '''Make a contiguous chain of count clusters.'''
+        if count <= 0:
+            return
+        width = self.fat_type // 8
+        start = first * width
+        end = start + count * width
+        if self.fat_type == FAT12 or (
+                self.fat_type == FAT32
+                and max(self.data[start + 3:end:4]) & 0xF0):
+            # Entries can't be sliced or have reserved bits to preserve.
+            for cluster in range(first, first + count - 1):
+                self[cluster] = cluster + 1
+            self[first + count - 1] = self.eoc
+            return
+        values = array.array('H' if self.fat_type == FAT16 else 'I',
+                             range(first + 1, first + count))
+        values.append(self.eoc)
+        if sys.byteorder == "big":
+            values.byteswap()
+        self.data[start:end] = values.tobytes()
+        self._mark_dirty(start, end)
+
+    def link_clusters(self, clusters):
+        '''Make a chain of the listed clusters.'''
+        last = None
+        for first, count in _runs(clusters):
+            if last is not None:
+                self[last] = first
+            self.link(first, count)
+            last = first + count - 1
+
+    def _mark_dirty(self, start, end):
+        if self.dirty is None:
+            self.dirty = (start, end)
+        else:
+            self.dirty = (min(self.dirty[0], start), max(self.dirty[1], end))
+
+    def free_clusters(self, count):
+        '''List the free clusters among the first count data clusters.'''
+        end = count + 2
+        if self.fat_type == FAT12:
+            return [cluster for cluster in range(2, end) if self[cluster] == 0]
+        if self.fat_type == FAT16:
+            values = array.array('H', self.data[:end * 2])
+            mask = 0xFFFF
+        else:
+            values = array.array('I', self.data[:end * 4])
+            mask = 0x0FFFFFFF
+        if sys.byteorder == "big":
+            values.byteswap()
+        return [cluster for cluster in range(2, min(end, len(values)))
+                if not values[cluster] & mask]
+
+
+class DirEntry:
+    '''A file, a directory or the volume label in a FAT directory.'''
+    def __init__(self, name, short_name, attr, cluster, size, mtime,
+                 offsets):
+        self.name = name
+        self.short_name = short_name
+        self.attr = attr
+        self.cluster = cluster
+        self.size = size
+        self.mtime = mtime
+        # Image offsets of the 32-byte slots taken by this entry,
+        # the long name slots first and the 8.3 name slot last.
+        self.offsets = offsets
+
+    @property
+    def is_dir(self):
+        return bool(self.attr & ATTR_DIRECTORY)
+
+    @property
+    def is_file(self):
+        return not self.attr & (ATTR_DIRECTORY | ATTR_VOLUME_ID)
+
+
+class FatImage:
+    '''Read-only view of a FAT image mapped into memory.'''
+    def __init__(self, imagefile):
+        self.imagefile = imagefile
+        self.fat = None
+        self._mmap = None
+        try:
+            with open(imagefile, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < SECTOR_SIZE:
+                    raise AdfotgError(
+                        "image is too small to be a FAT volume")
+                self._mmap = mmap.mmap(f.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        except OSError as e:
+            raise AdfotgError("cannot read image '{}': {}".format(
+                imagefile, e.strerror)) from e
+        self.data = memoryview(self._mmap)
+        try:
+            self.geometry = FatGeometry.parse(
+                bytes(self.data[:SECTOR_SIZE]))
+            if self.geometry.data_offset > size:
+                raise AdfotgError("image is truncated")
+            # Clusters past the end of a truncated image are ignored.
+            self._cluster_limit = min(
+                self.geometry.cluster_count + 2,
+                self.geometry.fat_capacity + 2,
+                (size - self.geometry.data_offset)
+                // self.geometry.cluster_size + 2)
+            fat_offset = self.geometry.fat_offset
+            self.fat = FatTable(
+                self.geometry.fat_type,
+                self.data[fat_offset:fat_offset + self.geometry.fat_size])
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.fat is not None:
+            self.fat.data.release()
+            self.fat = None
+        if self._mmap is not None:
+            self.data.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def chain(self, first):
+        '''Yield the clusters of the chain that starts with first.'''
+        cluster = first
+        for _ in range(self._cluster_limit):
+            if not 2 <= cluster < self._cluster_limit:
+                if cluster < 2 or not self.fat.is_eoc(cluster):
+                    raise AdfotgError("broken cluster chain at {}".format(
+                        cluster))
+                return
+            yield cluster
+            cluster = self.fat[cluster]
+        raise AdfotgError("cluster chain starting at {} loops".format(first))
+
+    def root_dir_regions(self):
+        '''Yield (offset, size) of the areas taken by the root directory.'''
+        geometry = self.geometry
+        if geometry.fat_type == FAT32:
+            for cluster in self.chain(geometry.root_cluster):
+                yield geometry.cluster_offset(cluster), geometry.cluster_size
+        else:
+            yield geometry.root_offset, geometry.root_size
+
+    def root_entries(self):
+        '''Yield the DirEntry of each file, directory and volume label
+        in the root directory in the order in which they are stored.
+        '''
+        lfn = _LfnCollector()
+        for region_offset, region_size in self.root_dir_regions():
+            for offset in range(region_offset, region_offset + region_size,
+                                DIR_ENTRY_SIZE):
+                raw = bytes(self.data[offset:offset + DIR_ENTRY_SIZE])
+                if raw[0] == 0x00:
+                    return
+                if raw[0] == 0xE5:
+                    lfn.reset()
+                    continue
+                attr = raw[11]
+                if attr & 0x3F == ATTR_LONG_NAME:
+                    lfn.add(raw, offset)
+                    continue
+                entry = self._dir_entry(raw, offset, lfn)
+                lfn.reset()
+                if entry is not None:
+                    yield entry
+
+    def files(self):
+        '''Regular files in the root directory.'''
+        return [entry for entry in self.root_entries() if entry.is_file]
+
+    def find(self, name):
+        '''Find the regular file in the root directory by its name;
+        FAT names are case-insensitive, but an exact match wins.
+
+        Returns: the DirEntry or None if there's no such file.
+        '''
+        found = None
+        for entry in self.files():
+            if entry.name == name:
+                return entry
+            if found is None and entry.name.lower() == name.lower():
+                found = entry
+        return found
+
+    def _dir_entry(self, raw, offset, lfn):
+        (short_name, attr, nt_flags, _, _, _, _, cluster_hi,
+         wrt_time, wrt_date, cluster_lo, size) = _SHORT_ENTRY.unpack(raw)
+        name = lfn.name(short_name)
+        offsets = lfn.offsets + [offset]
+        if name is None:
+            name = _decode_short_name(short_name, nt_flags)
+            offsets = [offset]
+        if name in (".", ".."):
+            return None
+        cluster = cluster_lo
+        if self.geometry.fat_type == FAT32:
+            cluster |= cluster_hi << 16
+        return DirEntry(name, short_name, attr, cluster, size,
+                        dos_timestamp(wrt_date, wrt_time), offsets)
+
+
+class FatFileReader(io.RawIOBase):
+    '''Reads a file straight from its clusters in the image.'''
+    def __init__(self, image, entry, close_image=False):
+        super().__init__()
+        self.name = entry.name
+        self.size = entry.size
+        self.mtime = entry.mtime
+        self._image = image
+        self._close_image = close_image
+        self._pos = 0
+        cluster_size = image.geometry.cluster_size
+        needed = _div_up(entry.size, cluster_size)
+        self._clusters = []
+        if needed:
+            for cluster in image.chain(entry.cluster):
+                self._clusters.append(cluster)
+                if len(self._clusters) == needed:
+                    break
+        if len(self._clusters) < needed:
+            raise AdfotgError("file '{}' is truncated in the image".format(
+                entry.name))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        elif whence != os.SEEK_SET:
+            raise ValueError("invalid whence ({})".format(whence))
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        dest = memoryview(b).cast('B')
+        total = max(0, min(len(dest), self.size - self._pos))
+        cluster_size = self._image.geometry.cluster_size
+        done = 0
+        while done < total:
+            index, within = divmod(self._pos, cluster_size)
+            first = self._clusters[index]
+            length = min(cluster_size - within, total - done)
+            # Copy as many contiguous clusters at once as possible.
+            run = 1
+            while (length < total - done
+                   and index + run < len(self._clusters)
+                   and self._clusters[index + run] == first + run):
+                length = min(length + cluster_size, total - done)
+                run += 1
+            offset = self._image.geometry.cluster_offset(first) + within
+            dest[done:done + length] = \
+                self._image.data[offset:offset + length]
+            done += length
+            self._pos += length
+        return total
+
+    def close(self):
+        if not self.closed and self._close_image:
+            self._image.close()
+        super().close()
+
+
+class FatEditor:
+    '''Edits the files in the root directory of a FAT image in place.
+
+    The changes are kept in memory until commit(). It writes the data
+    of the added files first, then the FATs and the root directory
+    last. An interrupted commit can leave lost clusters behind, but
+    the clusters of the removed files are reused only when the image
+    cannot grow any more, so an old directory never points to new data.
+    '''
+    def __init__(self, imagefile, preallocate=False):
+        self.imagefile = imagefile
+        self._preallocate = preallocate
+        with FatImage(imagefile) as image:
+            self.geometry = image.geometry
+            self.fat = FatTable(self.geometry.fat_type,
+                                bytearray(image.fat.data))
+            self.entries = []
+            for entry in image.root_entries():
+                entry.raw = b"".join(bytes(image.data[o:o + DIR_ENTRY_SIZE])
+                                     for o in entry.offsets)
+                self.entries.append(entry)
+            if self.geometry.fat_type == FAT32:
+                self._root_clusters = list(
+                    image.chain(self.geometry.root_cluster))
+            else:
+                self._root_clusters = []
+            self._size = len(image.data)
+        self._free = self.fat.free_clusters(self.geometry.cluster_count)
+        # Clusters freed before the commit are not reused, if possible,
+        # because the directory on the disk still points to them.
+        self._released = []
+        self._copies = []
+        self._namer = DirEntryNamer()
+        for entry in self.entries:
+            self._namer.reserve(entry.short_name)
+
+    @property
+    def files(self):
+        return [entry for entry in self.entries if entry.is_file]
+
+    def add(self, path, name=None):
+        '''Add the file at the end of the root directory.'''
+        name = name or os.path.basename(path)
+        validate_name(name)
+        if any(entry.name.lower() == name.lower() for entry in self.entries):
+            raise ActionError("file '{}' is already in the image".format(
+                name))
+        stat = os.stat(path)
+        if stat.st_size >= 1 << 32:
+            raise ActionError("file '{}' is too large for FAT".format(name))
+        clusters = self._allocate(
+            _div_up(stat.st_size, self.geometry.cluster_size))
+        first = clusters[0] if clusters else 0
+        short_name, nt_flags, needs_lfn = self._namer.name(name)
+        entry = DirEntry(name, short_name, ATTR_ARCHIVE, first,
+                         stat.st_size, int(stat.st_mtime), [])
+        entry.raw = dir_entries(name, short_name, nt_flags, needs_lfn,
+                                ATTR_ARCHIVE, first, stat.st_size,
+                                stat.st_mtime)
+        self.entries.append(entry)
+        self._copies.append((path, name, stat.st_size, clusters))
+
+    def remove(self, name):
+        '''Remove the file from the image and free its clusters.'''
+        entry = self._find(name)
+        for cluster in list(self._chain(entry.cluster)):
+            self.fat[cluster] = 0
+            self._released.append(cluster)
+        self.entries.remove(entry)
+        self._namer.release(entry.short_name)
+
+    def reorder(self, names):
+        '''Reorder the files; names must list all of them.'''
+        files = self.files
+        if len(names) != len(files) \
+                or {entry.name for entry in files} != set(names):
+            raise ActionError("the new order must list every file "
+                              "in the image exactly once")
+        by_name = {entry.name: entry for entry in files}
+        self.entries = ([entry for entry in self.entries
+                         if not entry.is_file]
+                        + [by_name[name] for name in names])
+
+    def commit(self, progress=None):
+        '''Write the changes to the image.
+
+        progress -- optional progress(done, total) callback, called with
+          the number of bytes of the added files written so far
+        '''
+        root = self._pack_root()
+        self._free = sorted(self._free + self._released)
+        self._released = []
+        with open(self.imagefile, 'r+b') as image:
+            if self.geometry.size > self._size:
+                storage.allocate(image, self.geometry.size,
+                                 self._preallocate)
+                self._write_total_sectors(image.fileno())
+            buf = memoryview(bytearray(1024 * 1024))
+            advance = _Progress(progress, sum(copy[2]
+                                              for copy in self._copies))
+            for path, name, size, clusters in self._copies:
+                self._write_file(image.fileno(), path, name, size,
+                                 clusters, buf, advance)
+            self._write_fats(image.fileno())
+            self._write_root(image.fileno(), root)
+            if self.geometry.fat_type == FAT32:
+                self._write_fsinfo(image.fileno())
+        self._copies = []
+        self._size = max(self._size, self.geometry.size)
+
+    def _find(self, name):
+        for entry in self.files:
+            if entry.name == name:
+                return entry
+        raise ActionError("file '{}' is not in the image".format(name))
+
+    def _chain(self, first):
+        cluster = first
+        for _ in range(self.geometry.cluster_count):
+            if not 2 <= cluster < self.geometry.cluster_count + 2:
+                return
+            yield cluster
+            cluster = self.fat[cluster]
+
+    def _allocate(self, count):
+        '''Allocate a chain of count clusters, contiguous if possible.'''
+        if count == 0:
+            return []
+        if len(self._free) < count:
+            self._grow(count - len(self._free))
+        if len(self._free) < count:
+            self._free = sorted(self._free + self._released)
+            self._released = []
+        if len(self._free) < count:
+            raise ActionError("there's not enough space left in the image "
+                              "and it cannot grow any further")
+        chosen = None
+        run_start = 0
+        for index in range(len(self._free)):
+            if index > 0 and self._free[index] != self._free[index - 1] + 1:
+                run_start = index
+            if index - run_start + 1 == count:
+                chosen = self._free[run_start:index + 1]
+                del self._free[run_start:index + 1]
+                break
+        if chosen is None:
+            chosen = self._free[:count]
+            del self._free[:count]
+        self.fat.link_clusters(chosen)
+        return chosen
+
+    def _grow(self, count):
+        '''Make the image larger by at least count clusters.'''
+        geometry = self.geometry
+        old_count = geometry.cluster_count
+        headroom = _div_up(_GROWTH_HEADROOM, geometry.cluster_size)
+        new_count = min(geometry.fat_capacity, old_count + count + headroom)
+        if new_count <= old_count:
+            return
+        geometry.total_sectors = (geometry.data_offset // SECTOR_SIZE
+                                  + new_count * geometry.sectors_per_cluster)
+        self._free.extend(cluster for cluster in range(old_count + 2,
+                                                       new_count + 2)
+                          if self.fat[cluster] == 0)
+
+    def _pack_root(self):
+        root = b"".join(entry.raw for entry in self.entries)
+        if self.geometry.fat_type != FAT32:
+            if len(root) > self.geometry.root_size:
+                raise ActionError("root directory of the image is full")
+            return root + bytes(self.geometry.root_size - len(root))
+        cluster_size = self.geometry.cluster_size
+        missing = _div_up(len(root), cluster_size) - len(self._root_clusters)
+        if missing > 0:
+            clusters = self._allocate(missing)
+            self.fat[self._root_clusters[-1]] = clusters[0]
+            self._root_clusters.extend(clusters)
+        return root + bytes(len(self._root_clusters) * cluster_size
+                            - len(root))
+
+    def _write_total_sectors(self, fd):
+        geometry = self.geometry
+        small = geometry.total_sectors < 0x10000 \
+            and geometry.fat_type != FAT32
+        fields = struct.pack("<H", geometry.total_sectors if small else 0)
+        sectors = [0]
+        if geometry.fat_type == FAT32:
+            backup = struct.unpack("<H", os.pread(fd, 2, 50))[0]
+            if 0 < backup < geometry.reserved_sectors:
+                sectors.append(backup)
+        for sector in sectors:
+            offset = sector * SECTOR_SIZE
+            os.pwrite(fd, fields, offset + 19)
+            os.pwrite(fd, struct.pack("<L", 0 if small
+                                      else geometry.total_sectors),
+                      offset + 32)
+
+    def _write_file(self, fd, path, name, size, clusters, buf, advance):
+        cluster_size = self.geometry.cluster_size
+        remaining = size
+        with open(path, 'rb') as source:
+            for first, count in _runs(clusters):
+                offset = self.geometry.cluster_offset(first)
+                run_remaining = min(count * cluster_size, remaining)
+                while run_remaining:
+                    chunk = buf[:min(run_remaining, len(buf))]
+                    read = source.readinto(chunk)
+                    if not read:
+                        raise AdfotgError("file '{}' has shrunk while it "
+                                          "was being added".format(name))
+                    os.pwrite(fd, chunk[:read], offset)
+                    offset += read
+                    run_remaining -= read
+                    remaining -= read
+                    advance(read)
+
+    def _write_fats(self, fd):
+        if self.fat.dirty is None:
+            return
+        start, end = self.fat.dirty
+        start -= start % SECTOR_SIZE
+        end = min(_round_up(end, SECTOR_SIZE), self.geometry.fat_size)
+        span = bytes(self.fat.data[start:end])
+        for n in range(self.geometry.num_fats):
+            os.pwrite(fd, span, self.geometry.fat_offset
+                      + n * self.geometry.fat_size + start)
+
+    def _write_root(self, fd, root):
+        if self.geometry.fat_type != FAT32:
+            os.pwrite(fd, root, self.geometry.root_offset)
+            return
+        cluster_size = self.geometry.cluster_size
+        for index, cluster in enumerate(self._root_clusters):
+            os.pwrite(fd, root[index * cluster_size:(index + 1) * cluster_size],
+                      self.geometry.cluster_offset(cluster))
+
+    def _write_fsinfo(self, fd):
+        fsinfo = struct.unpack("<H", os.pread(fd, 2, 48))[0]
+        if not 0 < fsinfo < self.geometry.reserved_sectors:
+            return
+        offset = fsinfo * SECTOR_SIZE
+        if struct.unpack("<L", os.pread(fd, 4, offset))[0] != 0x41615252:
+            return
+        next_free = self._free[0] if self._free else 0xFFFFFFFF
+        os.pwrite(fd, struct.pack("<LL", len(self._free), next_free),
+                  offset + 488)
+
+
+class _LfnCollector:
+    '''Assembles the VFAT long name from the slots that precede
+    the 8.3 entry.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._parts = None
+        self._checksum = None
+        self._expected = 0
+        self.offsets = []
+
+    def add(self, raw, offset):
+        order, name1, _, _, checksum, name2, _, name3 = \
+            _LFN_ENTRY.unpack(raw)
+        seq = order & 0x3F
+        if order & _LAST_LFN:
+            self._parts = [None] * seq
+            self._checksum = checksum
+            self._expected = seq
+            self.offsets = []
+        if (self._parts is None or seq != self._expected or seq == 0
+                or checksum != self._checksum):
+            # Orphaned slot, for example of a file renamed by a tool
+            # that doesn't know long names.
+            self.reset()
+            return
+        self._parts[seq - 1] = name1 + name2 + name3
+        self._expected -= 1
+        self.offsets.append(offset)
+
+    def name(self, short_name):
+        '''Returns: the long name if it belongs to the 8.3 entry,
+        None otherwise.
+        '''
+        if (self._parts is None or self._expected != 0
+                or self._checksum != _lfn_checksum(short_name)):
+            return None
+        encoded = b"".join(self._parts)
+        for n in range(0, len(encoded), 2):
+            if encoded[n:n + 2] == b"\0\0":
+                encoded = encoded[:n]
+                break
+        return encoded.decode("utf-16-le", errors="replace")
+
+
+class DirEntryNamer:
+    '''Assigns unique 8.3 names to the long file names that are put
+    into a single directory.
+    '''
+    def __init__(self):
+        self._taken = set()
+
+    def reserve(self, short_name):
+        self._taken.add(short_name)
+
+    def release(self, short_name):
+        self._taken.discard(short_name)
+
+    def name(self, long_name):
+        '''Returns: a tuple of the 11-byte short name, the NT case flags
+        and whether a VFAT long name is needed.
+        '''
+        exact = _exact_short_name(long_name)
+        if exact is not None and exact[0] not in self._taken:
+            self._taken.add(exact[0])
+            return exact + (False,)
+        base, ext = _basis_name(long_name)
+        for n in range(1, 1000000):
+            tail = "~{}".format(n)
+            short_name = (base[:8 - len(tail)] + tail).ljust(8) + ext.ljust(3)
+            short_name = short_name.encode("ascii")
+            if short_name not in self._taken:
+                self._taken.add(short_name)
+                return short_name, 0, True
+        raise AdfotgError("cannot find a short name for '{}'".format(
+            long_name))
+
+
+def validate_name(name):
+    '''Raise AdfotgError if the name cannot be put into a FAT image.'''
+    if not name or name in (".", "..") or name != name.rstrip(" ."):
+        raise AdfotgError("'{}' is not a valid FAT file name".format(name))
+    if any(c in _LFN_INVALID_CHARS or ord(c) < 0x20 for c in name):
+        raise AdfotgError("'{}' contains characters not allowed "
+                          "in FAT file names".format(name))
+    if len(name.encode("utf-16-le")) // 2 > _MAX_LFN:
+        raise AdfotgError("'{}' is too long for a FAT file name".format(
+            name))
+
+
+def dir_entries(long_name, short_name, nt_flags, needs_lfn,
+                attr, cluster, size, mtime):
+    '''Pack the directory entries of a single file, preceded by its
+    VFAT long name entries if it has a long name.
+    '''
+    date, time_ = dos_datetime(mtime)
+    short = _SHORT_ENTRY.pack(short_name, attr, nt_flags, 0, time_, date,
+                              date, cluster >> 16, time_, date,
+                              cluster & 0xFFFF, size)
+    if not needs_lfn:
+        return short
+    return _lfn_entries(long_name, _lfn_checksum(short_name)) + short
+
+
+def dos_datetime(timestamp):
+    '''Returns: the (date, time) tuple of the local time in DOS format.'''
+    tm = time.localtime(timestamp)
+    if tm.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    if tm.tm_year > 2107:
+        return (127 << 9) | (12 << 5) | 31, (23 << 11) | (59 << 5) | 29
+    date = (tm.tm_year - 1980) << 9 | tm.tm_mon << 5 | tm.tm_mday
+    time_ = tm.tm_hour << 11 | tm.tm_min << 5 | min(tm.tm_sec, 59) // 2
+    return date, time_
+
+
+def dos_timestamp(date, time_):
+    '''Returns: the seconds since epoch of the local DOS date and time,
+    or 0 if the date is not set.
+    '''
+    year = (date >> 9) + 1980
+    month = date >> 5 & 0x0F
+    day = date & 0x1F
+    if not 1 <= month <= 12 or day == 0:
+        return 0
+    hour = time_ >> 11
+    minute = time_ >> 5 & 0x3F
+    second = (time_ & 0x1F) * 2
+    try:
+        return int(time.mktime((year, month, day, hour, minute, second,
+                                0, 0, -1)))
+    except (OverflowError, ValueError):
+        return 0
+
+
+def build_image(imagefile, files, free_space=0, preallocate=False,
+                progress=None):
+    '''Create a FAT image containing the files, in the order in which
+    they are on the list.
+
+    files -- paths to the files
+    free_space -- amount of bytes to leave free in the image
+    preallocate -- reserve the disk space for the whole image instead
+      of leaving the unused parts sparse
+    progress -- optional progress(done, total) callback, called with
+      the number of bytes of the files copied so far
+    '''
+    sources = []
+    names = set()
+    for path in files:
+        name = os.path.basename(path)
+        validate_name(name)
+        if name.lower() in names:
+            raise AdfotgError("file '{}' is specified more than once".format(
+                name))
+        names.add(name.lower())
+        stat = os.stat(path)
+        if stat.st_size >= 1 << 32:
+            raise AdfotgError("file '{}' is too large for FAT".format(name))
+        sources.append((path, name, stat.st_size, stat.st_mtime))
+
+    namer = DirEntryNamer()
+    short_names = [_exact_short_name(name) for _, name, _, _ in sources]
+    for short_name in short_names:
+        if short_name is not None:
+            namer.reserve(short_name[0])
+    short_names = [
+        namer.name(name) if exact is None else exact + (False,)
+        for (_, name, _, _), exact in zip(sources, short_names)
+    ]
+    entry_count = sum(
+        1 + (_div_up(len(name.encode("utf-16-le")) // 2, _LFN_CHARS)
+             if short[2] else 0)
+        for (_, name, _, _), short in zip(sources, short_names))
+
+    geometry = FatGeometry.plan([size for _, _, size, _ in sources],
+                                entry_count, free_space)
+    cluster_size = geometry.cluster_size
+    fat = FatTable.create(geometry)
+    next_cluster = 2
+    if geometry.fat_type == FAT32:
+        root_clusters = _div_up(max(_MIN_ROOT_ENTRIES, 2 * entry_count)
+                                * DIR_ENTRY_SIZE, cluster_size)
+        fat.link(geometry.root_cluster, root_clusters)
+        next_cluster += root_clusters
+        root_size = root_clusters * cluster_size
+    else:
+        root_size = geometry.root_size
+    root = bytearray()
+    for (path, name, size, mtime), short in zip(sources, short_names):
+        clusters = _div_up(size, cluster_size)
+        first = next_cluster if clusters else 0
+        fat.link(next_cluster, clusters)
+        next_cluster += clusters
+        root += dir_entries(name, *short, ATTR_ARCHIVE, first, size, mtime)
+    root += bytes(root_size - len(root))
+    free_clusters = geometry.cluster_count - (next_cluster - 2)
+
+    try:
+        with open(imagefile, 'wb') as image:
+            storage.allocate(image, geometry.size, preallocate)
+            image.write(geometry.pack_reserved_region(free_clusters,
+                                                      next_cluster))
+            # The unused tail of the FATs stays sparse.
+            fat_used = min(_round_up(fat.dirty[1], SECTOR_SIZE),
+                           geometry.fat_size)
+            for n in range(geometry.num_fats):
+                image.seek(geometry.fat_offset + n * geometry.fat_size)
+                image.write(fat.data[:fat_used])
+            # The root directory follows the FATs directly, both
+            # the fixed one and the one in the first FAT32 cluster.
+            image.seek(geometry.root_offset)
+            image.write(root)
+            buf = memoryview(bytearray(1024 * 1024))
+            advance = _Progress(progress, sum(size for _, _, size, _
+                                              in sources))
+            for path, name, size, _ in sources:
+                _copy(path, name, size, image, buf, advance)
+                # Skip the slack of the last cluster, it stays a hole.
+                image.seek(-size % cluster_size, os.SEEK_CUR)
+    except BaseException:
+        try:
+            os.unlink(imagefile)
+        except FileNotFoundError:
+            pass
+        raise
+    return geometry
+
+
+def _copy(path, name, size, image, buf, advance):
+    with open(path, 'rb') as source:
+        remaining = size
+        while remaining:
+            chunk = buf[:min(remaining, len(buf))]
+            read = source.readinto(chunk)
+            if not read:
+                raise AdfotgError("file '{}' has shrunk while it was "
+                                  "being packed".format(name))
+            image.write(chunk[:read])
+            remaining -= read
+            advance(read)
+
+
+class _Progress:
+    '''Sums up the copied bytes for a progress(done, total) callback.'''
+    def __init__(self, progress, total):
+        self._progress = progress
+        self._total = total
+        self._done = 0
+        if progress:
+            progress(0, total)
+
+    def __call__(self, nbytes):
+        self._done += nbytes
+        if self._progress:
+            self._progress(self._done, self._total)
+
+
+def _exact_short_name(name):
+    '''Returns: a tuple of the short name and the NT case flags if
+    the name can be stored as 8.3 without a long name, None otherwise.
+    '''
+    base, dot, ext = name.partition(".")
+    if not 1 <= len(base) <= 8 or len(ext) > 3 or "." in ext \
+            or (dot and not ext):
+        return None
+    flags = 0
+    for part, lower_flag in ((base, _NT_LOWER_BASE), (ext, _NT_LOWER_EXT)):
+        if not all(c.upper() in _SHORT_CHARS for c in part):
+            return None
+        if part != part.upper():
+            if part != part.lower():
+                # Mixed case needs a long name.
+                return None
+            flags |= lower_flag
+    short_name = (base.upper().ljust(8) + ext.upper().ljust(3))
+    return short_name.encode("ascii"), flags
+
+
+def _decode_short_name(short_name, nt_flags):
+    if short_name[0] == 0x05:
+        short_name = b"\xe5" + short_name[1:]
+    base = short_name[:8].decode("cp437").rstrip(" ")
+    ext = short_name[8:].decode("cp437").rstrip(" ")
+    if nt_flags & _NT_LOWER_BASE:
+        base = base.lower()
+    if nt_flags & _NT_LOWER_EXT:
+        ext = ext.lower()
+    return base + "." + ext if ext else base
+
+
+def _basis_name(name):
+    '''The uppercase base and extension of the short name from which
+    the numbered 8.3 names are made.
+    '''
+    def clean(part):
+        return "".join(
+            c if c in _SHORT_CHARS else "_"
+            for c in part.upper().replace(" ", "").replace(".", ""))
+    name = name.lstrip(".")
+    base, dot, ext = name.rpartition(".")
+    if not dot:
+        base, ext = ext, ""
+    return clean(base)[:8] or "_", clean(ext)[:3]
+
+
+def _lfn_checksum(short_name):
+    checksum = 0
+    for c in short_name:
+        checksum = ((checksum & 1) << 7 | checksum >> 1) + c & 0xFF
+    return checksum
+
+
+def _lfn_entries(long_name, checksum):
+    encoded = long_name.encode("utf-16-le")
+    unit_count = len(encoded) // 2
+    count = _div_up(unit_count, _LFN_CHARS)
+    padded_len = count * _LFN_CHARS * 2
+    if unit_count < count * _LFN_CHARS:
+        encoded += b"\0\0"
+    encoded += b"\xff" * (padded_len - len(encoded))
+    entries = []
+    for n in range(count):
+        part = encoded[n * _LFN_CHARS * 2:(n + 1) * _LFN_CHARS * 2]
+        order = n + 1
+        if n == count - 1:
+            order |= _LAST_LFN
+        entries.append(_LFN_ENTRY.pack(order, part[:10], ATTR_LONG_NAME, 0,
+                                       checksum, part[10:22], 0, part[22:]))
+    # The entries are stored from the last part to the first one.
+    return b"".join(reversed(entries))
+
+
+def _volume_id():
+    return int(time.time()) & 0xFFFFFFFF
+
+
+def _runs(clusters):
+    '''Yield (first, count) of the runs of consecutive clusters.'''
+    first = None
+    count = 0
+    for cluster in clusters:
+        if first is not None and cluster == first + count:
+            count += 1
+            continue
+        if first is not None:
+            yield first, count
+        first = cluster
+        count = 1
+    if first is not None:
+        yield first, count
+
+
+def _div_up(a, b):
+    return -(-a // b)
+
+
+def _round_up(a, b):
+    return _div_up(a, b) * b
@@ -0,0 +1,122 @@
+'''Cache of the mount image contents.
+
+Reading the directory of an image is cheap, but the contents are
+viewed far more often than the images change. The listings are kept
+in memory for the most recently viewed images and persisted in
+a sidecar file in a hidden directory next to the image, so that they
+survive a restart. A cached listing is valid as long as the image's
+size, mtime and inode don't change.
+'''
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = 64
+SIDECAR_DIR = ".manifests"
+
+# Images modified this recently are not cached, because another
+# modification in the same mtime tick would go unnoticed.
+_RACY_NS = 2 * 10**9
+
+
+class ManifestCache:
+    def __init__(self, capacity=CACHE_SIZE):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._manifests = OrderedDict()
+
+    def get(self, imagefile, read):
+        '''Get the listing of the image; read() is called to read
+        the listing from the image if it's not cached.
+
+        Returns: a list of FileEntry dicts.
+        '''
+        imagefile = os.path.abspath(imagefile)
+        stamp = _stamp(imagefile)
+        with self._lock:
+            cached = self._manifests.get(imagefile)
+            if cached is not None and cached[0] == stamp:
+                self._manifests.move_to_end(imagefile)
+                return _copy(cached[1])
+        listing = _read_sidecar(imagefile, stamp)
+        if listing is None:
+            listing = read()
+            if _is_racy(stamp):
+                return listing
+            _write_sidecar(imagefile, stamp, listing)
+        with self._lock:
+            self._manifests[imagefile] = (stamp, listing)
+            self._manifests.move_to_end(imagefile)
+            while len(self._manifests) > self._capacity:
+                self._manifests.popitem(last=False)
+        return _copy(listing)
+
+    def invalidate(self, imagefile):
+        '''Forget the listing of the image, also the persisted one.'''
+        imagefile = os.path.abspath(imagefile)
+        with self._lock:
+            self._manifests.pop(imagefile, None)
+        try:
+            os.unlink(_sidecar_path(imagefile))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print("cannot remove manifest of '{}': {}".format(imagefile, e),
+                  file=sys.stderr)
+
+
+def _stamp(imagefile):
+    stat = os.stat(imagefile)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def _is_racy(stamp):
+    return time.time_ns() - stamp[1] < _RACY_NS
+
+
+def _copy(listing):
+    return [dict(entry) for entry in listing]
+
+
+def _sidecar_path(imagefile):
+    dirpath, name = os.path.split(imagefile)
+    return os.path.join(dirpath, SIDECAR_DIR, name + ".json")
+
+
+def _read_sidecar(imagefile, stamp):
+    try:
+        with open(_sidecar_path(imagefile), 'r') as f:
+            sidecar = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print("ignoring manifest of '{}': {}".format(imagefile, e),
+              file=sys.stderr)
+        return None
+    if not isinstance(sidecar, dict) or sidecar.get("stamp") != stamp:
+        return None
+    return sidecar.get("listing")
+
+
+def _write_sidecar(imagefile, stamp, listing):
+    path = _sidecar_path(imagefile)
+    tmppath = "{}.{}.tmp".format(path, threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmppath, 'w') as f:
+            json.dump({"stamp": stamp, "listing": listing}, f)
+        os.replace(tmppath, path)
+    except OSError as e:
+        # The manifest is only an optimization.
+        print("cannot store manifest of '{}': {}".format(imagefile, e),
+              file=sys.stderr)
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+
+
+manifests = ManifestCache()
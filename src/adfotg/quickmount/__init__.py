@@ -0,0 +1,165 @@
+'''Quickmount images made from a pre-packed template.
+
+Every quickmount image contains the standard ADFs followed by the
+chosen one. The standard ADFs are packed only once into a template
+image kept in the cache dir. A quickmount image is a clone of
+the template, a reflink where the file-system supports it, with the
+chosen ADF appended to it in place.
+
+There are two quickmount slots used in turns. The new image is made
+in the slot that isn't mounted, so the current disk stays available
+to the host until the very end, when the mount is swapped.
+'''
+import json
+import os
+import sys
+import threading
+import time
+
+from werkzeug.utils import safe_join
+
+from adfotg import adf, storage
+from adfotg.config import config
+from adfotg.mount import Mount
+from adfotg.mountimg import MountImage
+
+TEMPLATE_NAME = "quickmount-template.img"
+SLOT_NAMES = (".QUICKMOUNT.A", ".QUICKMOUNT.B")
+# Quickmount image of the older versions that used only one slot.
+_LEGACY_NAME = ".QUICKMOUNT"
+
+
+class Template:
+    def __init__(self, imagefile):
+        self.imagefile = imagefile
+        self._stampfile = os.path.splitext(imagefile)[0] + ".json"
+        self._lock = threading.Lock()
+
+    def prepare(self):
+        '''Pack the template anew if the standard ADFs have changed.'''
+        with self._lock:
+            self._prepare()
+
+    def make_image(self, adf_path, imagefile, progress=None):
+        '''Make a quickmount image with the ADF from the template.
+
+        progress -- optional progress(done, total) callback, called with
+          the number of bytes of the ADF added so far
+        '''
+        with self._lock:
+            standard = self._prepare()
+            storage.clone(self.imagefile, imagefile)
+        image = MountImage(imagefile)
+        if os.path.basename(adf_path).lower() not in standard:
+            image.append([adf_path], progress)
+        return image
+
+    def _prepare(self):
+        '''Returns: the lower-cased names of the standard ADFs.'''
+        paths = [safe_join(config.adf_dir, name)
+                 for name in adf.list_standard_adfs()]
+        stamp = [_stamp(path) for path in paths]
+        if not os.path.isfile(self.imagefile) or self._read_stamp() != stamp:
+            started = time.monotonic()
+            os.makedirs(os.path.dirname(self.imagefile), exist_ok=True)
+            tmpfile = self.imagefile + ".tmp"
+            MountImage(tmpfile).pack(paths)
+            os.replace(tmpfile, self.imagefile)
+            self._write_stamp(stamp)
+            print("prepared quickmount template in {:.3f}s".format(
+                time.monotonic() - started), file=sys.stderr)
+        return [os.path.basename(path).lower() for path in paths]
+
+    def _read_stamp(self):
+        try:
+            with open(self._stampfile, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_stamp(self, stamp):
+        with open(self._stampfile, 'w') as f:
+            json.dump(stamp, f)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def get_template():
+    '''Returns: the Template stored in the configured cache dir.'''
+    global _template
+    imagefile = os.path.join(config.cache_dir, TEMPLATE_NAME)
+    with _template_lock:
+        if _template is None or _template.imagefile != imagefile:
+            _template = Template(imagefile)
+        return _template
+
+
+def prepare_in_background():
+    '''Prepare the template so that the first quickmount is fast too.'''
+    def _prepare():
+        try:
+            get_template().prepare()
+        except Exception as e:
+            print("cannot prepare quickmount template: {}".format(e),
+                  file=sys.stderr)
+    threading.Thread(target=_prepare, name="quickmount-template",
+                     daemon=True).start()
+
+
+_quickmount_lock = threading.Lock()
+_last_quickmount = None
+
+
+def quickmount(adf_path, progress=None):
+    '''Make a quickmount image with the ADF in the free slot and mount it
+    in place of the currently mounted image.
+
+    progress -- optional progress(done, total) callback, as for
+      Template.make_image()
+
+    Returns: a dict with the stats of this quickmount, same as
+    last_quickmount().
+    '''
+    global _last_quickmount
+    with _quickmount_lock:
+        mounted = Mount.current().imagefile
+        slots = [safe_join(config.mount_images_dir, name)
+                 for name in SLOT_NAMES]
+        imagefile = slots[1] if mounted == slots[0] else slots[0]
+        image = MountImage(imagefile)
+        image.delete()
+        os.makedirs(config.mount_images_dir, exist_ok=True)
+        started = time.monotonic()
+        get_template().make_image(adf_path, imagefile, progress)
+        built = time.monotonic()
+        Mount(imagefile).mount()
+        swapped = time.monotonic()
+        # The previous image is not mounted anymore.
+        for name in SLOT_NAMES + (_LEGACY_NAME,):
+            path = safe_join(config.mount_images_dir, name)
+            if path != imagefile:
+                MountImage(path).delete()
+        _last_quickmount = {
+            "adf": os.path.basename(adf_path),
+            "image": os.path.basename(imagefile),
+            "build_time": built - started,
+            "mount_gap": swapped - built,
+        }
+        print("quickmounted '{}' in {:.3f}s with {:.3f}s mount gap".format(
+            adf_path, swapped - started, swapped - built), file=sys.stderr)
+        return dict(_last_quickmount)
+
+
+def last_quickmount():
+    '''Returns: a dict with the stats of the last quickmount or None
+    if there was none since the start.
+    '''
+    with _quickmount_lock:
+        return dict(_last_quickmount) if _last_quickmount else None
@@ -1,36 +1,59 @@
 import os
 
-from flask import Blueprint
+from flask import jsonify, Blueprint
 from werkzeug.utils import safe_join
 
-from adfotg import adf
-from adfotg.apiutil import apierr
+from adfotg import quickmount
+from adfotg.apiutil import apierr, run_job
 from adfotg.config import config
-from adfotg.mount import Mount, MountStatus
-from adfotg.mountimg import MountImage
 
 
 api = Blueprint("quickmount", __name__, url_prefix="/quickmount")
 
 
+@api.route("", methods=["GET"])
+def get_last_quickmount():
+    '''Get the stats of the last quickmount.
+
+    Returns: QuickmountStats object or null if nothing was quickmounted
+    since adfotg started.
+    '''
+    return jsonify(quickmount.last_quickmount())
+
+
 @api.route("/adf/<name>", methods=["POST"])
 def quickmount_adf(name):
     '''Just mount a specified, single ADF.
 
     This performs following steps in one go:
 
-    1. Unmounts any mount image if already mounted.
-    2. Creates a new temporary mount image. This image is
-       created in the normal directory for the mount images
-       but is always named .QUICKMOUNT.
+    1. Creates a new temporary mount image. There are two such images,
+       used in turns, created in the normal directory for the mount
+       images and always named .QUICKMOUNT.A and .QUICKMOUNT.B.
+       The new image is created in the one that is not mounted,
+       so the currently mounted image stays available until
+       the new one is ready.
 
        The contents of the image include all standard ADFs
        as listed by the /adf_std endpoint, and the selected ADF.
+       The standard ADFs are not packed each time; the image is
+       cloned from a template that already contains them.
+    2. Unmounts any mount image if already mounted and mounts
+       the new temporary mount image.
+    3. Deletes the other temporary mount image.
 
-       2.1. Old temporary mount image is deleted, if there is any.
-    3. Mounts this temporary mount image.
+    Query args:
+    - async -- optional; if 1, the quickmount runs as a background job
+      and the response is 202 with the Job object, see GET /jobs/<id>
 
-    Returns: nothing if successful
+    Returns: QuickmountStats object: {
+      adf: string; name of the mounted ADF
+      image: string; name of the mounted temporary mount image
+      build_time: number; seconds it took to create the image
+      mount_gap: number; seconds between the unmount of the old image
+          and the mount of the new one, when no image was available
+          to the host
+    }
 
     Errors:
     - 404 -- if the ADF is not found
@@ -38,20 +61,5 @@ def quickmount_adf(name):
     adf_path = safe_join(config.adf_dir, name)
     if not os.path.isfile(adf_path):
         return apierr(404, "ADF '{}' cannot be found".format(name))
-    old_mount = Mount.current()
-    if old_mount.state() == MountStatus.Mounted:
-        old_mount.unmount()
-    img = _quickmount_image()
-    if img.exists():
-        img.delete()
-    os.makedirs(os.path.dirname(img.imagefile), exist_ok=True)
-    img.pack(
-        [safe_join(config.adf_dir, n) for n in adf.list_standard_adfs()]
-        + [adf_path])
-    img_mount = Mount(img.imagefile)
-    img_mount.mount()
-    return ""
-
-
-def _quickmount_image():
-    return MountImage(safe_join(config.mount_images_dir, ".QUICKMOUNT"))
+    return run_job("quickmount", lambda progress: quickmount.quickmount(
+        adf_path, progress), jsonify)
@@ -54,14 +54,16 @@ def _check_rpi():
 
 @_catch_error
 def _check_mass_storage():
-    if 0 != _call(['modinfo', 'g_mass_storage']):
-        return 'g_mass_storage Kernel module not found'
+    module = ('libcomposite' if config.mounter == 'configfs'
+              else 'g_mass_storage')
+    if 0 != _call(['modinfo', module]):
+        return '{} Kernel module not found'.format(module)
     return ''
 
 
 @_catch_error
 def _check_mtools():
-    commands = ['mdir', 'mcopy', 'mkdosfs']
+    commands = ['mcopy', 'mkdosfs']
     return _check_commands(commands)
 
 
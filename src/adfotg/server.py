@@ -1,19 +1,54 @@
 from . import app
 from .error import ActionError
 
-from flask import abort, jsonify, send_from_directory
+from flask import abort, jsonify, request, send_from_directory
 from werkzeug.exceptions import InternalServerError, NotFound
 
+import mimetypes
 import os
+import re
+
+_WEBUI_DIR = os.path.join(app.root_path, "webui")
+
+# Precompressed siblings of the web UI files made by the web UI build,
+# in the order of preference: (Content-Encoding, file suffix).
+_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+# Vite puts a hash of the contents in the names of the built assets,
+# so they can be cached forever.
+_HASHED_ASSET = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$')
+_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _scan_precompressed(webui_dir):
+    '''Returns: a dict of the web UI file paths to the set of encodings
+    in which they are available precompressed.
+    '''
+    precompressed = {}
+    for dirpath, _, names in os.walk(webui_dir):
+        for name in names:
+            for encoding, suffix in _ENCODINGS:
+                if name.endswith(suffix):
+                    path = os.path.relpath(
+                        os.path.join(dirpath, name[:-len(suffix)]), webui_dir)
+                    path = path.replace(os.sep, "/")
+                    precompressed.setdefault(path, set()).add(encoding)
+    return precompressed
+
+
+# The web UI is installed together with the app, so it's looked up only
+# once at startup.
+_HAS_WEBUI = os.path.isdir(_WEBUI_DIR)
+_PRECOMPRESSED = _scan_precompressed(_WEBUI_DIR) if _HAS_WEBUI else {}
 
 
 @app.route('/', defaults={'path': 'index.html'})
 @app.route('/<path:path>')
 def serve_file(path):
     try:
-        if os.path.isdir(os.path.join(app.root_path, "webui")):
+        if _HAS_WEBUI:
             # This is valid for deployment.
-            return send_from_directory("webui", path)
+            return _send_webui_file(path)
         else:
             return abort(404)
     except NotFound as e:
@@ -24,6 +59,39 @@ def serve_file(path):
             raise
 
 
+def _send_webui_file(path):
+    available = _PRECOMPRESSED.get(path, ())
+    encoding = _negotiate_encoding(available)
+    if encoding is None:
+        response = send_from_directory(_WEBUI_DIR, path)
+    else:
+        suffix = dict(_ENCODINGS)[encoding]
+        mimetype = (mimetypes.guess_type(path)[0]
+                    or "application/octet-stream")
+        response = send_from_directory(
+            _WEBUI_DIR, path + suffix, mimetype=mimetype,
+            download_name=os.path.basename(path))
+        response.headers["Content-Encoding"] = encoding
+    if available:
+        response.vary.add("Accept-Encoding")
+    if _HASHED_ASSET.match(path):
+        response.headers["Cache-Control"] = _IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def _negotiate_encoding(available):
+    '''Returns: the most preferred of the available encodings that
+    the client accepts, or None if the file should be sent as it is.
+    '''
+    best, best_quality = None, 0
+    for encoding, _ in _ENCODINGS:
+        if encoding in available:
+            quality = request.accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+    return best
+
+
 @app.route('/inspect/mountimg/<path:path>')
 @app.route('/upload')
 def serve_sites(*args, **kwargs):
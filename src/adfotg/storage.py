@@ -1,11 +1,17 @@
+from . import index, watcher
+from .error import AdfotgError
 from .util import Interpretable
 
 from collections import namedtuple
 from enum import Enum
+import fcntl
 import fnmatch
 import os
 import re
 
+# ioctl that makes the file share the blocks of another file.
+_FICLONE = 0x40049409
+
 
 class FileEntryField(Interpretable, Enum):
     NAME = "name"
@@ -29,26 +35,55 @@ class Direction(Interpretable, Enum):
         return self == self.ASCENDING
 
 
-def listdir(dirpath, name_filter=None, sort=None):
-    '''
+def query(dirpath, name_pattern=None, sort=None, start=None, limit=None):
+    '''Listing of the files in the directory.
+
+    The zones are listed from the watcher's views in the file index;
+    other directories are scanned.
+
+    name_pattern -- files are listed only if their name contains this
+      string, case-insensitive; None lists all files
     sort -- tuple of (FileEntryField, Direction) enums or None
+    start -- index of the first listed file
+    limit -- maximum amount of listed files
+
+    Returns: a tuple of a list of FileEntry dicts and the total amount
+    of files matching the name_pattern.
+    '''
+    field, direction = sort or (FileEntryField.NAME, Direction.ASCENDING)
+    field = FileEntryField.interpret(field)
+    direction = Direction.interpret(direction)
+    if name_pattern:
+        name_pattern = name_pattern.lower()
+    kwargs = dict(name_pattern=name_pattern, sort_field=field.value,
+                  ascending=direction.is_ascending(), start=start, limit=limit)
+    result = watcher.get_watcher().query(dirpath, **kwargs)
+    if result is None:
+        # Not a watched zone.
+        result = _scan(dirpath).query(**kwargs)
+    rows, total = result
+    return [FileEntryField.dictify(*row) for row in rows], total
+
+
+def stat(dirpath, name):
+    '''Returns: the FileEntry dict of the file in the directory,
+    or None if there's no such file.
     '''
-    if name_filter is None:
-        name_filter = _true
-    files = [entry for entry in os.scandir(dirpath) if entry.is_file()]
-    files = [
-        _fileentry_to_dict(entry)
-        for entry in files
-        if name_filter(entry.name)
-    ]
-    if sort:
-        field, direction = sort
-        field = FileEntryField.interpret(field)
-        direction = Direction.interpret(direction)
-        files = list(sorted(files,
-                            key=lambda f: _case_insensitive(f[field.value]),
-                            reverse=not direction.is_ascending()))
-    return files
+    row = watcher.get_watcher().stat(dirpath, name)
+    if row is False:
+        row = _scan(dirpath).stat(name)
+    return FileEntryField.dictify(*row) if row is not None else None
+
+
+def changed(dirpath, name):
+    '''Notify that the file in the directory was modified in place.'''
+    watcher.get_watcher().changed(dirpath, name)
+
+
+def _scan(dirpath):
+    view = watcher.ZoneView(dirpath, index.FileIndex())
+    view.load()
+    return view
 
 
 def find(dirpath, pattern, case_sensitive=True):
@@ -74,6 +109,55 @@ def unlink(filepath, optional=False):
             raise
 
 
+def allocate(f, size, preallocate=False):
+    '''Resize the open file to the size without writing anything.
+
+    The file stays sparse where the file-system supports it, unless
+    preallocate is set; then the disk space is reserved up front and
+    running out of it fails here instead of in a later write.
+    '''
+    f.truncate(size)
+    if preallocate:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError as e:
+            raise AdfotgError("cannot preallocate {} bytes for '{}': {}".format(
+                size, f.name, e.strerror)) from e
+
+
+def clone(srcpath, dstpath):
+    '''Copy the file, sharing its blocks copy-on-write where the
+    file-system supports reflinks. Otherwise only the data is copied
+    and the holes of a sparse file stay holes.
+    '''
+    with open(srcpath, 'rb') as src, open(dstpath, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+        size = os.fstat(src.fileno()).st_size
+        dst.truncate(size)
+        offset = 0
+        while offset < size:
+            try:
+                start = os.lseek(src.fileno(), offset, os.SEEK_DATA)
+            except OSError:
+                # No data past the offset.
+                break
+            end = os.lseek(src.fileno(), start, os.SEEK_HOLE)
+            src.seek(start)
+            dst.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+            offset = end
+
+
 def mount_point(path):
     if path:
         path = os.path.realpath(path)
@@ -90,16 +174,3 @@ def fs_stats(path):
     return FsStats(path,
                    stat.f_bsize * stat.f_blocks,
                    stat.f_bsize * stat.f_bavail)
-
-
-def _fileentry_to_dict(entry):
-    stat = entry.stat()
-    return FileEntryField.dictify(entry.name, stat.st_size, int(stat.st_mtime))
-
-
-def _true(*args, **kwargs):
-    return True
-
-
-def _case_insensitive(what):
-    return what.lower() if isinstance(what, str) else what
@@ -0,0 +1,199 @@
+'''Streaming upload of files into the zones.
+
+The multipart body is parsed as it's read from the request stream,
+without letting werkzeug spool it to a temporary file first. (The
+server may have buffered the body already; waitress keeps bodies
+of up to 512 KiB in memory and spools bigger ones to a temporary
+file.) Each file is written into a hidden temporary file in the zone
+where it belongs, and is renamed to its name when it's complete. The zone
+is chosen as soon as the first bytes of the file arrive. A file goes
+to the ADF library if it starts with an AmigaDOS boot block, if its
+part of the body has a Content-Length of a standard ADF size, or,
+failing both, if it's not empty and has the .adf extension. All other
+files go to the upload zone.
+
+The files are hashed in the same pass and, if they are ADFs, their
+disk label is read from the root block as it goes by. Both are
+reported back to the client. The zone watcher sees the files when
+they are renamed, so nothing needs to be rescanned.
+'''
+import hashlib
+import os
+import secrets
+
+from werkzeug.sansio.multipart import (
+    Data, Epilogue, Field, File, MultipartDecoder, NeedData)
+from werkzeug.utils import safe_join
+
+from adfotg import adf
+from adfotg.config import config
+from adfotg.error import ActionError
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadedFile:
+    def __init__(self, name, length=None):
+        self.name = name
+        self.dirpath = None
+        self.size = 0
+        # Content-Length of the file's part, if the client has sent it.
+        self._length = length
+        # The first bytes, held until there are enough to classify
+        # the file.
+        self._head = b""
+        self._hash = hashlib.sha1()
+        self._file = None
+        self._tmppath = None
+        # Root blocks of the standard ADF sizes, captured on the way.
+        self._root_blocks = {
+            offset: bytearray()
+            for offset in (adf.root_block_offset(adf.ADF_SIZE),
+                           adf.root_block_offset(adf.ADF_HD_SIZE))
+        }
+
+    @property
+    def checksum(self):
+        return self._hash.hexdigest()
+
+    @property
+    def label(self):
+        offset = adf.root_block_offset(self.size)
+        if offset is None:
+            return None
+        return adf.read_label(bytes(self._root_blocks[offset]))
+
+    @property
+    def zone(self):
+        return "adf" if self.dirpath == config.adf_dir else "upload"
+
+    def write(self, data):
+        if not data:
+            return
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._head += data
+            if len(self._head) >= adf.DOS_MAGIC_SIZE:
+                self._open_classified()
+        self._hash.update(data)
+        for offset, block in self._root_blocks.items():
+            start = max(offset, self.size)
+            end = min(offset + adf.BLOCK_SIZE, self.size + len(data))
+            if start < end:
+                block += data[start - self.size:end - self.size]
+        self.size += len(data)
+
+    def finish(self):
+        '''Move the complete file under its name.'''
+        if self._file is None:
+            self._open_classified()
+        self._file.close()
+        self._file = None
+        os.replace(self._tmppath, self._dest_path())
+        self._tmppath = None
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmppath is not None:
+            try:
+                os.unlink(self._tmppath)
+            except FileNotFoundError:
+                pass
+            self._tmppath = None
+
+    def info(self):
+        '''Returns: an UploadedFile dict as described by the upload API.'''
+        return {
+            "name": self.name,
+            "zone": self.zone,
+            "size": self.size,
+            "checksum": self.checksum,
+            "label": self.label,
+        }
+
+    def _is_adf(self):
+        if adf.is_dos_boot_block(self._head):
+            return True
+        if self._length in (adf.ADF_SIZE, adf.ADF_HD_SIZE):
+            return True
+        # Empty files are never ADFs.
+        return bool(self._head) and adf.is_adf_name(self.name)
+
+    def _open_classified(self):
+        self._open(config.adf_dir if self._is_adf() else config.upload_dir)
+        self._file.write(self._head)
+        self._head = b""
+
+    def _open(self, dirpath):
+        self.dirpath = dirpath
+        self._dest_path()  # validate before anything is written
+        os.makedirs(dirpath, exist_ok=True)
+        # Not mkstemp(), which would make the file readable only
+        # by its owner; the umask applies as to any other file.
+        self._tmppath = os.path.join(
+            dirpath, ".upload-{}".format(secrets.token_hex(8)))
+        fd = os.open(self._tmppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                     0o666)
+        self._file = os.fdopen(fd, 'wb')
+
+    def _dest_path(self):
+        path = safe_join(self.dirpath, self.name)
+        if path is None or not self.name:
+            raise ActionError("invalid file name '{}'".format(self.name))
+        return path
+
+
+def receive(stream, boundary):
+    '''Receive the files from a multipart/form-data body. As in the web
+    UI's requests, the files are named by their form field names.
+
+    Returns: a list of UploadedFile objects, in the order in which
+    they were received.
+    '''
+    decoder = MultipartDecoder(boundary.encode("latin-1"))
+    uploaded = []
+    current = None
+    try:
+        ended = False
+        while not ended:
+            chunk = stream.read(CHUNK_SIZE)
+            # The decoder waits for the end of the body to be sure
+            # that the last boundary is complete.
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    current = UploadedFile(event.name,
+                                           _part_length(event.headers))
+                elif isinstance(event, Field):
+                    current = None
+                elif isinstance(event, Data) and current is not None:
+                    current.write(event.data)
+                    if not event.more_data:
+                        current.finish()
+                        uploaded.append(current)
+                        current = None
+                event = decoder.next_event()
+            ended = isinstance(event, Epilogue)
+            if not ended and not chunk:
+                raise ActionError("the upload has ended prematurely")
+    except ValueError as e:
+        # The decoder's complaints about a malformed or cut off body.
+        if not chunk:
+            raise ActionError("the upload has ended prematurely") from e
+        raise ActionError("invalid upload: {}".format(e)) from e
+    finally:
+        # Files received before an error are kept.
+        if current is not None:
+            current.abort()
+    return uploaded
+
+
+def _part_length(headers):
+    try:
+        return int(headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
@@ -1,12 +1,12 @@
 import os
-import shutil
 
 from flask import jsonify, request, send_from_directory, Blueprint
 from werkzeug.utils import safe_join
 
-from adfotg import adf, storage
 from adfotg.apiutil import Listing, del_files
 from adfotg.config import config
+from adfotg.error import ActionError
+from adfotg.upload import receive
 
 
 api = Blueprint("upload", __name__, url_prefix="/upload")
@@ -18,20 +18,33 @@ def upload():
 
     This is a "smart" function. It accepts file uploads and tries to
     organize them. It expects files to be uploaded using the HTTP
-    standard "multipart/form-data" format. The uploaded files are
-    analyzed to see if they can be identified as ADFs. ADFs are then
-    stored in the ADF library, while all other files are moved to the
-    upload zone.
+    standard "multipart/form-data" format, with each file named by its
+    form field name. The files are stored as they are received: ADFs
+    go straight to the ADF library, while all other files go to the
+    upload zone. A file is an ADF if it starts with an AmigaDOS boot
+    block, if its part has a Content-Length of 901120 or 1802240 bytes,
+    or otherwise if it's not empty and has the .adf extension.
+
+    Returns: a list of objects, one for each uploaded file: {
+      name: string; file name
+      zone: string; adf or upload
+      size: int; size in bytes
+      checksum: string; SHA-1 of the file as a hex string
+      label: string or null; disk label if this is an AmigaDOS ADF
+    }
 
+    Errors:
+    - 400 -- the request is not multipart/form-data, it's malformed or
+      incomplete, or a file name is invalid; files received before
+      the error are kept
     '''
-    os.makedirs(config.upload_dir, exist_ok=True)
-    for filename, file in request.files.items():
-        dest_path = safe_join(config.upload_dir, filename)
-        file.save(dest_path)
-        if adf.is_adf_path(dest_path):
-            os.makedirs(config.adf_dir, exist_ok=True)
-            shutil.move(dest_path, safe_join(config.adf_dir, filename))
-    return ""
+    if request.mimetype != "multipart/form-data" or \
+            "boundary" not in request.mimetype_params:
+        raise ActionError("expected a multipart/form-data upload")
+    # Read the body directly, not through request.files, so that
+    # the files are not spooled to a temporary file first.
+    uploaded = receive(request.stream, request.mimetype_params["boundary"])
+    return jsonify([file.info() for file in uploaded])
 
 
 @api.route("", methods=['GET'])
@@ -58,12 +71,7 @@ def list_uploads():
 
     '''
     listing = Listing(request)
-    full_list = storage.listdir(config.upload_dir,
-                                name_filter=listing.filter_name,
-                                sort=listing.sorting)
-    return jsonify(
-        listing=listing.limit(full_list),
-        total=len(full_list))
+    return listing.response(config.upload_dir)
 
 
 @api.route("", methods=["DELETE"])
@@ -0,0 +1,402 @@
+'''Change feed of the app's zones.
+
+The watcher keeps a view of the files in each zone, stored in the file
+index, and updates it as the files are added, removed or renamed, also by
+programs other than adfotg, like scp or Samba. On Linux the changes
+are reported by inotify; elsewhere, or if inotify is not available,
+the zones are polled by checking the mtimes of their directories.
+
+Every change bumps the change sequence number. Each zone also has its
+own generation number, which is the sequence number of its last
+change. Clients can poll these numbers to learn if anything
+has changed, or get a 'zone' event with them pushed as it happens.
+'''
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from stat import S_ISREG
+
+from adfotg import events, index
+from adfotg.config import config
+
+POLL_INTERVAL = 2.0
+
+# Names of the temporary files and dirs that adfotg makes in the zones.
+TEMP_PREFIXES = (".upload-", ".batch-")
+
+
+class ZoneView:
+    '''Listing of the files in a directory, kept in the file index.
+
+    The temporary files of adfotg are left out: the uploads in progress
+    and the work dirs of the ADF batches.
+    '''
+    def __init__(self, dirpath, file_index):
+        self.dirpath = dirpath
+        self.generation = 0
+        self._index = file_index
+        self._dir_mtime = None
+
+    def load(self, rescan=True):
+        '''Scan the directory into the index; without rescan, only if
+        the directory has changed since the index was last complete.
+        '''
+        dir_mtime = os.stat(self.dirpath).st_mtime_ns
+        if not rescan and self._index.dir_mtime(self.dirpath) == dir_mtime:
+            self._dir_mtime = dir_mtime
+            return
+        rows = []
+        for entry in os.scandir(self.dirpath):
+            if entry.is_file() and not _is_temporary(entry.name):
+                rows.append(_row(entry.name, entry.stat()))
+        self._index.replace(self.dirpath, rows)
+        self.checkpoint(dir_mtime)
+
+    def checkpoint(self, dir_mtime):
+        '''Remember that the index has all the changes made to the
+        directory up to when it had this mtime.
+        '''
+        if dir_mtime != self._dir_mtime:
+            self._dir_mtime = dir_mtime
+            self._index.set_dir_mtime(self.dirpath, dir_mtime)
+
+    def update(self, name):
+        '''Re-stat the file; returns True if the view has changed.'''
+        if _is_temporary(name):
+            return False
+        try:
+            stat = os.stat(os.path.join(self.dirpath, name))
+        except FileNotFoundError:
+            row = None
+        else:
+            row = _row(name, stat) if S_ISREG(stat.st_mode) else None
+        if row is None:
+            return self.remove(name)
+        if self._index.get(self.dirpath, name) == row:
+            return False
+        self._index.put(self.dirpath, row)
+        return True
+
+    def remove(self, name):
+        return self._index.delete(self.dirpath, name)
+
+    def names(self):
+        return self._index.names(self.dirpath)
+
+    def query(self, *args, **kwargs):
+        '''Query the files in the view, without touching the filesystem;
+        see FileIndex.query().
+        '''
+        return self._index.query(self.dirpath, *args, **kwargs)
+
+    def stat(self, name):
+        return self._index.get(self.dirpath, name)
+
+
+class Watcher:
+    def __init__(self, dirpaths):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._views = {dirpath: None for dirpath in dirpaths}
+        self._index = index.open_index()
+        self._backend = _InotifyBackend.create() or _PollingBackend()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def backend_name(self):
+        return self._backend.name
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="zone-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop watching and release the backend and the file index.'''
+        self._stopping.set()
+        self._backend.wake()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._backend.close()
+            self._index.close()
+
+    @property
+    def seq(self):
+        with self._lock:
+            self._sync()
+            return self._seq
+
+    def generations(self):
+        '''Returns: a dict of the zone dirpath to its generation.'''
+        with self._lock:
+            self._sync()
+            return {dirpath: view.generation if view else None
+                    for dirpath, view in self._views.items()}
+
+    def query(self, dirpath, *args, **kwargs):
+        '''Query the zone's view; returns None if the directory is not
+        watched.
+        '''
+        with self._lock:
+            self._sync()
+            view = self._views.get(dirpath)
+            return view.query(*args, **kwargs) if view else None
+
+    def stat(self, dirpath, name):
+        '''Returns: a (name, size, mtime) tuple, None if there's no such
+        file or False if the directory is not watched.
+        '''
+        with self._lock:
+            self._sync()
+            view = self._views.get(dirpath)
+            return view.stat(name) if view else False
+
+    def changed(self, dirpath, name):
+        '''Re-stat the file that was modified in place, unless the backend
+        reports such modifications by itself.
+        '''
+        if self._backend.reports_modifications:
+            return
+        with self._lock:
+            view = self._views.get(dirpath)
+            if view is not None and view.update(name):
+                self._bump(dirpath)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Sync first, as the directories are watched only once
+            # they are attached.
+            with self._lock:
+                self._sync()
+            self._backend.wait()
+
+    def _sync(self):
+        for dirpath, view in self._views.items():
+            if view is None:
+                self._attach(dirpath, rescan=False)
+        # Taken before the changes are read, the mtimes cover only
+        # the changes that are read below.
+        dir_mtimes = {}
+        for dirpath, view in self._views.items():
+            try:
+                dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                pass
+        for dirpath, name in self._backend.changes(self._views):
+            view = self._views.get(dirpath)
+            if view is None:
+                continue
+            if name is None:
+                # The whole directory has changed or is gone.
+                self._views[dirpath] = None
+                dir_mtimes.pop(dirpath, None)
+                self._attach(dirpath)
+                self._bump(dirpath)
+            elif view.update(name):
+                self._bump(dirpath)
+        for dirpath, dir_mtime in dir_mtimes.items():
+            view = self._views.get(dirpath)
+            if view is not None:
+                view.checkpoint(dir_mtime)
+
+    def _attach(self, dirpath, rescan=True):
+        if not os.path.isdir(dirpath):
+            return
+        try:
+            self._backend.watch(dirpath)
+            view = ZoneView(dirpath, self._index)
+            view.load(rescan)
+        except OSError as e:
+            print("cannot watch '{}': {}".format(dirpath, e), file=sys.stderr)
+            return
+        self._views[dirpath] = view
+        self._bump(dirpath)
+
+    def _bump(self, dirpath):
+        self._seq += 1
+        view = self._views.get(dirpath)
+        if view is not None:
+            view.generation = self._seq
+        for zone, zone_dirpath in zone_dirs().items():
+            if zone_dirpath == dirpath:
+                events.publish("zone", {"zone": zone, "seq": self._seq})
+
+
+class _InotifyBackend:
+    name = "inotify"
+    reports_modifications = True
+
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    _MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+             | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    _EVENT = struct.Struct("iIII")
+
+    @classmethod
+    def create(cls):
+        '''Returns: the backend or None if inotify is not available.'''
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return cls(libc, fd)
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self._fd = fd
+        self._dirs = {}
+        # Written to by wake() to end wait().
+        self._wake_r, self._wake_w = os.pipe()
+
+    def watch(self, dirpath):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(dirpath), self._MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), dirpath)
+        self._dirs[wd] = dirpath
+
+    def wait(self):
+        select.select([self._fd, self._wake_r], [], [])
+
+    def wake(self):
+        os.write(self._wake_w, b"\0")
+
+    def close(self):
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            os.close(fd)
+
+    def changes(self, views):
+        '''Yields (dirpath, name) tuples of the changed files. The name
+        is None if the whole directory must be reloaded.
+        '''
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = self._EVENT.unpack_from(buf, offset)
+                offset += self._EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    for dirpath in views:
+                        yield dirpath, None
+                    continue
+                dirpath = self._dirs.get(wd)
+                if dirpath is None:
+                    continue
+                if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF
+                           | self.IN_IGNORED):
+                    # Watch the directory again by its path.
+                    if mask & self.IN_MOVE_SELF:
+                        self._libc.inotify_rm_watch(self._fd, wd)
+                    del self._dirs[wd]
+                    yield dirpath, None
+                elif not mask & self.IN_ISDIR:
+                    yield dirpath, os.fsdecode(name)
+
+
+class _PollingBackend:
+    name = "polling"
+    # Only the directories' mtimes are polled, and they don't change
+    # when a file is modified in place.
+    reports_modifications = False
+
+    def __init__(self):
+        self._mtimes = {}
+        self._wakeup = threading.Event()
+
+    def watch(self, dirpath):
+        self._mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+
+    def wait(self):
+        self._wakeup.wait(POLL_INTERVAL)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def close(self):
+        pass
+
+    def changes(self, views):
+        for dirpath, old_mtime in list(self._mtimes.items()):
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except FileNotFoundError:
+                del self._mtimes[dirpath]
+                yield dirpath, None
+                continue
+            if mtime != old_mtime:
+                self._mtimes[dirpath] = mtime
+                yield from self._diff(dirpath, views.get(dirpath))
+
+    def _diff(self, dirpath, view):
+        if view is None:
+            return
+        names = set(view.names())
+        for entry in os.scandir(dirpath):
+            names.add(entry.name)
+        for name in names:
+            yield dirpath, name
+
+
+def _is_temporary(name):
+    return name.startswith(TEMP_PREFIXES)
+
+
+def _row(name, stat):
+    return (name, stat.st_size, int(stat.st_mtime))
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def zone_dirs():
+    '''Returns: a dict of the zone names to their directories.'''
+    return {
+        "adf": config.adf_dir,
+        "upload": config.upload_dir,
+        "mountimg": config.mount_images_dir,
+    }
+
+
+def get_watcher():
+    '''Returns: the Watcher of the configured zones; it's started
+    on the first call.
+    '''
+    global _watcher
+    with _watcher_lock:
+        dirpaths = set(zone_dirs().values())
+        if _watcher is None or set(_watcher._views) != dirpaths:
+            if _watcher is not None:
+                _watcher.stop()
+            _watcher = Watcher(dirpaths)
+            _watcher.start()
+            print("watching zones with {}".format(_watcher.backend_name),
+                  file=sys.stderr)
+        return _watcher
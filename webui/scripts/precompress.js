@@ -0,0 +1,46 @@
+// Writes .gz and .br siblings of the built web UI files, so that
+// the server can send them without compressing anything on the Pi.
+import { readdirSync, readFileSync, statSync, writeFileSync } from 'node:fs';
+import { join } from 'node:path';
+import { brotliCompressSync, constants, gzipSync } from 'node:zlib';
+
+const COMPRESSIBLE = /\.(css|html|js|json|map|svg|ttf|txt|xml)$/i;
+// Smaller files are not worth the extra request header.
+const MIN_SIZE = 1024;
+
+function* walk(dir) {
+	for (const name of readdirSync(dir)) {
+		const path = join(dir, name);
+		if (statSync(path).isDirectory())
+			yield* walk(path);
+		else
+			yield path;
+	}
+}
+
+const root = process.argv[2];
+if (!root) {
+	console.error("usage: precompress.js <dir>");
+	process.exit(2);
+}
+for (const path of walk(root)) {
+	if (!COMPRESSIBLE.test(path))
+		continue;
+	const data = readFileSync(path);
+	if (data.length < MIN_SIZE)
+		continue;
+	const variants = [
+		[".gz", gzipSync(data, { level: 9 })],
+		[".br", brotliCompressSync(data, {
+			params: {
+				[constants.BROTLI_PARAM_QUALITY]: constants.BROTLI_MAX_QUALITY,
+				[constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+			},
+		})],
+	];
+	for (const [suffix, compressed] of variants) {
+		// Keep only the variants that actually save something.
+		if (compressed.length < data.length)
+			writeFileSync(path + suffix, compressed);
+	}
+}
@@ -0,0 +1,27 @@
+export const EventType = {
+	Mount: "mount",
+	Job: "job",
+	Zone: "zone",
+	Resync: "resync",
+} as const
+
+export type EventType = typeof EventType[keyof typeof EventType]
+
+/**
+ * Listen to the server-sent events from /api/events. The `resync`
+ * events are always passed to the listener, as they mean that other
+ * events were lost.
+ *
+ * Returns a function that stops listening.
+ */
+export function listenEvents(types: EventType[],
+		onEvent: (type: EventType, data: any) => void): () => void {
+	const source = new EventSource("/api/events");
+	const listener = (e: MessageEvent) => {
+		onEvent(e.type as EventType, e.data ? JSON.parse(e.data) : null);
+	};
+	for (const type of new Set([...types, EventType.Resync])) {
+		source.addEventListener(type, listener);
+	}
+	return () => source.close();
+}
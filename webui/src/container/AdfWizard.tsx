@@ -138,19 +138,26 @@ export default class AdfWizard extends Component<AdfWizardProps, AdfWizardState>
 
 	private async submitAsync(): Promise<void> {
 		const disks = this.disks.slice();
-		const requests = disks.map(disk => {
-			return request.post("/api/adf/image/" + disk.name + ".adf")
-				.send({label: disk.label, contents: disk.contents});
-		});
-		for (let i = 0; i < requests.length; ++i) {
-			try {
-				await requests[i];
-				disks[i].done = true;
-			} catch (e) {
-				disks[i].error = errorToString(e);
-			}
-			this.setState({disks: this.disks});
+		try {
+			const res = await request.post("/api/adf/batch")
+				.send({disks: disks.map(disk => ({
+					name: disk.name + ".adf",
+					label: disk.label,
+					contents: disk.contents
+				}))});
+			const results: [number, string, string][] = res.body;
+			results.forEach(([code, , error], i) => {
+				if (code == 200) {
+					disks[i].done = true;
+				} else {
+					disks[i].error = error;
+				}
+			});
+		} catch (e) {
+			const error = errorToString(e);
+			disks.forEach(disk => disk.error = error);
 		}
+		this.setState({disks: this.disks});
 	}
 }
 
@@ -1,5 +1,6 @@
 import { Component } from 'react';
 
+import { EventType, listenEvents } from '../app/Events';
 import ImageLibrary from './ImageLibrary';
 import Mount from './Mount';
 
@@ -16,6 +17,9 @@ export default class Home extends Component<HomeProps, HomeState> {
 		refreshSwitch: false,
 	}
 
+	private stopEvents: (() => void) | null = null;
+	private refreshTimer: number | null = null;
+
 	render () {
 		return (
 			<div>
@@ -28,6 +32,28 @@ export default class Home extends Component<HomeProps, HomeState> {
 			</div>);
 	}
 
+	componentDidMount() {
+		this.stopEvents = listenEvents([EventType.Mount, EventType.Zone],
+			() => this.scheduleRefresh());
+	}
+
+	componentWillUnmount() {
+		if (this.stopEvents)
+			this.stopEvents();
+		if (this.refreshTimer !== null)
+			window.clearTimeout(this.refreshTimer);
+	}
+
+	private scheduleRefresh(): void {
+		// Events come in bursts; refresh once per burst.
+		if (this.refreshTimer === null) {
+			this.refreshTimer = window.setTimeout(() => {
+				this.refreshTimer = null;
+				this.promptRefresh();
+			}, 250);
+		}
+	}
+
 	private promptRefresh(): void {
 		this.setState({
 			refreshSwitch: !this.state.refreshSwitch